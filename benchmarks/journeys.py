@@ -0,0 +1,39 @@
+import random
+from typing import Any, Callable, Dict, List, Tuple
+
+from utils.fake_telegram import callback_update, message_update
+
+# A journey is a list of (step name, update factory); a factory gets the
+# simulated user id and the product ids the journey may pick from
+Step = Tuple[str, Callable[[int, List[int]], Dict[str, Any]]]
+
+
+def shopper(rng: random.Random) -> List[Step]:
+    """Browse -> select -> step the quantity -> add -> cart -> checkout -> order history"""
+    state = {}
+
+    def select(user_id, product_ids):
+        state['product_id'] = rng.choice(product_ids)
+        state['quantity'] = rng.randint(2, 5)
+        return callback_update(user_id, f"product:{state['product_id']}")
+
+    return [
+        ("browse", lambda user_id, _: message_update(user_id, "🛍 Mahsulotlar")),
+        ("select", select),
+        ("quantity", lambda user_id, _: callback_update(user_id, f"qty:{state['product_id']}:{state['quantity']}")),
+        ("add", lambda user_id, _: callback_update(user_id, f"add:{state['product_id']}:{state['quantity']}")),
+        ("cart", lambda user_id, _: message_update(user_id, "🧺 Savatni ko'rish")),
+        ("checkout", lambda user_id, _: callback_update(user_id, "checkout")),
+        ("orders", lambda user_id, _: message_update(user_id, "📜 Buyurtmalarim")),
+    ]
+
+
+def admin_price_edit(rng: random.Random) -> List[Step]:
+    """Admin: open the edit list -> pick a product -> change its price"""
+    return [
+        ("admin_menu", lambda user_id, _: message_update(user_id, "/admin")),
+        ("admin_edit_list", lambda user_id, _: message_update(user_id, "✏️ Mahsulotni o'zgartirish")),
+        ("admin_edit_select", lambda user_id, ids: callback_update(user_id, f"edit:{rng.choice(ids)}")),
+        ("admin_edit_option", lambda user_id, _: callback_update(user_id, "option:price")),
+        ("admin_edit_price", lambda user_id, _: message_update(user_id, str(rng.randint(1000, 90000)))),
+    ]
@@ -0,0 +1,153 @@
+"""Benchmark of PDF receipt rendering: receipts per second per core.
+
+Renders synthetic orders (no database or Bot API needed) first directly on
+the event loop, then through receipts.ReceiptRenderer with each --workers
+count. Reports throughput, throughput per worker, latency, text fallbacks
+once the queue limit is reached and the worst event loop lag seen while
+rendering, which is what the other users would wait.
+
+    python -m benchmarks.receipts --receipts 5000 --items 12 --workers 1,2,4
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List
+
+from benchmarks.run import percentile
+
+# Interval of the event loop lag probe, in seconds
+PROBE_INTERVAL = 0.001
+
+
+def make_orders(count: int, items: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    orders = []
+    for order_id in range(1, count + 1):
+        lines = [
+            {
+                'name': f"Mahsulot {rng.randint(1, 5000)} {'premium ' * rng.randint(0, 3)}",
+                'price': Decimal(rng.randint(1000, 90000)),
+                'quantity': rng.randint(1, 5)
+            }
+            for _ in range(items)
+        ]
+        orders.append({
+            'id': order_id,
+            'total': sum(line['price'] * line['quantity'] for line in lines),
+            'created_at': datetime.now(timezone.utc),
+            'items': lines
+        })
+    return orders
+
+
+class LagProbe:
+    """Worst delay of a periodic timer, i.e. how long the loop was blocked"""
+
+    def __init__(self):
+        self.worst = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(PROBE_INTERVAL)
+            self.worst = max(self.worst, time.perf_counter() - started - PROBE_INTERVAL)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def summarize(name: str, latencies: List[float], elapsed: float, workers: int, fallbacks: int, lag: float) -> Dict:
+    rendered = len(latencies)
+    return {
+        'mode': name,
+        'workers': workers,
+        'rendered': rendered,
+        'fallbacks': fallbacks,
+        'receipts_per_s': round(rendered / elapsed, 1),
+        'receipts_per_s_per_core': round(rendered / elapsed / workers, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else '-',
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else '-',
+        'max_loop_lag_ms': round(lag * 1000, 2)
+    }
+
+
+async def inline(orders: List[Dict]) -> Dict:
+    """Render on the event loop, the way not to do it"""
+    from utils.receipt_pdf import render_receipt_pdf
+
+    latencies = []
+    with LagProbe() as probe:
+        started = time.perf_counter()
+        for order in orders:
+            began = time.perf_counter()
+            items = [(item['name'], item['price'], item['quantity']) for item in order['items']]
+            render_receipt_pdf(order['id'], order['created_at'], order['total'], items, "Xaridor")
+            latencies.append(time.perf_counter() - began)
+            # Let the probe run between receipts, like between updates
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+    return summarize("inline", latencies, elapsed, 1, 0, probe.worst)
+
+
+async def pooled(orders: List[Dict], workers: int, queue_limit: int, concurrency: int) -> Dict:
+    from receipts import ReceiptRenderer
+
+    renderer = ReceiptRenderer(workers=workers, queue_limit=queue_limit)
+    await renderer.start()
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def checkout(order):
+        async with slots:
+            began = time.perf_counter()
+            if await renderer.render(order, "Xaridor") is not None:
+                latencies.append(time.perf_counter() - began)
+
+    try:
+        with LagProbe() as probe:
+            started = time.perf_counter()
+            await asyncio.gather(*(checkout(order) for order in orders))
+            elapsed = time.perf_counter() - started
+    finally:
+        await renderer.close()
+    return summarize("pool", latencies, elapsed, workers, renderer.fallbacks, probe.worst)
+
+
+async def benchmark(args) -> List[Dict]:
+    orders = make_orders(args.receipts, args.items, args.seed)
+    reports = [await inline(orders)]
+    for workers in args.workers:
+        reports.append(await pooled(orders, workers, args.queue_limit, args.concurrency))
+    return reports
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=10, help="lines per order")
+    parser.add_argument('--workers', type=lambda value: [int(n) for n in value.split(',')], default=[1, 2], help="comma separated worker counts")
+    parser.add_argument('--concurrency', type=int, default=64, help="checkouts waiting for a receipt at once")
+    parser.add_argument('--queue-limit', type=int, default=1_000_000, help="RECEIPT_QUEUE_LIMIT; lower it to see fallbacks")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    reports = asyncio.run(benchmark(args))
+    print(f"\n{args.receipts} receipts of {args.items} items\n")
+    print(f"{'mode':<8}{'workers':>8}{'rendered':>10}{'fallback':>10}{'per s':>10}{'per core':>10}{'p50 ms':>9}{'p99 ms':>9}{'loop lag ms':>13}")
+    for r in reports:
+        print(
+            f"{r['mode']:<8}{r['workers']:>8}{r['rendered']:>10}{r['fallbacks']:>10}{r['receipts_per_s']:>10}"
+            f"{r['receipts_per_s_per_core']:>10}{r['p50_ms']:>9}{r['p99_ms']:>9}{r['max_loop_lag_ms']:>13}"
+        )
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,213 @@
+"""Offline end-to-end benchmark of the bot's handlers.
+
+Runs the real dispatcher from main.py against utils/fake_telegram.py's fake
+Bot API and the database configured by DB_* (use a scratch database: the
+run seeds products and places orders; with DB_BACKEND=sqlite and a
+throwaway SQLITE_PATH it needs no external services). Thousands of
+simulated users go through scripted journeys concurrently; the report shows
+throughput, p50/p95/p99 latency per step and database queries and Bot API
+calls per journey.
+
+    python -m benchmarks.run --users 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+# Settings must be in place before config.py is imported through main
+FAKE_TOKEN = "123456:BENCHMARK-TOKEN-not-a-real-one-000000"
+ADMIN_BASE_ID = 900_000_000
+USER_BASE_ID = 1_000_000_000
+
+
+class StepCounter:
+    """DB queries made while a step is being handled"""
+    __slots__ = ('queries',)
+
+    def __init__(self):
+        self.queries = 0
+
+
+# Counter of the step running in the current task
+current_step: contextvars.ContextVar[Optional[StepCounter]] = contextvars.ContextVar('current_step', default=None)
+
+
+def _count_query(record) -> None:
+    # Called in the context of the querying task: directly by on_execute,
+    # through call_soon (which copies the context) for query loggers
+    counter = current_step.get()
+    if counter is not None:
+        counter.queries += 1
+
+
+async def attach_query_counter(conn) -> None:
+    # asyncpg's query loggers see every query, named statements included;
+    # SQLite connections only have on_execute
+    if hasattr(conn, 'add_query_logger'):
+        conn.add_query_logger(_count_query)
+    else:
+        conn.on_execute = _count_query
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, int] = Counter()
+        self.errors: Dict[str, int] = Counter()
+        self.journeys = 0
+
+    def report(self, elapsed: float, api_calls: Counter) -> Dict:
+        updates = sum(len(values) for values in self.latencies.values())
+        steps = {
+            name: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'queries_per_update': round(self.queries[name] / len(values), 2),
+                'errors': self.errors[name]
+            }
+            for name, values in self.latencies.items()
+        }
+        return {
+            'journeys': self.journeys,
+            'updates': updates,
+            'elapsed_s': round(elapsed, 2),
+            'updates_per_s': round(updates / elapsed, 1),
+            'journeys_per_s': round(self.journeys / elapsed, 1),
+            'queries_per_journey': round(sum(self.queries.values()) / max(self.journeys, 1), 2),
+            'api_calls_per_journey': round(sum(api_calls.values()) / max(self.journeys, 1), 2),
+            'api_calls': dict(api_calls),
+            'steps': steps
+        }
+
+
+def print_report(report: Dict) -> None:
+    print(f"\n{report['journeys']} journeys, {report['updates']} updates in {report['elapsed_s']} s")
+    print(f"{report['updates_per_s']} updates/s, {report['journeys_per_s']} journeys/s")
+    print(f"{report['queries_per_journey']} DB queries and {report['api_calls_per_journey']} Bot API calls per journey\n")
+    print(f"{'step':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'errors':>8}")
+    for name, step in report['steps'].items():
+        print(
+            f"{name:<20}{step['count']:>8}{step['p50_ms']:>10}{step['p95_ms']:>10}"
+            f"{step['p99_ms']:>10}{step['queries_per_update']:>10}{step['errors']:>8}"
+        )
+
+
+async def run_journey(dp, bot, steps, user_id: int, product_ids: List[int], results: Results) -> None:
+    for name, make_update in steps:
+        update = make_update(user_id, product_ids)
+        counter = StepCounter()
+        token = current_step.set(counter)
+        started = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            results.errors[name] += 1
+        finally:
+            results.latencies[name].append(time.perf_counter() - started)
+            current_step.reset(token)
+        results.queries[name] += counter.queries
+    results.journeys += 1
+
+
+async def seed_products(count: int) -> List[int]:
+    from database.db import get_all_products, import_products
+
+    products = await get_all_products()
+    if len(products) < count:
+        rng = random.Random(0)
+        await import_products(
+            (None, f"Mahsulot {i}", Decimal(rng.randint(1000, 90000)))
+            for i in range(len(products), count)
+        )
+        products = await get_all_products()
+    return [product['id'] for product in products]
+
+
+async def benchmark(args) -> Dict:
+    from aiohttp import web
+    from utils.fake_telegram import FakeTelegramAPI
+
+    api = FakeTelegramAPI(latency=args.api_latency / 1000)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', args.api_port).start()
+
+    import main
+    from benchmarks.journeys import shopper, admin_price_edit
+    from database.db import init_db, migrate_schema
+
+    await init_db(connection_init=attach_query_counter)
+    await migrate_schema()
+    await main.dp.storage.start()
+    await main.receipt_renderer.start()
+
+    try:
+        product_ids = await seed_products(args.products)
+        api.calls.clear()
+
+        rng = random.Random(args.seed)
+        results = Results()
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def journey(index: int):
+            async with slots:
+                if index < args.admins:
+                    await run_journey(main.dp, main.bot, admin_price_edit(rng), ADMIN_BASE_ID + index, product_ids, results)
+                else:
+                    await run_journey(main.dp, main.bot, shopper(rng), USER_BASE_ID + index, product_ids, results)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(journey(index) for index in range(args.admins + args.users)))
+        elapsed = time.perf_counter() - started
+        return results.report(elapsed, api.calls)
+    finally:
+        await main.on_shutdown()
+        await main.bot.session.close()
+        await runner.cleanup()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help="shopper journeys")
+    parser.add_argument('--admins', type=int, default=0, help="admin price-edit journeys")
+    parser.add_argument('--concurrency', type=int, default=100, help="journeys running at once")
+    parser.add_argument('--products', type=int, default=200, help="catalog size to seed")
+    parser.add_argument('--api-port', type=int, default=8099)
+    parser.add_argument('--api-latency', type=float, default=0.0, help="fake Bot API latency in ms")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    os.environ['BOT_TOKEN'] = FAKE_TOKEN
+    os.environ['TELEGRAM_API_URL'] = f"http://localhost:{args.api_port}"
+    os.environ['ADMIN_IDS'] = ','.join(str(ADMIN_BASE_ID + i) for i in range(args.admins))
+    # Journeys send updates back to back, the per-user limit would drop them
+    os.environ['THROTTLE_RATE'] = '1000000'
+    os.environ['THROTTLE_BURST'] = '1000000'
+    if 'config' in sys.modules:
+        sys.exit("benchmarks.run must configure the bot before config.py is imported")
+
+    report = asyncio.run(benchmark(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
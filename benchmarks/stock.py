@@ -0,0 +1,140 @@
+"""Stress test of stock reservation: many buyers racing for one product.
+
+Creates a product with --stock units in the database configured by DB_*
+(use a scratch database) and lets --buyers simulated users add 1-3 units
+to their carts and check out concurrently. Some of them abandon their cart
+instead, and a background task keeps releasing idle reservations so
+checkouts also take the re-reservation path. Fails if anything was
+oversold or lost, and reports throughput and latency.
+
+    python -m benchmarks.stock --buyers 1000 --stock 500 --concurrency 200
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List
+
+from benchmarks.run import percentile
+
+USER_BASE_ID = 2_000_000_000
+
+
+async def stress(args) -> Dict:
+    from database.db import (
+        init_db, migrate_schema, close_db,
+        add_product, delete_product, get_stock, set_stock,
+        add_to_cart, clear_cart, place_order, release_reservations
+    )
+    from database.errors import OutOfStock
+
+    await init_db()
+    await migrate_schema()
+    product_id = await add_product(f"Aksiya {int(time.time())}", Decimal(9900))
+    await set_stock(product_id, args.stock)
+
+    rng = random.Random(args.seed)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    outcomes: Dict[str, int] = defaultdict(int)
+    sold = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def timed(name: str, call):
+        started = time.perf_counter()
+        try:
+            return await call
+        finally:
+            latencies[name].append(time.perf_counter() - started)
+
+    async def buyer(index: int):
+        nonlocal sold
+        user_id = USER_BASE_ID + index
+        quantity = rng.randint(1, 3)
+        abandon = rng.random() < args.abandon
+        async with slots:
+            if not await timed("add_to_cart", add_to_cart(user_id, product_id, quantity)):
+                outcomes['add_refused'] += 1
+                return
+            if abandon:
+                await timed("clear_cart", clear_cart(user_id))
+                outcomes['abandoned'] += 1
+                return
+            try:
+                order = await timed("checkout", place_order(user_id))
+            except OutOfStock:
+                outcomes['checkout_refused'] += 1
+                await clear_cart(user_id)
+                return
+            sold += sum(item['quantity'] for item in order['items'])
+            outcomes['ordered'] += 1
+
+    async def releaser():
+        while True:
+            await asyncio.sleep(args.release_interval / 1000)
+            outcomes['released_lines'] += await release_reservations(0, 1000)
+
+    release_task = asyncio.create_task(releaser()) if args.release_interval else None
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(buyer(index) for index in range(args.buyers)))
+        elapsed = time.perf_counter() - started
+    finally:
+        if release_task is not None:
+            release_task.cancel()
+            try:
+                await release_task
+            except asyncio.CancelledError:
+                pass
+
+    remaining = await get_stock(product_id)
+    await delete_product(product_id)
+    await close_db()
+
+    operations = sum(len(values) for values in latencies.values())
+    return {
+        'buyers': args.buyers,
+        'stock': args.stock,
+        'sold': sold,
+        'remaining': remaining,
+        'consistent': remaining >= 0 and sold + remaining == args.stock,
+        'elapsed_s': round(elapsed, 2),
+        'operations_per_s': round(operations / elapsed, 1),
+        'outcomes': dict(outcomes),
+        'steps': {
+            name: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2)
+            }
+            for name, values in latencies.items()
+        }
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buyers', type=int, default=500)
+    parser.add_argument('--stock', type=int, default=300, help="units of the contested product")
+    parser.add_argument('--concurrency', type=int, default=200, help="buyers running at once")
+    parser.add_argument('--abandon', type=float, default=0.2, help="share of buyers who clear their cart")
+    parser.add_argument('--release-interval', type=float, default=20, help="ms between reservation releases, 0 disables")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    report = asyncio.run(stress(args))
+    print(f"\n{report['buyers']} buyers for {report['stock']} units: "
+          f"{report['sold']} sold, {report['remaining']} left in {report['elapsed_s']} s")
+    print(f"{report['operations_per_s']} operations/s, outcomes: {report['outcomes']}\n")
+    print(f"{'step':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, step in report['steps'].items():
+        print(f"{name:<16}{step['count']:>8}{step['p50_ms']:>10}{step['p95_ms']:>10}{step['p99_ms']:>10}")
+    if not report['consistent']:
+        sys.exit("Stock is inconsistent: sold + remaining does not add up to the initial stock")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -7,6 +7,11 @@ load_dotenv()
 # Bot token from BotFather
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Storage backend: "postgres", or "sqlite" for single-process installs and
+# hermetic benchmark runs, with the path of its database file
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "korzinka.db")
+
 # PostgreSQL Database settings
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
@@ -14,5 +19,94 @@ DB_NAME = os.getenv("DB_NAME", "korzinka")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 
+# Connection pool: size, seconds an idle connection is kept, per-query
+# timeout in seconds (0 disables it) and asyncpg's per-connection statement
+# cache size, which must hold every repository statement
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Number of products per page in catalog keyboards
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "10"))
+
+# Number of orders per page in the order history
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "10"))
+
+# Maximum number of results for inline product search
+INLINE_RESULTS_LIMIT = int(os.getenv("INLINE_RESULTS_LIMIT", "20"))
+
+# Users whose rendered cart is kept in memory (0 disables the cache). Only
+# valid while each user's updates are handled by one process: set it to 0
+# for several webhook replicas behind a load balancer
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", "10000"))
+
+# Per-user rate limit: updates per second and burst size (admins are exempt)
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+
 # Admin user IDs (list of Telegram user IDs who have admin access)
 ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()]
+
+# FSM storage: write-back delay (seconds) used to coalesce state/data writes,
+# lifetime of an untouched state and how often expired states are removed
+FSM_WRITE_DELAY = float(os.getenv("FSM_WRITE_DELAY", "0.05"))
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 60 * 60)))
+FSM_CLEANUP_INTERVAL = int(os.getenv("FSM_CLEANUP_INTERVAL", str(60 * 60)))
+
+# Storage keys whose FSM state is kept in memory, so reading it costs no
+# query (0 disables the cache). Only valid while each user's updates are
+# handled by one process: polling, a single webhook instance or supervisor mode
+FSM_STATE_CACHE_SIZE = int(os.getenv("FSM_STATE_CACHE_SIZE", "10000"))
+
+# Webhook mode: public base URL Telegram posts updates to, path and secret
+# token it must present, local address to listen on and the maximum number
+# of updates processed at the same time
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+
+# Alternative Bot API server, e.g. utils/fake_telegram.py for offline runs
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Supervisor mode: number of worker processes updates are sharded across
+WORKERS = int(os.getenv("WORKERS", "0")) or os.cpu_count() or 1
+
+# Prometheus metrics: handler, query and Bot API timings. Served at /metrics
+# on the webhook port, or on METRICS_PORT in polling mode (supervisor worker
+# N uses METRICS_PORT + 1 + N)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Outgoing message queue (broadcasts, price change notices): messages per
+# second overall, seconds between messages to one chat, messages claimed
+# per batch, seconds between queue polls, delivery attempts before giving
+# up, seconds a claimed batch stays hidden from other senders and seconds
+# between broadcast progress updates
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "30"))
+OUTBOX_CHAT_INTERVAL = float(os.getenv("OUTBOX_CHAT_INTERVAL", "1"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "300"))
+OUTBOX_PROGRESS_INTERVAL = float(os.getenv("OUTBOX_PROGRESS_INTERVAL", "5"))
+
+# Abandoned carts: seconds since a cart last changed before it is deleted,
+# seconds between cleanup runs and cart lines deleted per statement
+CART_TTL = int(os.getenv("CART_TTL", str(7 * 24 * 60 * 60)))
+CART_CLEANUP_INTERVAL = int(os.getenv("CART_CLEANUP_INTERVAL", str(10 * 60)))
+CART_CLEANUP_BATCH = int(os.getenv("CART_CLEANUP_BATCH", "1000"))
+
+# Seconds a cart may sit untouched before the stock it holds is released;
+# checkout reserves it again if it is still available
+STOCK_RESERVATION_TTL = int(os.getenv("STOCK_RESERVATION_TTL", str(30 * 60)))
+
+# PDF receipts: worker processes rendering them per bot process (0 sends text
+# receipts only) and receipts allowed to render or wait for a worker at once;
+# checkouts beyond that get the text receipt instead of waiting
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "1"))
+RECEIPT_QUEUE_LIMIT = int(os.getenv("RECEIPT_QUEUE_LIMIT", "16"))
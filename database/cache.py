@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import CART_CACHE_SIZE
+
+Loader = Callable[[], Awaitable[List[Dict[str, Any]]]]
+
+
+class CatalogCache:
+    """In-process copy of the products table guarded by a version counter.
+
+    Every write to the catalog calls ``invalidate()``, which bumps the version
+    and drops the cached rows. The next read reloads the catalog with a single
+    query. A load that started before an invalidation is returned to its caller
+    but never installed, so a stale snapshot cannot overwrite a newer one.
+    Cached rows are shared between callers and must not be mutated.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._products: Optional[List[Dict[str, Any]]] = None
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._ids: List[int] = []
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._products is not None
+
+    def invalidate(self) -> int:
+        """Drop cached rows and return the new catalog version"""
+        self.version += 1
+        self._products = None
+        self._by_id = {}
+        self._ids = []
+        return self.version
+
+    async def get_all(self, loader: Loader) -> List[Dict[str, Any]]:
+        """Return the ordered catalog, loading it once on a miss"""
+        if self._products is not None:
+            return self._products
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Concurrent misses wait for the first loader instead of all querying
+        async with self._lock:
+            if self._products is not None:
+                return self._products
+
+            version = self.version
+            products = await loader()
+            if version == self.version:
+                self._products = products
+                self._by_id = {product['id']: product for product in products}
+                self._ids = [product['id'] for product in products]
+            return products
+
+    async def get(self, product_id: int, loader: Loader) -> Optional[Dict[str, Any]]:
+        """Return a single product from the cached catalog"""
+        if self._products is None:
+            products = await self.get_all(loader)
+            if self._products is None:
+                # Invalidated while loading, answer from the fresh rows anyway
+                return next((p for p in products if p['id'] == product_id), None)
+        return self._by_id.get(product_id)
+
+    def page(
+        self, after_id: int, before_id: Optional[int], size: int
+    ) -> Tuple[List[Dict[str, Any]], bool, bool]:
+        """Slice a keyset page out of the loaded catalog.
+
+        Returns ``(products, has_prev, has_next)``. Only valid while ``loaded``.
+        """
+        if before_id is not None:
+            end = bisect_left(self._ids, before_id)
+            start = max(end - size, 0)
+        else:
+            start = bisect_right(self._ids, after_id)
+            end = start + size
+        return self._products[start:end], start > 0, end < len(self._ids)
+
+
+class CartCache:
+    """Per-user values derived from the cart (e.g. rendered text), by cart version.
+
+    Cart writes call ``bump(user_id)``. A reader takes ``key(user_id)`` before
+    reading the cart and stores its result with ``put``, which is ignored if
+    the cart or the catalog changed in between. At most ``max_users`` users
+    are kept, least recently used first out.
+
+    Versions are only known to this process, so the cache is only valid
+    while each user's updates are all handled by one process: polling, a
+    single webhook instance or supervisor mode. Carts changed elsewhere
+    must be bumped here too; database.postgres publishes the users whose
+    carts the expiry job deleted, and ``invalidate_all()`` covers
+    changes that may have been missed. Several webhook replicas behind a
+    load balancer change each other's carts unseen: run them with
+    ``max_users=0``, which disables the cache.
+    """
+
+    def __init__(self, catalog: CatalogCache, max_users: int):
+        self.catalog = catalog
+        self.max_users = max_users
+        self._counter = itertools.count(1)
+        # Bumped by invalidate_all, so reads started before it are not stored
+        self._epoch = 0
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        self._entries: "OrderedDict[int, Tuple[Tuple[int, int, int], Any]]" = OrderedDict()
+
+    def key(self, user_id: int) -> Tuple[int, int, int]:
+        """Current (cart version, catalog version, epoch) of a user"""
+        return self._versions.get(user_id, 0), self.catalog.version, self._epoch
+
+    def bump(self, user_id: int) -> None:
+        """Mark the user's cart as changed"""
+        # Globally unique values, so a version forgotten on eviction never comes back
+        self._versions[user_id] = next(self._counter)
+        self._versions.move_to_end(user_id)
+        self._entries.pop(user_id, None)
+        while len(self._versions) > self.max_users * 2:
+            evicted, _ = self._versions.popitem(last=False)
+            self._entries.pop(evicted, None)
+
+    def invalidate_all(self) -> None:
+        """Forget every cached value, e.g. when cart changes may have been missed"""
+        self._epoch += 1
+        self._entries.clear()
+
+    def get(self, user_id: int) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != self.key(user_id):
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: int, key: Tuple[int, int, int], value: Any) -> None:
+        if not self.max_users or key != self.key(user_id):
+            return
+        self._entries[user_id] = (key, value)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            evicted, _ = self._entries.popitem(last=False)
+            self._versions.pop(evicted, None)
+
+
+# Shared caches for this process
+catalog_cache = CatalogCache()
+cart_cache = CartCache(catalog_cache, CART_CACHE_SIZE)
@@ -0,0 +1,9 @@
+from typing import List
+
+
+class OutOfStock(Exception):
+    """Checkout could not reserve enough stock for some cart lines"""
+
+    def __init__(self, names: List[str]):
+        super().__init__(f"Not enough stock for: {', '.join(names)}")
+        self.names = names
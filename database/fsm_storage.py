@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import FSM_WRITE_DELAY, FSM_STATE_TTL, FSM_CLEANUP_INTERVAL, FSM_STATE_CACHE_SIZE
+from database import db
+
+# Marks a field that has no buffered write
+_UNSET = object()
+
+
+class _PendingWrite:
+    """Buffered state/data for one storage key"""
+    __slots__ = ('state', 'data')
+
+    def __init__(self):
+        self.state = _UNSET
+        self.data = _UNSET
+
+
+class DatabaseStorage(BaseStorage):
+    """FSM storage in the fsm_state table, shared by every bot instance.
+
+    Writes are buffered per key for ``write_delay`` seconds and flushed as one
+    batch, so the ``update_data`` + ``set_state`` pair of a handler ends up as
+    a single upsert. Reads see buffered writes before the database. Buffered
+    writes are lost if the process dies before the flush.
+
+    States untouched for ``ttl`` seconds are ignored on read and deleted by
+    the cleanup task started with ``start()``, together with cleared states.
+
+    The middleware reads the state on every update, so states of up to
+    ``state_cache_size`` keys are kept in memory, written through by
+    ``set_state`` and remembered as None when a key has none; only a miss
+    queries the database. This assumes a key's updates are all handled by
+    this process. ``state_cache_size=0`` disables it.
+    """
+
+    def __init__(
+        self,
+        write_delay: float = FSM_WRITE_DELAY,
+        ttl: int = FSM_STATE_TTL,
+        cleanup_interval: int = FSM_CLEANUP_INTERVAL,
+        state_cache_size: int = FSM_STATE_CACHE_SIZE
+    ):
+        self.write_delay = write_delay
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.state_cache_size = state_cache_size
+        # key -> (state, time.monotonic() it expires at); no state never expires
+        self._states: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        # Bumped by set_state, so a read racing a write does not cache the old state
+        self._state_writes = 0
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._flushing: Dict[str, _PendingWrite] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks = set()
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            getattr(key, 'thread_id', None) or '',
+            getattr(key, 'business_connection_id', None) or '',
+            key.destiny
+        ))
+
+    async def start(self) -> None:
+        """Start the background cleanup of expired states"""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        self._pending_write(key).state = state
+        self._state_writes += 1
+        self._cache_state(self._key(key), state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state = self._buffered(key, 'state')
+        if state is not _UNSET:
+            return state
+
+        k = self._key(key)
+        cached = self._states.get(k)
+        if cached is not None and cached[1] > time.monotonic():
+            self._states.move_to_end(k)
+            return cached[0]
+
+        writes = self._state_writes
+        state, expires_in = await db.fsm_get_state(k, self.ttl)
+        if writes == self._state_writes:
+            self._cache_state(k, state, expires_in)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._pending_write(key).data = dict(data)
+        # The write refreshes the row, which extends the state's lifetime
+        k = self._key(key)
+        cached = self._states.get(k)
+        if cached is not None and cached[0] is not None:
+            self._states[k] = (cached[0], time.monotonic() + self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = self._buffered(key, 'data')
+        if data is not _UNSET:
+            return dict(data)
+
+        raw = await db.fsm_get_data(self._key(key), self.ttl)
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if db.connected():
+            await self.flush()
+
+    def _pending_write(self, key: StorageKey) -> _PendingWrite:
+        k = self._key(key)
+        entry = self._pending.get(k)
+        if entry is None:
+            entry = self._pending[k] = _PendingWrite()
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(
+                    self.write_delay, self._start_flush
+                )
+        return entry
+
+    def _cache_state(self, k: str, state: Optional[str], expires_in: float) -> None:
+        if not self.state_cache_size:
+            return
+        expires_at = float('inf') if state is None else time.monotonic() + expires_in
+        self._states[k] = (state, expires_at)
+        self._states.move_to_end(k)
+        while len(self._states) > self.state_cache_size:
+            self._states.popitem(last=False)
+
+    def _buffered(self, key: StorageKey, field: str) -> Any:
+        k = self._key(key)
+        # Newest first: not yet flushed, then the batch being written
+        for buffer in (self._pending, self._flushing):
+            entry = buffer.get(k)
+            if entry is not None and getattr(entry, field) is not _UNSET:
+                return getattr(entry, field)
+        return _UNSET
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> None:
+        """Write all buffered changes in one batch"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        # One batch at a time so an older batch never lands after a newer one
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+
+            args = [
+                (
+                    k,
+                    None if entry.state is _UNSET else entry.state,
+                    None if entry.data is _UNSET else json.dumps(entry.data),
+                    entry.state is not _UNSET,
+                    entry.data is not _UNSET
+                )
+                for k, entry in self._flushing.items()
+            ]
+            try:
+                await db.fsm_set_many(args)
+            except Exception as e:
+                # Keep the writes and retry with the next flush
+                logging.error(f"Error flushing FSM state: {e}")
+                self._requeue(self._flushing)
+            finally:
+                self._flushing = {}
+
+    def _requeue(self, batch: Dict[str, _PendingWrite]) -> None:
+        """Put a failed batch back under any newer buffered writes"""
+        for k, entry in batch.items():
+            newer = self._pending.get(k)
+            if newer is None:
+                self._pending[k] = entry
+                continue
+            if newer.state is _UNSET:
+                newer.state = entry.state
+            if newer.data is _UNSET:
+                newer.data = entry.data
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.write_delay, self._start_flush
+            )
+
+    async def cleanup(self) -> int:
+        """Delete expired and cleared states, returning the number removed"""
+        return await db.fsm_cleanup(self.ttl)
+
+    async def _cleanup_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                removed = await self.cleanup()
+                if removed:
+                    logging.info(f"Removed {removed} expired FSM states")
+            except Exception as e:
+                logging.error(f"Error cleaning up FSM states: {e}")
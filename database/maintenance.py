@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Optional
+
+from config import CART_TTL, CART_CLEANUP_INTERVAL, CART_CLEANUP_BATCH, STOCK_RESERVATION_TTL
+from database.db import expire_carts, release_reservations
+
+# Pause between two delete batches of the same run, in seconds
+BATCH_PAUSE = 0.1
+
+
+class CartExpiry:
+    """Background job that deletes carts nobody touched for ``ttl`` seconds.
+
+    Every ``interval`` seconds it deletes stale cart lines in batches of
+    ``batch_size`` until none are left, pausing between batches so it never
+    holds many row locks or a pool connection for long. Before that it
+    releases the stock reserved by carts untouched for ``reservation_ttl``
+    seconds, the same way.
+    """
+
+    def __init__(
+        self,
+        ttl: int = CART_TTL,
+        interval: int = CART_CLEANUP_INTERVAL,
+        batch_size: int = CART_CLEANUP_BATCH,
+        reservation_ttl: int = STOCK_RESERVATION_TTL
+    ):
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reservation_ttl = reservation_ttl
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Release stale reservations and delete every stale cart line, returning how many were removed"""
+        released = await self._in_batches(release_reservations, self.reservation_ttl)
+        if released:
+            logging.info(f"Released stock reserved by {released} idle cart lines")
+        return await self._in_batches(expire_carts, self.ttl)
+
+    async def _in_batches(self, job, ttl: int) -> int:
+        done = 0
+        while True:
+            count = await job(ttl, self.batch_size)
+            done += count
+            if count < self.batch_size:
+                return done
+            await asyncio.sleep(BATCH_PAUSE)
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                removed = await self.run_once()
+                if removed:
+                    logging.info(f"Removed {removed} expired cart lines")
+            except Exception as e:
+                logging.error(f"Error expiring carts: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Cart expiry job of this process, started by main.on_startup where it should run
+cart_expiry = CartExpiry()
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+from typing import NamedTuple, Tuple
+
+# Any fixed number; every replica takes the same advisory lock to migrate
+ADVISORY_LOCK_ID = 7_340_216_011
+
+# Migrations may build indexes on big tables, far beyond DB_COMMAND_TIMEOUT
+MIGRATION_TIMEOUT = 60 * 60
+
+# Seconds between attempts to take the advisory lock while another replica migrates
+LOCK_POLL_INTERVAL = 0.5
+
+
+class Migration(NamedTuple):
+    """One numbered schema change.
+
+    Steps of a transactional migration are applied atomically together with
+    its schema_version row. Set ``transactional=False`` for statements that
+    cannot run in a transaction (CREATE INDEX CONCURRENTLY); such steps run
+    one by one and must be safe to repeat, since a crash can leave a
+    migration half applied.
+    """
+    version: int
+    description: str
+    steps: Tuple[str, ...]
+    transactional: bool = True
+
+
+# Append new migrations at the end, never edit one that has shipped.
+# Versions 1-5 recreate the schema create_tables used to build, written so
+# they also apply cleanly to a database that create_tables already set up.
+MIGRATIONS = (
+    Migration(1, "products and cart", (
+        '''
+        CREATE TABLE IF NOT EXISTS products (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            price NUMERIC(10, 2) NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cart (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+        )
+        ''',
+        # One row per (user, product): merge duplicates left by the old
+        # read-then-write add_to_cart before the unique index can exist
+        '''
+        WITH dups AS (
+            SELECT MIN(id) AS keep_id, user_id, product_id, SUM(quantity) AS quantity
+            FROM cart
+            GROUP BY user_id, product_id
+            HAVING COUNT(*) > 1
+        ), merged AS (
+            UPDATE cart c SET quantity = d.quantity
+            FROM dups d
+            WHERE c.id = d.keep_id
+        )
+        DELETE FROM cart c
+        USING dups d
+        WHERE c.user_id = d.user_id
+          AND c.product_id = d.product_id
+          AND c.id <> d.keep_id
+        ''',
+        # Also serves every per-user lookup (get_cart_items, clear_cart)
+        "CREATE UNIQUE INDEX IF NOT EXISTS cart_user_product_key ON cart (user_id, product_id)",
+        # Lets ON DELETE CASCADE from products avoid a full cart scan
+        "CREATE INDEX IF NOT EXISTS cart_product_id_idx ON cart (product_id)",
+    )),
+    Migration(2, "orders", (
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            total NUMERIC(12, 2) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''',
+        # Items keep name and price as sold
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id SERIAL PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER,
+            name TEXT NOT NULL,
+            price NUMERIC(10, 2) NOT NULL,
+            quantity INTEGER NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE SET NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id)",
+        "CREATE INDEX IF NOT EXISTS order_items_product_id_idx ON order_items (product_id)",
+    )),
+    Migration(3, "FSM state", (
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS fsm_state_updated_at_idx ON fsm_state (updated_at)",
+    )),
+    Migration(4, "customers and outbox", (
+        # Everyone who ever had a cart: the broadcast audience
+        '''
+        CREATE TABLE IF NOT EXISTS customers (
+            user_id BIGINT PRIMARY KEY,
+            first_seen TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''',
+        '''
+        INSERT INTO customers (user_id)
+        SELECT user_id FROM cart
+        UNION
+        SELECT user_id FROM orders
+        ON CONFLICT DO NOTHING
+        ''',
+        # Broadcast rows of the outbox take their text from the broadcast
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            admin_id BIGINT NOT NULL,
+            progress_message_id BIGINT,
+            total INTEGER NOT NULL,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            text TEXT,
+            broadcast_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before TIMESTAMPTZ NOT NULL DEFAULT now(),
+            sent_at TIMESTAMPTZ,
+            error TEXT,
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id) ON DELETE CASCADE
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS outbox_due_idx ON outbox (not_before, id) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS outbox_broadcast_id_idx ON outbox (broadcast_id)",
+    )),
+    Migration(5, "cart expiry", (
+        "ALTER TABLE cart ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS cart_updated_at_idx ON cart (updated_at)",
+    )),
+    Migration(6, "stock reservations", (
+        # NULL stock means the product is not tracked and never runs out
+        "ALTER TABLE products ADD COLUMN stock INTEGER CHECK (stock >= 0)",
+        # Part of the line's quantity taken from stock
+        "ALTER TABLE cart ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX cart_reserved_updated_at_idx ON cart (updated_at) WHERE reserved > 0",
+    )),
+    Migration(7, "categories", (
+        '''
+        CREATE TABLE categories (
+            id SERIAL PRIMARY KEY,
+            parent_id INTEGER REFERENCES categories (id) ON DELETE SET NULL,
+            name TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX categories_parent_id_idx ON categories (parent_id)",
+        # NULL category lists the product at the top level of the catalog
+        "ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES categories (id) ON DELETE SET NULL",
+        "CREATE INDEX products_category_id_idx ON products (category_id)",
+    )),
+    Migration(8, "customer order totals", (
+        # Kept up to date by place_order, so showing them never aggregates orders
+        '''
+        ALTER TABLE customers
+            ADD COLUMN order_count INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN lifetime_spend NUMERIC(14, 2) NOT NULL DEFAULT 0
+        ''',
+        "INSERT INTO customers (user_id) SELECT DISTINCT user_id FROM orders ON CONFLICT DO NOTHING",
+        '''
+        UPDATE customers c
+        SET order_count = o.order_count, lifetime_spend = o.lifetime_spend
+        FROM (
+            SELECT user_id, COUNT(*) AS order_count, SUM(total) AS lifetime_spend
+            FROM orders
+            GROUP BY user_id
+        ) o
+        WHERE c.user_id = o.user_id
+        ''',
+    )),
+    # Order history pages are index-only scans; built without blocking
+    # checkouts, an interrupted build is dropped and redone
+    Migration(9, "order history index", (
+        "DROP INDEX CONCURRENTLY IF EXISTS orders_user_history_idx",
+        "CREATE INDEX CONCURRENTLY orders_user_history_idx ON orders (user_id, created_at, id) INCLUDE (total)",
+    ), transactional=False),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn) -> int:
+    """Schema version of the database, 0 if it was never migrated"""
+    if await conn.fetchval("SELECT to_regclass('schema_version')") is None:
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+
+
+async def apply_migrations(conn) -> int:
+    """Bring the schema up to LATEST_VERSION, returning the number of migrations applied.
+
+    A current schema costs two catalog reads and no DDL. Otherwise the
+    advisory lock makes concurrently starting replicas migrate one at a
+    time; the ones that waited find the work done.
+    """
+    if await current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    await _lock(conn)
+    try:
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''')
+        version = await current_version(conn)
+        applied = 0
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            logging.info(f"Applying migration {migration.version}: {migration.description}")
+            if migration.transactional:
+                async with conn.transaction():
+                    await _apply(conn, migration)
+            else:
+                await _apply(conn, migration)
+            applied += 1
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", ADVISORY_LOCK_ID)
+
+
+async def _lock(conn) -> None:
+    """Take the migration advisory lock, polling instead of blocking.
+
+    A session blocked in pg_advisory_lock keeps its statement's snapshot
+    open, and CREATE INDEX CONCURRENTLY in the replica holding the lock
+    waits for every older snapshot: the two would wait on each other.
+    Between tries a waiting replica holds no snapshot.
+    """
+    deadline = time.monotonic() + MIGRATION_TIMEOUT
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", ADVISORY_LOCK_ID):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Timed out waiting for another replica to finish migrating")
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+async def _apply(conn, migration: Migration) -> None:
+    for step in migration.steps:
+        await conn.execute(step, timeout=MIGRATION_TIMEOUT)
+    await conn.execute(
+        "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+        migration.version, migration.description
+    )
@@ -0,0 +1,849 @@
+import asyncio
+import logging
+import uuid
+import asyncpg
+from decimal import Decimal
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from config import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASSWORD,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_INACTIVE_LIFETIME,
+    DB_COMMAND_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE,
+    CATALOG_PAGE_SIZE,
+    ORDERS_PAGE_SIZE,
+    METRICS_ENABLED
+)
+from database.cache import catalog_cache, cart_cache
+from database.errors import OutOfStock
+from database.migrations import apply_migrations
+from database.repository import RepositoryConnection, Product, CartItem, Order
+from utils.search import product_index
+from utils.categories import CategoryTree, category_tree
+from utils import metrics
+
+# API shared with database.sqlite, re-exported by database.db
+__all__ = [
+    'init_db', 'migrate_schema', 'close_db', 'connected',
+    'add_product', 'get_all_products', 'get_product_by_id', 'get_products_page',
+    'search_products', 'update_product', 'delete_product', 'import_products', 'export_products',
+    'get_category_tree', 'add_category', 'rename_category', 'delete_category', 'set_product_category',
+    'get_stock', 'set_stock',
+    'add_to_cart', 'get_cart_items', 'remove_from_cart', 'clear_cart', 'expire_carts',
+    'release_reservations',
+    'place_order', 'get_orders_page', 'get_order_summary', 'get_order',
+    'enqueue_broadcast', 'set_broadcast_message', 'notify_price_change', 'claim_outbox', 'finish_outbox',
+    'fsm_get_state', 'fsm_get_data', 'fsm_set_many', 'fsm_cleanup',
+]
+
+# Connection pool
+pool = None
+
+# Dedicated connection that LISTENs for catalog and cart changes made by other instances
+listener_conn = None
+
+# NOTIFY channel for catalog invalidation, the payload is the sender's instance id
+CATALOG_CHANNEL = "catalog_changed"
+INSTANCE_ID = uuid.uuid4().hex
+
+# NOTIFY channel for carts deleted by the expiry job, the payload is
+# "<instance id>:<user id>,<user id>,..." with at most CART_NOTIFY_USERS
+# users, which keeps it well under the 8000 byte payload limit
+CARTS_CHANNEL = "carts_expired"
+CART_NOTIFY_USERS = 500
+
+if METRICS_ENABLED:
+    metrics.register_gauge("db_pool_size", "Open pool connections", lambda: pool.get_size() if pool else 0)
+    metrics.register_gauge("db_pool_idle", "Idle pool connections", lambda: pool.get_idle_size() if pool else 0)
+
+async def init_db(connection_init=None):
+    """Initialize the database connection pool
+
+    connection_init, if given, is awaited with every new pool connection
+    (used by the benchmarks to attach query counters).
+    """
+    global pool
+
+    try:
+        # Create a connection pool
+        pool = await asyncpg.create_pool(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            command_timeout=DB_COMMAND_TIMEOUT or None,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            connection_class=RepositoryConnection,
+            init=connection_init
+        )
+        logging.info("Database connection pool created successfully")
+    except Exception as e:
+        logging.error(f"Error creating connection pool: {e}")
+        raise e
+
+    await start_catalog_listener()
+
+def connected() -> bool:
+    return pool is not None
+
+def acquire(query: str):
+    """pool.acquire(), timed under the query name when metrics are enabled"""
+    if METRICS_ENABLED:
+        return metrics.TimedAcquire(pool, query)
+    return pool.acquire()
+
+async def close_db():
+    """Close the catalog listener and the connection pool"""
+    global pool, listener_conn
+    if listener_conn is not None:
+        listener_conn.remove_termination_listener(_on_listener_terminated)
+        await listener_conn.close()
+        listener_conn = None
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+async def start_catalog_listener():
+    """Subscribe to catalog invalidations and cart expiries sent by other bot instances"""
+    global listener_conn
+    try:
+        listener_conn = await asyncpg.connect(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD
+        )
+        await listener_conn.add_listener(CATALOG_CHANNEL, _on_catalog_changed)
+        await listener_conn.add_listener(CARTS_CHANNEL, _on_carts_expired)
+        listener_conn.add_termination_listener(_on_listener_terminated)
+        # Changes made while we were not listening are unknown to us
+        catalog_cache.invalidate()
+        cart_cache.invalidate_all()
+        logging.info("Listening for catalog and cart changes")
+    except Exception as e:
+        logging.error(f"Error starting catalog listener: {e}")
+        raise e
+
+def _on_catalog_changed(connection, pid, channel, payload):
+    """Invalidate the local catalog when another instance changes it"""
+    if payload != INSTANCE_ID:
+        catalog_cache.invalidate()
+
+def _on_carts_expired(connection, pid, channel, payload):
+    """Drop the cached cart views of users whose carts another instance expired"""
+    sender, _, user_ids = payload.partition(':')
+    if sender != INSTANCE_ID:
+        for user_id in user_ids.split(','):
+            cart_cache.bump(int(user_id))
+
+def _on_listener_terminated(connection):
+    """Stop trusting the caches and reconnect when the listener drops"""
+    catalog_cache.invalidate()
+    cart_cache.invalidate_all()
+    logging.warning("Catalog listener connection lost, reconnecting")
+    asyncio.get_running_loop().create_task(_reconnect_catalog_listener())
+
+async def _reconnect_catalog_listener():
+    delay = 1
+    while True:
+        try:
+            await start_catalog_listener()
+            return
+        except Exception:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+async def migrate_schema():
+    """Apply pending schema migrations; no DDL runs when the schema is current"""
+    async with acquire("migrate_schema") as conn:
+        try:
+            applied = await apply_migrations(conn)
+            if applied:
+                logging.info(f"Applied {applied} schema migrations")
+        except Exception as e:
+            logging.error(f"Error migrating schema: {e}")
+            raise e
+
+# Product operations
+# Every write sends pg_notify in the same statement, so other instances drop
+# their catalog cache exactly when the change commits.
+async def add_product(name: str, price: float) -> int:
+    """Add a new product"""
+    async with acquire("add_product") as conn:
+        try:
+            product = await conn.run_row("add_product", name, price, CATALOG_CHANNEL, INSTANCE_ID)
+            _catalog_applied(product=product)
+            return product['id']
+        except Exception as e:
+            logging.error(f"Error adding product: {e}")
+            raise e
+
+async def get_all_products() -> List[Product]:
+    """Get all products (served from the catalog cache)"""
+    return await catalog_cache.get_all(_load_products)
+
+async def get_product_by_id(product_id: int) -> Optional[Product]:
+    """Get product by ID (served from the catalog cache)"""
+    return await catalog_cache.get(product_id, _load_products)
+
+async def get_products_page(
+    after_id: int = 0, before_id: Optional[int] = None
+) -> Tuple[List[Product], bool, bool]:
+    """Get one catalog page by keyset on id.
+
+    Returns (products, has_prev, has_next). Pass after_id for the next page or
+    before_id for the previous one. Served from the catalog cache when it is
+    loaded, otherwise a single indexed query reads page size + 1 rows.
+    """
+    if catalog_cache.loaded:
+        return catalog_cache.page(after_id, before_id, CATALOG_PAGE_SIZE)
+
+    async with acquire("get_products_page") as conn:
+        try:
+            if before_id is not None:
+                rows = await conn.run("products_before", before_id, CATALOG_PAGE_SIZE + 1)
+                products = rows[:CATALOG_PAGE_SIZE][::-1]
+                return products, len(rows) > CATALOG_PAGE_SIZE, True
+
+            rows = await conn.run("products_after", after_id, CATALOG_PAGE_SIZE + 1)
+            products = rows[:CATALOG_PAGE_SIZE]
+            return products, after_id > 0, len(rows) > CATALOG_PAGE_SIZE
+        except Exception as e:
+            logging.error(f"Error getting products page: {e}")
+            raise e
+
+async def search_products(query: str, limit: int) -> List[Product]:
+    """Search products by name in the in-memory index, rebuilt only after catalog changes"""
+    if product_index.version != catalog_cache.version:
+        version = catalog_cache.version
+        product_index.rebuild(await get_all_products(), version)
+    return product_index.search(query, limit)
+
+def _catalog_applied(
+    product: Optional[Product] = None,
+    removed_id: Optional[int] = None,
+    category: Optional[asyncpg.Record] = None,
+    removed_category_id: Optional[int] = None
+) -> None:
+    """Bump the catalog version after a single write and apply it to the search index and category tree"""
+    version = catalog_cache.invalidate()
+    product_index.apply(version, product=product, removed_id=removed_id)
+    category_tree.apply(
+        version, category=category, removed_category_id=removed_category_id,
+        product=product, removed_id=removed_id
+    )
+
+async def _load_products() -> List[Product]:
+    """Read the whole catalog from the database"""
+    async with acquire("load_products") as conn:
+        try:
+            return await conn.run("load_products")
+        except Exception as e:
+            logging.error(f"Error getting products: {e}")
+            raise e
+
+async def update_product(product_id: int, name: str, price: float) -> None:
+    """Update product information"""
+    async with acquire("update_product") as conn:
+        try:
+            product = await conn.run_row("update_product", name, price, product_id, CATALOG_CHANNEL, INSTANCE_ID)
+            if product:
+                _catalog_applied(product=product)
+            else:
+                catalog_cache.invalidate()
+        except Exception as e:
+            logging.error(f"Error updating product: {e}")
+            raise e
+
+async def delete_product(product_id: int) -> None:
+    """Delete a product"""
+    async with acquire("delete_product") as conn:
+        try:
+            await conn.run("delete_product", product_id, CATALOG_CHANNEL, INSTANCE_ID)
+            _catalog_applied(removed_id=product_id)
+        except Exception as e:
+            logging.error(f"Error deleting product: {e}")
+            raise e
+
+async def import_products(records: Iterable[Tuple[Optional[int], str, Decimal]]) -> Tuple[int, int]:
+    """Bulk load (id, name, price) records into the catalog.
+
+    Records are streamed with COPY into a temporary staging table and merged
+    in one statement: a record with the id of an existing product updates it,
+    every other record becomes a new product. Returns (updated, inserted).
+    """
+    async with acquire("import_products") as conn:
+        try:
+            async with conn.transaction():
+                await conn.execute('''
+                CREATE TEMPORARY TABLE products_import (
+                    id INTEGER,
+                    name TEXT NOT NULL,
+                    price NUMERIC(10, 2) NOT NULL
+                ) ON COMMIT DROP
+                ''')
+                await conn.copy_records_to_table(
+                    'products_import', records=records, columns=['id', 'name', 'price']
+                )
+                result = await conn.fetchrow('''
+                WITH updated AS (
+                    UPDATE products p SET name = s.name, price = s.price
+                    FROM products_import s
+                    WHERE p.id = s.id
+                    RETURNING p.id
+                ), inserted AS (
+                    INSERT INTO products (name, price)
+                    SELECT s.name, s.price
+                    FROM products_import s
+                    WHERE s.id IS NULL
+                       OR NOT EXISTS (SELECT 1 FROM products p WHERE p.id = s.id)
+                    RETURNING id
+                )
+                SELECT (SELECT COUNT(*) FROM updated) AS updated,
+                       (SELECT COUNT(*) FROM inserted) AS inserted,
+                       pg_notify($1, $2)
+                ''', CATALOG_CHANNEL, INSTANCE_ID)
+            catalog_cache.invalidate()
+            return result['updated'], result['inserted']
+        except Exception as e:
+            logging.error(f"Error importing products: {e}")
+            raise e
+
+async def export_products(output: Any) -> int:
+    """Stream the catalog as CSV (id, name, price) to a path or binary file, returning the row count"""
+    async with acquire("export_products") as conn:
+        try:
+            result = await conn.copy_from_query(
+                "SELECT id, name, price FROM products ORDER BY id",
+                output=output, format='csv', header=True
+            )
+            return int(result.split()[-1])
+        except Exception as e:
+            logging.error(f"Error exporting products: {e}")
+            raise e
+
+# Category operations
+# Categories belong to the catalog: writes bump its version and notify other
+# instances like product writes, and the category tree applies them in place.
+async def get_category_tree() -> CategoryTree:
+    """The category tree with product counts, rebuilt only after catalog changes it did not apply"""
+    if category_tree.version != catalog_cache.version:
+        version = catalog_cache.version
+        categories = await _load_categories()
+        category_tree.rebuild(categories, await get_all_products(), version)
+    return category_tree
+
+async def _load_categories() -> List[asyncpg.Record]:
+    """Read every category from the database"""
+    async with acquire("load_categories") as conn:
+        try:
+            return await conn.fetch("SELECT id, parent_id, name FROM categories")
+        except Exception as e:
+            logging.error(f"Error getting categories: {e}")
+            raise e
+
+async def add_category(name: str, parent_id: Optional[int] = None) -> int:
+    """Add a category, at the top level when parent_id is None"""
+    async with acquire("add_category") as conn:
+        try:
+            category = await conn.fetchrow('''
+            WITH inserted AS (
+                INSERT INTO categories (name, parent_id) VALUES ($1, $2) RETURNING id, parent_id, name
+            )
+            SELECT id, parent_id, name FROM inserted, pg_notify($3, $4)
+            ''', name, parent_id, CATALOG_CHANNEL, INSTANCE_ID)
+            _catalog_applied(category=category)
+            return category['id']
+        except Exception as e:
+            logging.error(f"Error adding category: {e}")
+            raise e
+
+async def rename_category(category_id: int, name: str) -> None:
+    """Rename a category"""
+    async with acquire("rename_category") as conn:
+        try:
+            category = await conn.fetchrow('''
+            WITH updated AS (
+                UPDATE categories SET name = $2 WHERE id = $1 RETURNING id, parent_id, name
+            )
+            SELECT id, parent_id, name FROM updated, pg_notify($3, $4)
+            ''', category_id, name, CATALOG_CHANNEL, INSTANCE_ID)
+            if category:
+                _catalog_applied(category=category)
+        except Exception as e:
+            logging.error(f"Error renaming category: {e}")
+            raise e
+
+async def delete_category(category_id: int) -> None:
+    """Delete a category; its subcategories and products move up to its parent"""
+    async with acquire("delete_category") as conn:
+        try:
+            async with conn.transaction():
+                parent_id = await conn.fetchval(
+                    "SELECT parent_id FROM categories WHERE id = $1 FOR UPDATE", category_id
+                )
+                await conn.execute(
+                    "UPDATE categories SET parent_id = $2 WHERE parent_id = $1", category_id, parent_id
+                )
+                await conn.execute(
+                    "UPDATE products SET category_id = $2 WHERE category_id = $1", category_id, parent_id
+                )
+                await conn.execute('''
+                WITH deleted AS (
+                    DELETE FROM categories WHERE id = $1 RETURNING id
+                )
+                SELECT pg_notify($2, $3) FROM deleted
+                ''', category_id, CATALOG_CHANNEL, INSTANCE_ID)
+            _catalog_applied(removed_category_id=category_id)
+        except Exception as e:
+            logging.error(f"Error deleting category: {e}")
+            raise e
+
+async def set_product_category(product_id: int, category_id: Optional[int]) -> None:
+    """Move a product to a category, None lists it at the top level"""
+    async with acquire("set_product_category") as conn:
+        try:
+            product = await conn.fetchrow('''
+            WITH updated AS (
+                UPDATE products SET category_id = $2 WHERE id = $1 RETURNING id, name, price, category_id
+            )
+            SELECT id, name, price, category_id FROM updated, pg_notify($3, $4)
+            ''', product_id, category_id, CATALOG_CHANNEL, INSTANCE_ID, record_class=Product)
+            if product:
+                _catalog_applied(product=product)
+        except Exception as e:
+            logging.error(f"Error setting product category: {e}")
+            raise e
+
+# Stock operations
+# Stock is the quantity not reserved by any cart. It is kept out of the
+# catalog cache, which would otherwise be dropped on every reservation.
+async def get_stock(product_id: int) -> Optional[int]:
+    """Unreserved stock of a product, None if it is not tracked"""
+    async with acquire("get_stock") as conn:
+        try:
+            return await conn.fetchval("SELECT stock FROM products WHERE id = $1", product_id)
+        except Exception as e:
+            logging.error(f"Error getting stock: {e}")
+            raise e
+
+async def set_stock(product_id: int, stock: Optional[int]) -> None:
+    """Set the unreserved stock of a product, None stops tracking it"""
+    async with acquire("set_stock") as conn:
+        try:
+            await conn.execute("UPDATE products SET stock = $2 WHERE id = $1", product_id, stock)
+        except Exception as e:
+            logging.error(f"Error setting stock: {e}")
+            raise e
+
+# Cart operations
+async def add_to_cart(user_id: int, product_id: int, quantity: int) -> bool:
+    """Add product to cart, reserving tracked stock. False if not enough is left"""
+    async with acquire("add_to_cart") as conn:
+        try:
+            added = await conn.run_row("add_to_cart", user_id, product_id, quantity) is not None
+            if added:
+                cart_cache.bump(user_id)
+            return added
+        except Exception as e:
+            logging.error(f"Error adding to cart: {e}")
+            raise e
+
+async def get_cart_items(user_id: int) -> List[CartItem]:
+    """Get user's cart items with product details"""
+    async with acquire("get_cart_items") as conn:
+        try:
+            return await conn.run("get_cart_items", user_id)
+        except Exception as e:
+            logging.error(f"Error getting cart items: {e}")
+            raise e
+
+async def remove_from_cart(user_id: int, cart_id: int) -> None:
+    """Remove item from cart"""
+    async with acquire("remove_from_cart") as conn:
+        try:
+            await conn.run("remove_from_cart", cart_id, user_id)
+            cart_cache.bump(user_id)
+        except Exception as e:
+            logging.error(f"Error removing from cart: {e}")
+            raise e
+
+async def clear_cart(user_id: int) -> None:
+    """Clear user's cart"""
+    async with acquire("clear_cart") as conn:
+        try:
+            await conn.run("clear_cart", user_id)
+            cart_cache.bump(user_id)
+        except Exception as e:
+            logging.error(f"Error clearing cart: {e}")
+            raise e
+
+async def expire_carts(ttl: float, batch_size: int) -> int:
+    """Delete up to batch_size lines of carts untouched for ttl seconds, returning how many.
+
+    A cart expires as a whole: lines are kept while any line of the same
+    user changed recently. Lines are picked by primary key, skipping locked
+    ones, which are being changed right now, so row locks are held only for
+    one small batch. The delete checks updated_at again, so a line touched
+    after the batch was picked stays. Reserved stock goes back to the
+    products.
+
+    The job runs in one process only. It publishes the expired users on
+    CARTS_CHANNEL in the same transaction, so every instance drops their
+    cached cart views once the lines are gone.
+    """
+    async with acquire("expire_carts") as conn:
+        try:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                WITH stale AS (
+                    SELECT c.id FROM cart c
+                    WHERE c.updated_at < now() - make_interval(secs => $1)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM cart r
+                          WHERE r.user_id = c.user_id
+                            AND r.updated_at >= now() - make_interval(secs => $1)
+                      )
+                    LIMIT $2
+                    FOR UPDATE OF c SKIP LOCKED
+                ), expired AS (
+                    DELETE FROM cart c
+                    USING stale s
+                    WHERE c.id = s.id
+                      AND c.updated_at < now() - make_interval(secs => $1)
+                    RETURNING c.user_id, c.product_id, c.reserved
+                ), restocked AS (
+                    UPDATE products p SET stock = p.stock + r.reserved
+                    FROM (
+                        SELECT product_id, SUM(reserved) AS reserved FROM expired
+                        WHERE reserved > 0
+                        GROUP BY product_id
+                    ) r
+                    WHERE p.id = r.product_id AND p.stock IS NOT NULL
+                )
+                SELECT user_id FROM expired
+                ''', ttl, batch_size)
+                user_ids = sorted({row['user_id'] for row in rows})
+                for start in range(0, len(user_ids), CART_NOTIFY_USERS):
+                    batch = ','.join(str(user_id) for user_id in user_ids[start:start + CART_NOTIFY_USERS])
+                    await conn.execute("SELECT pg_notify($1, $2)", CARTS_CHANNEL, f"{INSTANCE_ID}:{batch}")
+            for user_id in user_ids:
+                cart_cache.bump(user_id)
+            return len(rows)
+        except Exception as e:
+            logging.error(f"Error expiring carts: {e}")
+            raise e
+
+async def release_reservations(ttl: float, batch_size: int) -> int:
+    """Return the stock held by up to batch_size lines of carts untouched for ttl seconds.
+
+    The lines stay in the cart; checkout reserves them again. Locked lines
+    are skipped, they are being changed right now. Returns how many lines
+    were released.
+    """
+    async with acquire("release_reservations") as conn:
+        try:
+            return await conn.fetchval('''
+            WITH stale AS (
+                SELECT c.id, c.product_id, c.reserved FROM cart c
+                WHERE c.reserved > 0
+                  AND c.updated_at < now() - make_interval(secs => $1)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM cart r
+                      WHERE r.user_id = c.user_id
+                        AND r.updated_at >= now() - make_interval(secs => $1)
+                  )
+                LIMIT $2
+                FOR UPDATE OF c SKIP LOCKED
+            ), released AS (
+                UPDATE cart c SET reserved = 0
+                FROM stale s
+                WHERE c.id = s.id
+                RETURNING s.product_id, s.reserved
+            ), restocked AS (
+                UPDATE products p SET stock = p.stock + r.reserved
+                FROM (
+                    SELECT product_id, SUM(reserved) AS reserved FROM released
+                    GROUP BY product_id
+                ) r
+                WHERE p.id = r.product_id AND p.stock IS NOT NULL
+            )
+            SELECT COUNT(*) FROM released
+            ''', ttl, batch_size)
+        except Exception as e:
+            logging.error(f"Error releasing stock reservations: {e}")
+            raise e
+
+# Order operations
+async def place_order(user_id: int) -> Optional[Dict[str, Any]]:
+    """Move the user's cart into a new order.
+
+    A single statement deletes the cart rows, creates the order and its items
+    and returns them, so checkout is atomic and needs one round trip. Items
+    added to the cart while this runs stay in the cart. Returns None when the
+    cart is empty.
+
+    Stock was reserved when the items were added. If a tracked line lacks
+    its reservation, the missing stock is reserved for the whole cart in one
+    statement before the order is placed, in the same transaction; raises
+    OutOfStock when some of it is not available.
+    """
+    async with acquire("place_order") as conn:
+        try:
+            rows = await conn.run("place_order", user_id)
+            if not rows:
+                # Empty cart, or lines to reserve first
+                async with conn.transaction():
+                    short = await conn.run("reserve_cart", user_id)
+                    if short:
+                        raise OutOfStock([row['name'] for row in short])
+                    rows = await conn.run("place_order", user_id)
+            cart_cache.bump(user_id)
+        except OutOfStock:
+            raise
+        except Exception as e:
+            logging.error(f"Error placing order: {e}")
+            raise e
+
+    return _order(rows)
+
+async def get_orders_page(
+    user_id: int, after_id: int = 0, before_id: Optional[int] = None
+) -> Tuple[List[Order], bool, bool]:
+    """Get one page of the user's order history, newest first, by keyset.
+
+    Returns (orders, has_prev, has_next) like get_products_page: after_id
+    pages to older orders, before_id to newer ones. An anchor that is not
+    one of the user's orders gives the first page.
+    """
+    async with acquire("get_orders_page") as conn:
+        try:
+            if before_id is not None:
+                rows = await conn.run("orders_newer", user_id, before_id, ORDERS_PAGE_SIZE + 1)
+                if rows:
+                    return rows[:ORDERS_PAGE_SIZE][::-1], len(rows) > ORDERS_PAGE_SIZE, True
+            elif after_id:
+                rows = await conn.run("orders_older", user_id, after_id, ORDERS_PAGE_SIZE + 1)
+                if rows:
+                    return rows[:ORDERS_PAGE_SIZE], True, len(rows) > ORDERS_PAGE_SIZE
+
+            rows = await conn.run("orders_first", user_id, ORDERS_PAGE_SIZE + 1)
+            return rows[:ORDERS_PAGE_SIZE], False, len(rows) > ORDERS_PAGE_SIZE
+        except Exception as e:
+            logging.error(f"Error getting orders page: {e}")
+            raise e
+
+async def get_order_summary(user_id: int) -> Tuple[int, Decimal]:
+    """The user's order count and lifetime spend, kept up to date by place_order"""
+    async with acquire("get_order_summary") as conn:
+        try:
+            row = await conn.run_row("order_summary", user_id)
+            return (row['order_count'], row['lifetime_spend']) if row else (0, Decimal(0))
+        except Exception as e:
+            logging.error(f"Error getting order summary: {e}")
+            raise e
+
+async def get_order(user_id: int, order_id: int) -> Optional[Dict[str, Any]]:
+    """One of the user's orders like place_order returns it, None if it is not theirs"""
+    async with acquire("get_order") as conn:
+        try:
+            return _order(await conn.run("get_order", order_id, user_id))
+        except Exception as e:
+            logging.error(f"Error getting order: {e}")
+            raise e
+
+def _order(rows: List[asyncpg.Record]) -> Optional[Dict[str, Any]]:
+    """Order dict from its item rows, None without rows"""
+    if not rows:
+        return None
+
+    # Each row also carries the item's product_id, name, price and quantity
+    return {
+        'id': rows[0]['order_id'],
+        'total': rows[0]['total'],
+        'created_at': rows[0]['created_at'],
+        'items': rows
+    }
+
+# Outbox operations
+async def enqueue_broadcast(text: str, admin_id: int) -> Tuple[int, int]:
+    """Queue a message to every customer, returning (broadcast id, recipients)"""
+    async with acquire("enqueue_broadcast") as conn:
+        try:
+            row = await conn.fetchrow('''
+            WITH audience AS (
+                SELECT user_id FROM customers
+            ), broadcast AS (
+                INSERT INTO broadcasts (text, admin_id, total)
+                SELECT $1, $2, COUNT(*) FROM audience
+                RETURNING id, total
+            ), queued AS (
+                INSERT INTO outbox (chat_id, broadcast_id)
+                SELECT a.user_id, b.id FROM audience a CROSS JOIN broadcast b
+            )
+            SELECT id, total FROM broadcast
+            ''', text, admin_id)
+            return row['id'], row['total']
+        except Exception as e:
+            logging.error(f"Error enqueueing broadcast: {e}")
+            raise e
+
+async def set_broadcast_message(broadcast_id: int, message_id: int) -> None:
+    """Remember the admin's message that shows the broadcast's progress"""
+    async with acquire("set_broadcast_message") as conn:
+        try:
+            await conn.execute(
+                "UPDATE broadcasts SET progress_message_id = $2 WHERE id = $1",
+                broadcast_id, message_id
+            )
+        except Exception as e:
+            logging.error(f"Error saving broadcast message: {e}")
+            raise e
+
+async def notify_price_change(product_id: int, text: str) -> int:
+    """Queue a message to everyone with the product in their cart, returning how many"""
+    async with acquire("notify_price_change") as conn:
+        try:
+            result = await conn.execute('''
+            INSERT INTO outbox (chat_id, text)
+            SELECT DISTINCT user_id, $2 FROM cart WHERE product_id = $1
+            ''', product_id, text)
+            return int(result.split()[-1])
+        except Exception as e:
+            logging.error(f"Error queueing price notifications: {e}")
+            raise e
+
+async def claim_outbox(limit: int, lease: float) -> List[Dict[str, Any]]:
+    """Take up to limit due messages for delivery.
+
+    Claimed rows are hidden from other senders for lease seconds, so messages
+    of a sender that died are delivered again after the lease runs out.
+    """
+    async with acquire("claim_outbox") as conn:
+        try:
+            rows = await conn.fetch('''
+            WITH due AS (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND not_before <= now()
+                ORDER BY not_before, id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE outbox o
+            SET not_before = now() + make_interval(secs => $2), attempts = o.attempts + 1
+            FROM due
+            WHERE o.id = due.id
+            RETURNING o.id, o.chat_id, o.broadcast_id, o.attempts,
+                      COALESCE(o.text, (SELECT text FROM broadcasts WHERE id = o.broadcast_id)) AS text
+            ''', limit, lease)
+            return sorted((dict(row) for row in rows), key=lambda row: row['id'])
+        except Exception as e:
+            logging.error(f"Error claiming outbox messages: {e}")
+            raise e
+
+async def finish_outbox(
+    sent: List[Dict[str, Any]],
+    failed: List[Tuple[Dict[str, Any], str]],
+    retry: List[Tuple[Dict[str, Any], float, str]]
+) -> List[Dict[str, Any]]:
+    """Record delivery results of claimed messages.
+
+    failed holds (message, error) pairs that are given up, retry holds
+    (message, delay in seconds, error or None if it was not sent) triples. Returns the updated progress
+    of the broadcasts involved.
+    """
+    counts: Dict[int, List[int]] = {}
+    for message in sent:
+        if message['broadcast_id'] is not None:
+            counts.setdefault(message['broadcast_id'], [0, 0])[0] += 1
+    for message, _ in failed:
+        if message['broadcast_id'] is not None:
+            counts.setdefault(message['broadcast_id'], [0, 0])[1] += 1
+
+    async with acquire("finish_outbox") as conn:
+        try:
+            async with conn.transaction():
+                if sent:
+                    await conn.execute(
+                        "UPDATE outbox SET status = 'sent', sent_at = now() WHERE id = ANY($1::bigint[])",
+                        [message['id'] for message in sent]
+                    )
+                if failed:
+                    await conn.executemany(
+                        "UPDATE outbox SET status = 'failed', error = $2 WHERE id = $1",
+                        [(message['id'], error) for message, error in failed]
+                    )
+                if retry:
+                    # A message put back without being sent (no error) keeps its attempt
+                    await conn.executemany('''
+                    UPDATE outbox
+                    SET not_before = now() + make_interval(secs => $2), error = $3,
+                        attempts = attempts - (CASE WHEN $3::text IS NULL THEN 1 ELSE 0 END)
+                    WHERE id = $1
+                    ''', [(message['id'], delay, error) for message, delay, error in retry])
+                if not counts:
+                    return []
+                rows = await conn.fetch('''
+                UPDATE broadcasts b
+                SET sent = b.sent + v.sent, failed = b.failed + v.failed
+                FROM unnest($1::int[], $2::int[], $3::int[]) AS v (id, sent, failed)
+                WHERE b.id = v.id
+                RETURNING b.id, b.admin_id, b.progress_message_id, b.total, b.sent, b.failed
+                ''', list(counts), [c[0] for c in counts.values()], [c[1] for c in counts.values()])
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error recording outbox results: {e}")
+            raise e
+
+# FSM state operations, used by database.fsm_storage
+async def fsm_get_state(key: str, ttl: int) -> Tuple[Optional[str], float]:
+    """State of a storage key and the seconds until it expires; (None, 0) if unset or untouched for ttl seconds"""
+    async with acquire("fsm_get_state") as conn:
+        try:
+            row = await conn.run_row("fsm_get_state", key, ttl)
+            return (row['state'], row['expires_in']) if row else (None, 0.0)
+        except Exception as e:
+            logging.error(f"Error getting FSM state: {e}")
+            raise e
+
+async def fsm_get_data(key: str, ttl: int) -> Optional[str]:
+    """Data of a storage key as JSON text, None if unset or expired"""
+    async with acquire("fsm_get_data") as conn:
+        try:
+            return await conn.run_value("fsm_get_data", key, ttl)
+        except Exception as e:
+            logging.error(f"Error getting FSM data: {e}")
+            raise e
+
+async def fsm_set_many(rows: List[Tuple[str, Optional[str], Optional[str], bool, bool]]) -> None:
+    """Upsert (key, state, data JSON, state written, data written) rows in one batch"""
+    async with acquire("fsm_flush") as conn:
+        try:
+            await conn.run_many("fsm_set", rows)
+        except Exception as e:
+            logging.error(f"Error saving FSM states: {e}")
+            raise e
+
+async def fsm_cleanup(ttl: int) -> int:
+    """Delete expired and cleared states, returning the number removed"""
+    async with acquire("fsm_cleanup") as conn:
+        try:
+            result = await conn.execute('''
+            DELETE FROM fsm_state
+            WHERE updated_at < now() - make_interval(secs => $1)
+               OR (state IS NULL AND data = '{}'::jsonb)
+            ''', ttl)
+            return int(result.split()[-1])
+        except Exception as e:
+            logging.error(f"Error cleaning up FSM states: {e}")
+            raise e
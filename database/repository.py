@@ -0,0 +1,261 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+import asyncpg
+
+
+class Product(asyncpg.Record):
+    """products row: id, name, price, category_id"""
+    __slots__ = ()
+
+
+class CartItem(asyncpg.Record):
+    """Cart line joined with its product: id, product_id, quantity, name, price"""
+    __slots__ = ()
+
+
+class Order(asyncpg.Record):
+    """orders row: id, total, created_at"""
+    __slots__ = ()
+
+
+class OrderRow(asyncpg.Record):
+    """One item of a placed order with the order's id, total and created_at"""
+    __slots__ = ()
+
+
+# Every statement the bot runs on its hot paths: name -> (SQL, row class).
+# Columns are listed explicitly so a schema change never alters a prepared
+# statement's result shape.
+STATEMENTS: Dict[str, Tuple[str, Optional[Type[asyncpg.Record]]]] = {
+    # Catalog writes send pg_notify in the same statement, so other instances
+    # drop their catalog cache exactly when the change commits
+    'add_product': ('''
+        WITH inserted AS (
+            INSERT INTO products (name, price) VALUES ($1, $2) RETURNING id, name, price, category_id
+        )
+        SELECT id, name, price, category_id FROM inserted, pg_notify($3, $4)
+    ''', Product),
+    'update_product': ('''
+        WITH updated AS (
+            UPDATE products SET name = $1, price = $2 WHERE id = $3 RETURNING id, name, price, category_id
+        )
+        SELECT id, name, price, category_id FROM updated, pg_notify($4, $5)
+    ''', Product),
+    'delete_product': ('''
+        WITH deleted AS (
+            DELETE FROM products WHERE id = $1 RETURNING id
+        )
+        SELECT pg_notify($2, $3) FROM deleted
+    ''', None),
+    'load_products': (
+        "SELECT id, name, price, category_id FROM products ORDER BY id", Product
+    ),
+    'products_after': (
+        "SELECT id, name, price, category_id FROM products WHERE id > $1 ORDER BY id LIMIT $2", Product
+    ),
+    'products_before': (
+        "SELECT id, name, price, category_id FROM products WHERE id < $1 ORDER BY id DESC LIMIT $2", Product
+    ),
+
+    # Single atomic upsert, safe against double taps; also records the
+    # user as a customer for broadcasts. A tracked product is reserved with
+    # a conditional decrement, so concurrent buyers never take more than the
+    # stock; no row comes back when there is not enough left
+    'add_to_cart': ('''
+        WITH customer AS (
+            INSERT INTO customers (user_id) VALUES ($1) ON CONFLICT DO NOTHING
+        ), product AS (
+            SELECT stock IS NOT NULL AS tracked FROM products WHERE id = $2
+        ), taken AS (
+            UPDATE products SET stock = stock - $3
+            WHERE id = $2 AND stock >= $3
+            RETURNING id
+        )
+        INSERT INTO cart (user_id, product_id, quantity, reserved)
+        SELECT $1, $2, $3, CASE WHEN EXISTS (SELECT 1 FROM taken) THEN $3 ELSE 0 END
+        FROM product
+        WHERE NOT product.tracked OR EXISTS (SELECT 1 FROM taken)
+        ON CONFLICT (user_id, product_id)
+        DO UPDATE SET quantity = cart.quantity + EXCLUDED.quantity,
+                      reserved = cart.reserved + EXCLUDED.reserved,
+                      updated_at = now()
+        RETURNING id
+    ''', None),
+    'get_cart_items': ('''
+        SELECT c.id, c.product_id, c.quantity, p.name, p.price
+        FROM cart c
+        JOIN products p ON c.product_id = p.id
+        WHERE c.user_id = $1
+        ORDER BY c.id
+    ''', CartItem),
+    # Removing lines gives their reserved stock back
+    'remove_from_cart': ('''
+        WITH removed AS (
+            DELETE FROM cart WHERE id = $1 AND user_id = $2 RETURNING product_id, reserved
+        )
+        UPDATE products p SET stock = p.stock + r.reserved
+        FROM removed r
+        WHERE p.id = r.product_id AND r.reserved > 0 AND p.stock IS NOT NULL
+    ''', None),
+    'clear_cart': ('''
+        WITH removed AS (
+            DELETE FROM cart WHERE user_id = $1 RETURNING product_id, reserved
+        )
+        UPDATE products p SET stock = p.stock + r.reserved
+        FROM removed r
+        WHERE p.id = r.product_id AND r.reserved > 0 AND p.stock IS NOT NULL
+    ''', None),
+
+    # Reserves what the user's cart lines still lack (lines added before
+    # their product was tracked, or whose reservation expired) in one
+    # statement. Returns the names of products without enough stock; the
+    # caller then rolls back
+    'reserve_cart': ('''
+        WITH short AS (
+            SELECT id, product_id, quantity - reserved AS missing
+            FROM cart
+            WHERE user_id = $1 AND quantity > reserved
+            FOR UPDATE
+        ), taken AS (
+            UPDATE products p SET stock = p.stock - s.missing
+            FROM short s
+            WHERE p.id = s.product_id AND p.stock >= s.missing
+            RETURNING p.id
+        ), marked AS (
+            UPDATE cart c SET reserved = c.quantity
+            FROM short s
+            WHERE c.id = s.id AND s.product_id IN (SELECT id FROM taken)
+        )
+        SELECT p.name
+        FROM short s JOIN products p ON p.id = s.product_id
+        WHERE p.stock IS NOT NULL AND s.product_id NOT IN (SELECT id FROM taken)
+    ''', None),
+
+    # Moves nothing while a tracked line lacks its reservation; the caller
+    # then runs reserve_cart first. Also adds the order to the customer's
+    # order count and lifetime spend
+    'place_order': ('''
+        WITH moved AS (
+            DELETE FROM cart c
+            USING products p
+            WHERE c.user_id = $1 AND p.id = c.product_id
+              AND NOT EXISTS (
+                  SELECT 1 FROM cart s JOIN products sp ON sp.id = s.product_id
+                  WHERE s.user_id = $1 AND s.quantity > s.reserved AND sp.stock IS NOT NULL
+              )
+            RETURNING c.id AS cart_id, c.product_id, c.quantity, p.name, p.price
+        ), new_order AS (
+            INSERT INTO orders (user_id, total)
+            SELECT $1, SUM(price * quantity) FROM moved
+            HAVING COUNT(*) > 0
+            RETURNING id, total, created_at
+        ), items AS (
+            INSERT INTO order_items (order_id, product_id, name, price, quantity)
+            SELECT o.id, m.product_id, m.name, m.price, m.quantity
+            FROM new_order o CROSS JOIN moved m
+            ORDER BY m.cart_id
+            RETURNING id, product_id, name, price, quantity
+        ), customer AS (
+            INSERT INTO customers (user_id, order_count, lifetime_spend)
+            SELECT $1, 1, total FROM new_order
+            ON CONFLICT (user_id) DO UPDATE
+            SET order_count = customers.order_count + 1,
+                lifetime_spend = customers.lifetime_spend + EXCLUDED.lifetime_spend
+        )
+        SELECT o.id AS order_id, o.total, o.created_at,
+               i.product_id, i.name, i.price, i.quantity
+        FROM new_order o CROSS JOIN items i
+        ORDER BY i.id
+    ''', OrderRow),
+
+    # Order history, newest first, by keyset on (created_at, id) within the
+    # user; orders_user_history_idx covers these, so pages are index-only
+    'orders_first': ('''
+        SELECT id, total, created_at FROM orders
+        WHERE user_id = $1
+        ORDER BY created_at DESC, id DESC
+        LIMIT $2
+    ''', Order),
+    'orders_older': ('''
+        SELECT id, total, created_at FROM orders
+        WHERE user_id = $1
+          AND (created_at, id) < (SELECT created_at, id FROM orders WHERE id = $2 AND user_id = $1)
+        ORDER BY created_at DESC, id DESC
+        LIMIT $3
+    ''', Order),
+    'orders_newer': ('''
+        SELECT id, total, created_at FROM orders
+        WHERE user_id = $1
+          AND (created_at, id) > (SELECT created_at, id FROM orders WHERE id = $2 AND user_id = $1)
+        ORDER BY created_at, id
+        LIMIT $3
+    ''', Order),
+    'order_summary': (
+        "SELECT order_count, lifetime_spend FROM customers WHERE user_id = $1", None
+    ),
+    'get_order': ('''
+        SELECT o.id AS order_id, o.total, o.created_at,
+               i.product_id, i.name, i.price, i.quantity
+        FROM orders o JOIN order_items i ON i.order_id = o.id
+        WHERE o.id = $1 AND o.user_id = $2
+        ORDER BY i.id
+    ''', OrderRow),
+
+    # Also returns the seconds left until the state expires
+    'fsm_get_state': ('''
+        SELECT state, EXTRACT(EPOCH FROM updated_at - now())::float8 + $2 AS expires_in
+        FROM fsm_state
+        WHERE key = $1 AND updated_at > now() - make_interval(secs => $2)
+    ''', None),
+    'fsm_get_data': ('''
+        SELECT data::text FROM fsm_state
+        WHERE key = $1 AND updated_at > now() - make_interval(secs => $2)
+    ''', None),
+    # Flags $4 and $5 say whether state and data were written
+    'fsm_set': ('''
+        INSERT INTO fsm_state (key, state, data, updated_at)
+        VALUES ($1, $2, COALESCE($3::jsonb, '{}'::jsonb), now())
+        ON CONFLICT (key) DO UPDATE SET
+            state = CASE WHEN $4 THEN EXCLUDED.state ELSE fsm_state.state END,
+            data = CASE WHEN $5 THEN EXCLUDED.data ELSE fsm_state.data END,
+            updated_at = now()
+    ''', None),
+}
+
+
+class RepositoryConnection(asyncpg.Connection):
+    """Pool connection that runs the named STATEMENTS.
+
+    Statements go through asyncpg's statement cache, so each connection
+    prepares a statement on its first use and reuses it from then on, across
+    pool acquires too (``DB_STATEMENT_CACHE_SIZE`` must hold all of them).
+    Rows come back as the statement's record class. ``on_execute``, if set,
+    is called with the statement name before every execution.
+    """
+    __slots__ = ('on_execute',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_execute: Optional[Callable[[str], None]] = None
+
+    def _named(self, name: str) -> Tuple[str, Optional[Type[asyncpg.Record]]]:
+        if self.on_execute is not None:
+            self.on_execute(name)
+        return STATEMENTS[name]
+
+    async def run(self, name: str, *args: Any) -> List[asyncpg.Record]:
+        """Execute a named statement and return its rows"""
+        sql, record_class = self._named(name)
+        return await self.fetch(sql, *args, record_class=record_class)
+
+    async def run_row(self, name: str, *args: Any) -> Optional[asyncpg.Record]:
+        sql, record_class = self._named(name)
+        return await self.fetchrow(sql, *args, record_class=record_class)
+
+    async def run_value(self, name: str, *args: Any) -> Any:
+        sql, _ = self._named(name)
+        return await self.fetchval(sql, *args)
+
+    async def run_many(self, name: str, rows: Iterable[Iterable[Any]]) -> None:
+        sql, _ = self._named(name)
+        await self.executemany(sql, rows)
@@ -0,0 +1,1058 @@
+import asyncio
+import csv
+import io
+import logging
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import partial
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple
+
+import aiosqlite
+
+from config import SQLITE_PATH, CATALOG_PAGE_SIZE, ORDERS_PAGE_SIZE, METRICS_ENABLED
+from database.cache import catalog_cache, cart_cache
+from database.errors import OutOfStock
+from database.migrations import Migration
+from utils.search import product_index
+from utils.categories import CategoryTree, category_tree
+from utils import metrics
+
+# API shared with database.postgres, re-exported by database.db
+__all__ = [
+    'init_db', 'migrate_schema', 'close_db', 'connected',
+    'add_product', 'get_all_products', 'get_product_by_id', 'get_products_page',
+    'search_products', 'update_product', 'delete_product', 'import_products', 'export_products',
+    'get_category_tree', 'add_category', 'rename_category', 'delete_category', 'set_product_category',
+    'get_stock', 'set_stock',
+    'add_to_cart', 'get_cart_items', 'remove_from_cart', 'clear_cart', 'expire_carts',
+    'release_reservations',
+    'place_order', 'get_orders_page', 'get_order_summary', 'get_order',
+    'enqueue_broadcast', 'set_broadcast_message', 'notify_price_change', 'claim_outbox', 'finish_outbox',
+    'fsm_get_state', 'fsm_get_data', 'fsm_set_many', 'fsm_cleanup',
+]
+
+# Seconds a connection waits for the file lock held by another process
+BUSY_TIMEOUT = 5
+
+# Schema of the SQLite backend, versioned with PRAGMA user_version. Prices are
+# stored in cents and timestamps as Unix seconds. Append new migrations at the
+# end, never edit one that has shipped.
+MIGRATIONS = (
+    Migration(1, "initial schema", (
+        '''
+        CREATE TABLE products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE cart (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE,
+            quantity INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            UNIQUE (user_id, product_id)
+        )
+        ''',
+        "CREATE INDEX cart_product_id_idx ON cart (product_id)",
+        "CREATE INDEX cart_updated_at_idx ON cart (updated_at)",
+        '''
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE order_items (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+            product_id INTEGER REFERENCES products (id) ON DELETE SET NULL,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            quantity INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX order_items_order_id_idx ON order_items (order_id)",
+        "CREATE INDEX order_items_product_id_idx ON order_items (product_id)",
+        '''
+        CREATE TABLE fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX fsm_state_updated_at_idx ON fsm_state (updated_at)",
+        '''
+        CREATE TABLE customers (
+            user_id INTEGER PRIMARY KEY,
+            first_seen REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            admin_id INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            total INTEGER NOT NULL,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            text TEXT,
+            broadcast_id INTEGER REFERENCES broadcasts (id) ON DELETE CASCADE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before REAL NOT NULL,
+            sent_at REAL,
+            error TEXT
+        )
+        ''',
+        "CREATE INDEX outbox_due_idx ON outbox (not_before, id) WHERE status = 'pending'",
+        "CREATE INDEX outbox_broadcast_id_idx ON outbox (broadcast_id)",
+    )),
+    Migration(2, "stock reservations", (
+        "ALTER TABLE products ADD COLUMN stock INTEGER CHECK (stock >= 0)",
+        "ALTER TABLE cart ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX cart_reserved_updated_at_idx ON cart (updated_at) WHERE reserved > 0",
+    )),
+    Migration(3, "categories", (
+        '''
+        CREATE TABLE categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER REFERENCES categories (id) ON DELETE SET NULL,
+            name TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX categories_parent_id_idx ON categories (parent_id)",
+        "ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES categories (id) ON DELETE SET NULL",
+        "CREATE INDEX products_category_id_idx ON products (category_id)",
+    )),
+    Migration(4, "order history", (
+        "ALTER TABLE customers ADD COLUMN order_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE customers ADD COLUMN lifetime_spend INTEGER NOT NULL DEFAULT 0",
+        "INSERT OR IGNORE INTO customers (user_id, first_seen) SELECT user_id, MIN(created_at) FROM orders GROUP BY user_id",
+        '''
+        UPDATE customers
+        SET order_count = o.order_count, lifetime_spend = o.lifetime_spend
+        FROM (
+            SELECT user_id, COUNT(*) AS order_count, SUM(total) AS lifetime_spend
+            FROM orders
+            GROUP BY user_id
+        ) o
+        WHERE customers.user_id = o.user_id
+        ''',
+        "CREATE INDEX orders_user_history_idx ON orders (user_id, created_at, id, total)",
+    )),
+)
+
+
+class SqliteConnection(aiosqlite.Connection):
+    """aiosqlite connection with the run helpers of RepositoryConnection.
+
+    ``on_execute``, if set, is called with the SQL before every statement
+    (the benchmarks count queries with it).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_execute: Optional[Callable[[str], None]] = None
+
+    async def run(self, sql: str, *args: Any) -> List[tuple]:
+        """Execute a statement and return its rows"""
+        if self.on_execute is not None:
+            self.on_execute(sql)
+        return list(await self.execute_fetchall(sql, args))
+
+    async def run_row(self, sql: str, *args: Any) -> Optional[tuple]:
+        rows = await self.run(sql, *args)
+        return rows[0] if rows else None
+
+    async def run_value(self, sql: str, *args: Any) -> Any:
+        row = await self.run_row(sql, *args)
+        return row[0] if row else None
+
+    async def run_count(self, sql: str, *args: Any) -> int:
+        """Execute a statement and return the number of rows it changed"""
+        if self.on_execute is not None:
+            self.on_execute(sql)
+        return (await self.execute(sql, args)).rowcount
+
+    async def run_many(self, sql: str, rows: Iterable[Iterable[Any]]) -> None:
+        if self.on_execute is not None:
+            self.on_execute(sql)
+        await self.executemany(sql, rows)
+
+
+class _Reader:
+    """Read connection; in WAL mode it reads while a write is in progress"""
+
+    def __init__(self, conn: SqliteConnection):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+class _Writer:
+    """The only write connection, running one transaction at a time.
+
+    Writers queue on an asyncio lock in arrival order instead of contending
+    for SQLite's file lock, which would block the connection's thread.
+    """
+
+    def __init__(self, conn: SqliteConnection):
+        self.conn = conn
+        self.lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.lock:
+            # A cancelled statement still runs on the connection's thread;
+            # the ROLLBACK queued behind it always ends the transaction
+            try:
+                await self.conn.execute("BEGIN IMMEDIATE")
+                yield self.conn
+            except BaseException:
+                try:
+                    await self.conn.execute("ROLLBACK")
+                except sqlite3.OperationalError:
+                    # BEGIN itself failed, there is nothing to roll back
+                    pass
+                raise
+            await self.conn.execute("COMMIT")
+
+
+reader: Optional[_Reader] = None
+writer: Optional[_Writer] = None
+
+async def _connect(connection_init=None) -> SqliteConnection:
+    conn = SqliteConnection(partial(sqlite3.connect, SQLITE_PATH, isolation_level=None), iter_chunk_size=64)
+    await conn
+    await conn.execute("PRAGMA journal_mode = WAL")
+    await conn.execute("PRAGMA synchronous = NORMAL")
+    await conn.execute("PRAGMA foreign_keys = ON")
+    await conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+    if connection_init is not None:
+        await connection_init(conn)
+    return conn
+
+async def init_db(connection_init=None):
+    """Open the database file with one read and one write connection
+
+    connection_init, if given, is awaited with both connections (used by
+    the benchmarks to attach query counters).
+    """
+    global reader, writer
+    try:
+        writer = _Writer(await _connect(connection_init))
+        reader = _Reader(await _connect(connection_init))
+        logging.info(f"SQLite database {SQLITE_PATH} opened")
+    except Exception as e:
+        logging.error(f"Error opening SQLite database: {e}")
+        raise e
+
+def reading(query: str):
+    """The read connection, timed under the query name when metrics are enabled"""
+    if METRICS_ENABLED:
+        return metrics.TimedAcquire(reader, query)
+    return reader.acquire()
+
+def writing(query: str):
+    """A write transaction on the write connection, committed on exit"""
+    if METRICS_ENABLED:
+        return metrics.TimedAcquire(writer, query)
+    return writer.acquire()
+
+async def close_db():
+    """Close both connections"""
+    global reader, writer
+    if reader is not None:
+        await reader.conn.close()
+        reader = None
+    if writer is not None:
+        await writer.conn.close()
+        writer = None
+
+def connected() -> bool:
+    return writer is not None
+
+async def migrate_schema():
+    """Apply pending schema migrations; no DDL runs when the schema is current"""
+    try:
+        async with reading("migrate_schema") as conn:
+            version = await conn.run_value("PRAGMA user_version")
+        if version >= MIGRATIONS[-1].version:
+            return
+
+        # BEGIN IMMEDIATE also makes other processes on the file wait
+        async with writing("migrate_schema") as conn:
+            version = await conn.run_value("PRAGMA user_version")
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                logging.info(f"Applying migration {migration.version}: {migration.description}")
+                for step in migration.steps:
+                    await conn.run(step)
+                version = migration.version
+            await conn.run(f"PRAGMA user_version = {version}")
+    except Exception as e:
+        logging.error(f"Error migrating schema: {e}")
+        raise e
+
+def _money(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+def _cents(price: Any) -> int:
+    return int((Decimal(str(price)) * 100).to_integral_value())
+
+def _timestamp(seconds: float) -> datetime:
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+def _product(row: tuple) -> Dict[str, Any]:
+    return {'id': row[0], 'name': row[1], 'price': _money(row[2]), 'category_id': row[3]}
+
+def _category(row: tuple) -> Dict[str, Any]:
+    return {'id': row[0], 'parent_id': row[1], 'name': row[2]}
+
+def _order_row(row: tuple) -> Dict[str, Any]:
+    return {'id': row[0], 'total': _money(row[1]), 'created_at': _timestamp(row[2])}
+
+# Product operations
+async def add_product(name: str, price: float) -> int:
+    """Add a new product"""
+    try:
+        async with writing("add_product") as conn:
+            product = _product(await conn.run_row(
+                "INSERT INTO products (name, price) VALUES (?, ?) RETURNING id, name, price, category_id",
+                name, _cents(price)
+            ))
+        # After the commit, so a reload cannot miss the new product
+        _catalog_applied(product=product)
+        return product['id']
+    except Exception as e:
+        logging.error(f"Error adding product: {e}")
+        raise e
+
+async def get_all_products() -> List[Dict[str, Any]]:
+    """Get all products (served from the catalog cache)"""
+    return await catalog_cache.get_all(_load_products)
+
+async def get_product_by_id(product_id: int) -> Optional[Dict[str, Any]]:
+    """Get product by ID (served from the catalog cache)"""
+    return await catalog_cache.get(product_id, _load_products)
+
+async def get_products_page(
+    after_id: int = 0, before_id: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """Get one catalog page by keyset on id, see database.postgres.get_products_page"""
+    if catalog_cache.loaded:
+        return catalog_cache.page(after_id, before_id, CATALOG_PAGE_SIZE)
+
+    async with reading("get_products_page") as conn:
+        try:
+            if before_id is not None:
+                rows = await conn.run(
+                    "SELECT id, name, price, category_id FROM products WHERE id < ? ORDER BY id DESC LIMIT ?",
+                    before_id, CATALOG_PAGE_SIZE + 1
+                )
+                products = [_product(row) for row in rows[:CATALOG_PAGE_SIZE][::-1]]
+                return products, len(rows) > CATALOG_PAGE_SIZE, True
+
+            rows = await conn.run(
+                "SELECT id, name, price, category_id FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                after_id, CATALOG_PAGE_SIZE + 1
+            )
+            products = [_product(row) for row in rows[:CATALOG_PAGE_SIZE]]
+            return products, after_id > 0, len(rows) > CATALOG_PAGE_SIZE
+        except Exception as e:
+            logging.error(f"Error getting products page: {e}")
+            raise e
+
+async def search_products(query: str, limit: int) -> List[Dict[str, Any]]:
+    """Search products by name in the in-memory index, rebuilt only after catalog changes"""
+    if product_index.version != catalog_cache.version:
+        version = catalog_cache.version
+        product_index.rebuild(await get_all_products(), version)
+    return product_index.search(query, limit)
+
+def _catalog_applied(
+    product: Optional[Dict[str, Any]] = None,
+    removed_id: Optional[int] = None,
+    category: Optional[Dict[str, Any]] = None,
+    removed_category_id: Optional[int] = None
+) -> None:
+    """Bump the catalog version after a single write and apply it to the search index and category tree"""
+    version = catalog_cache.invalidate()
+    product_index.apply(version, product=product, removed_id=removed_id)
+    category_tree.apply(
+        version, category=category, removed_category_id=removed_category_id,
+        product=product, removed_id=removed_id
+    )
+
+async def _load_products() -> List[Dict[str, Any]]:
+    """Read the whole catalog from the database"""
+    async with reading("load_products") as conn:
+        try:
+            rows = await conn.run("SELECT id, name, price, category_id FROM products ORDER BY id")
+            return [_product(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error getting products: {e}")
+            raise e
+
+async def update_product(product_id: int, name: str, price: float) -> None:
+    """Update product information"""
+    try:
+        async with writing("update_product") as conn:
+            row = await conn.run_row(
+                "UPDATE products SET name = ?, price = ? WHERE id = ? RETURNING id, name, price, category_id",
+                name, _cents(price), product_id
+            )
+        if row:
+            _catalog_applied(product=_product(row))
+        else:
+            catalog_cache.invalidate()
+    except Exception as e:
+        logging.error(f"Error updating product: {e}")
+        raise e
+
+async def delete_product(product_id: int) -> None:
+    """Delete a product"""
+    try:
+        async with writing("delete_product") as conn:
+            await conn.run("DELETE FROM products WHERE id = ?", product_id)
+        _catalog_applied(removed_id=product_id)
+    except Exception as e:
+        logging.error(f"Error deleting product: {e}")
+        raise e
+
+async def import_products(records: Iterable[Tuple[Optional[int], str, Decimal]]) -> Tuple[int, int]:
+    """Bulk load (id, name, price) records into the catalog.
+
+    Records are inserted into a temporary staging table and merged like in
+    database.postgres.import_products. Returns (updated, inserted).
+    """
+    try:
+        async with writing("import_products") as conn:
+            await conn.run('''
+            CREATE TEMPORARY TABLE products_import (
+                id INTEGER,
+                name TEXT NOT NULL,
+                price INTEGER NOT NULL
+            )
+            ''')
+            try:
+                await conn.run_many(
+                    "INSERT INTO products_import (id, name, price) VALUES (?, ?, ?)",
+                    ((product_id, name, _cents(price)) for product_id, name, price in records)
+                )
+                updated = await conn.run_count('''
+                UPDATE products SET name = s.name, price = s.price
+                FROM products_import s
+                WHERE products.id = s.id
+                ''')
+                inserted = await conn.run_count('''
+                INSERT INTO products (name, price)
+                SELECT s.name, s.price
+                FROM products_import s
+                WHERE s.id IS NULL
+                   OR NOT EXISTS (SELECT 1 FROM products p WHERE p.id = s.id)
+                ORDER BY s.rowid
+                ''')
+            finally:
+                await conn.run("DROP TABLE products_import")
+        catalog_cache.invalidate()
+        return updated, inserted
+    except Exception as e:
+        logging.error(f"Error importing products: {e}")
+        raise e
+
+async def export_products(output: Any) -> int:
+    """Write the catalog as CSV (id, name, price) to a path or binary file, returning the row count"""
+    async with reading("export_products") as conn:
+        try:
+            rows = await conn.run("SELECT id, name, price FROM products ORDER BY id")
+        except Exception as e:
+            logging.error(f"Error exporting products: {e}")
+            raise e
+
+    text = io.StringIO()
+    out = csv.writer(text, lineterminator='\n')
+    out.writerow(('id', 'name', 'price'))
+    out.writerows((row[0], row[1], _money(row[2])) for row in rows)
+    data = text.getvalue().encode()
+    if hasattr(output, 'write'):
+        output.write(data)
+    else:
+        with open(output, 'wb') as file:
+            file.write(data)
+    return len(rows)
+
+# Category operations, see database.postgres
+async def get_category_tree() -> CategoryTree:
+    """The category tree with product counts, rebuilt only after catalog changes it did not apply"""
+    if category_tree.version != catalog_cache.version:
+        version = catalog_cache.version
+        categories = await _load_categories()
+        category_tree.rebuild(categories, await get_all_products(), version)
+    return category_tree
+
+async def _load_categories() -> List[Dict[str, Any]]:
+    """Read every category from the database"""
+    async with reading("load_categories") as conn:
+        try:
+            rows = await conn.run("SELECT id, parent_id, name FROM categories")
+            return [_category(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error getting categories: {e}")
+            raise e
+
+async def add_category(name: str, parent_id: Optional[int] = None) -> int:
+    """Add a category, at the top level when parent_id is None"""
+    try:
+        async with writing("add_category") as conn:
+            category = _category(await conn.run_row(
+                "INSERT INTO categories (name, parent_id) VALUES (?, ?) RETURNING id, parent_id, name",
+                name, parent_id
+            ))
+        _catalog_applied(category=category)
+        return category['id']
+    except Exception as e:
+        logging.error(f"Error adding category: {e}")
+        raise e
+
+async def rename_category(category_id: int, name: str) -> None:
+    """Rename a category"""
+    try:
+        async with writing("rename_category") as conn:
+            row = await conn.run_row(
+                "UPDATE categories SET name = ? WHERE id = ? RETURNING id, parent_id, name",
+                name, category_id
+            )
+        if row:
+            _catalog_applied(category=_category(row))
+    except Exception as e:
+        logging.error(f"Error renaming category: {e}")
+        raise e
+
+async def delete_category(category_id: int) -> None:
+    """Delete a category; its subcategories and products move up to its parent"""
+    try:
+        async with writing("delete_category") as conn:
+            parent = "(SELECT parent_id FROM categories WHERE id = ?)"
+            await conn.run(f"UPDATE categories SET parent_id = {parent} WHERE parent_id = ?", category_id, category_id)
+            await conn.run(f"UPDATE products SET category_id = {parent} WHERE category_id = ?", category_id, category_id)
+            await conn.run("DELETE FROM categories WHERE id = ?", category_id)
+        _catalog_applied(removed_category_id=category_id)
+    except Exception as e:
+        logging.error(f"Error deleting category: {e}")
+        raise e
+
+async def set_product_category(product_id: int, category_id: Optional[int]) -> None:
+    """Move a product to a category, None lists it at the top level"""
+    try:
+        async with writing("set_product_category") as conn:
+            row = await conn.run_row(
+                "UPDATE products SET category_id = ? WHERE id = ? RETURNING id, name, price, category_id",
+                category_id, product_id
+            )
+        if row:
+            _catalog_applied(product=_product(row))
+    except Exception as e:
+        logging.error(f"Error setting product category: {e}")
+        raise e
+
+# Stock operations, see database.postgres
+async def get_stock(product_id: int) -> Optional[int]:
+    """Unreserved stock of a product, None if it is not tracked"""
+    async with reading("get_stock") as conn:
+        try:
+            return await conn.run_value("SELECT stock FROM products WHERE id = ?", product_id)
+        except Exception as e:
+            logging.error(f"Error getting stock: {e}")
+            raise e
+
+async def set_stock(product_id: int, stock: Optional[int]) -> None:
+    """Set the unreserved stock of a product, None stops tracking it"""
+    try:
+        async with writing("set_stock") as conn:
+            await conn.run("UPDATE products SET stock = ? WHERE id = ?", stock, product_id)
+    except Exception as e:
+        logging.error(f"Error setting stock: {e}")
+        raise e
+
+async def _restock(conn: SqliteConnection, released: Iterable[Tuple[int, int]]) -> None:
+    """Give (product_id, reserved) amounts of removed or released cart lines back"""
+    totals: Dict[int, int] = {}
+    for product_id, reserved in released:
+        if reserved:
+            totals[product_id] = totals.get(product_id, 0) + reserved
+    if totals:
+        await conn.run_many(
+            "UPDATE products SET stock = stock + ? WHERE id = ? AND stock IS NOT NULL",
+            [(reserved, product_id) for product_id, reserved in totals.items()]
+        )
+
+# Cart operations
+async def add_to_cart(user_id: int, product_id: int, quantity: int) -> bool:
+    """Add product to cart, reserving tracked stock. False if not enough is left"""
+    try:
+        async with writing("add_to_cart") as conn:
+            now = time.time()
+            product = await conn.run_row("SELECT stock FROM products WHERE id = ?", product_id)
+            if product is None:
+                return False
+            reserved = 0
+            if product[0] is not None:
+                if not await conn.run_count(
+                    "UPDATE products SET stock = stock - ?1 WHERE id = ?2 AND stock >= ?1",
+                    quantity, product_id
+                ):
+                    return False
+                reserved = quantity
+            await conn.run(
+                "INSERT INTO customers (user_id, first_seen) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                user_id, now
+            )
+            await conn.run('''
+            INSERT INTO cart (user_id, product_id, quantity, reserved, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, product_id)
+            DO UPDATE SET quantity = quantity + excluded.quantity,
+                          reserved = reserved + excluded.reserved,
+                          updated_at = excluded.updated_at
+            ''', user_id, product_id, quantity, reserved, now)
+        cart_cache.bump(user_id)
+        return True
+    except Exception as e:
+        logging.error(f"Error adding to cart: {e}")
+        raise e
+
+async def get_cart_items(user_id: int) -> List[Dict[str, Any]]:
+    """Get user's cart items with product details"""
+    async with reading("get_cart_items") as conn:
+        try:
+            rows = await conn.run('''
+            SELECT c.id, c.product_id, c.quantity, p.name, p.price
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+            ORDER BY c.id
+            ''', user_id)
+            return [
+                {'id': row[0], 'product_id': row[1], 'quantity': row[2], 'name': row[3], 'price': _money(row[4])}
+                for row in rows
+            ]
+        except Exception as e:
+            logging.error(f"Error getting cart items: {e}")
+            raise e
+
+async def remove_from_cart(user_id: int, cart_id: int) -> None:
+    """Remove item from cart"""
+    try:
+        async with writing("remove_from_cart") as conn:
+            await _restock(conn, await conn.run(
+                "DELETE FROM cart WHERE id = ? AND user_id = ? RETURNING product_id, reserved", cart_id, user_id
+            ))
+        cart_cache.bump(user_id)
+    except Exception as e:
+        logging.error(f"Error removing from cart: {e}")
+        raise e
+
+async def clear_cart(user_id: int) -> None:
+    """Clear user's cart"""
+    try:
+        async with writing("clear_cart") as conn:
+            await _restock(conn, await conn.run(
+                "DELETE FROM cart WHERE user_id = ? RETURNING product_id, reserved", user_id
+            ))
+        cart_cache.bump(user_id)
+    except Exception as e:
+        logging.error(f"Error clearing cart: {e}")
+        raise e
+
+async def expire_carts(ttl: float, batch_size: int) -> int:
+    """Delete up to batch_size lines of carts untouched for ttl seconds, returning how many.
+
+    A cart expires as a whole: lines are kept while any line of the same
+    user changed recently. Reserved stock goes back to the products.
+    """
+    try:
+        async with writing("expire_carts") as conn:
+            rows = await conn.run('''
+            DELETE FROM cart
+            WHERE id IN (
+                SELECT c.id FROM cart c
+                WHERE c.updated_at < ?1
+                  AND NOT EXISTS (
+                      SELECT 1 FROM cart r
+                      WHERE r.user_id = c.user_id AND r.updated_at >= ?1
+                  )
+                LIMIT ?2
+            )
+            RETURNING user_id, product_id, reserved
+            ''', time.time() - ttl, batch_size)
+            await _restock(conn, ((row[1], row[2]) for row in rows))
+        for user_id in {row[0] for row in rows}:
+            cart_cache.bump(user_id)
+        return len(rows)
+    except Exception as e:
+        logging.error(f"Error expiring carts: {e}")
+        raise e
+
+async def release_reservations(ttl: float, batch_size: int) -> int:
+    """Return the stock held by up to batch_size lines of carts untouched for ttl seconds.
+
+    The lines stay in the cart; checkout reserves them again. Returns how
+    many lines were released.
+    """
+    try:
+        async with writing("release_reservations") as conn:
+            rows = await conn.run('''
+            SELECT c.id, c.product_id, c.reserved FROM cart c
+            WHERE c.reserved > 0
+              AND c.updated_at < ?1
+              AND NOT EXISTS (
+                  SELECT 1 FROM cart r
+                  WHERE r.user_id = c.user_id AND r.updated_at >= ?1
+              )
+            LIMIT ?2
+            ''', time.time() - ttl, batch_size)
+            await conn.run_many("UPDATE cart SET reserved = 0 WHERE id = ?", [(row[0],) for row in rows])
+            await _restock(conn, ((row[1], row[2]) for row in rows))
+        return len(rows)
+    except Exception as e:
+        logging.error(f"Error releasing stock reservations: {e}")
+        raise e
+
+# Order operations
+async def place_order(user_id: int) -> Optional[Dict[str, Any]]:
+    """Move the user's cart into a new order in one write transaction.
+
+    Tracked lines lacking their reservation are reserved in one statement
+    first; raises OutOfStock when the stock is not there. Returns None when
+    the cart is empty, otherwise the order like database.postgres.place_order.
+    """
+    try:
+        async with writing("place_order") as conn:
+            lines = await conn.run('''
+            SELECT c.product_id, c.quantity, p.name, p.price, c.quantity - c.reserved, p.stock
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+            ORDER BY c.id
+            ''', user_id)
+            if not lines:
+                return None
+
+            # The write lock makes the stock read above current
+            short = [line for line in lines if line[5] is not None and line[4] > 0]
+            missing = [line[2] for line in short if line[5] < line[4]]
+            if missing:
+                raise OutOfStock(missing)
+            if short:
+                await conn.run('''
+                UPDATE products SET stock = stock - c.quantity + c.reserved
+                FROM cart c
+                WHERE c.user_id = ? AND c.product_id = products.id
+                  AND c.quantity > c.reserved AND products.stock IS NOT NULL
+                ''', user_id)
+
+            created_at = time.time()
+            total = sum(line[1] * line[3] for line in lines)
+            order_id = await conn.run_value(
+                "INSERT INTO orders (user_id, total, created_at) VALUES (?, ?, ?) RETURNING id",
+                user_id, total, created_at
+            )
+            await conn.run_many(
+                "INSERT INTO order_items (order_id, product_id, name, price, quantity) VALUES (?, ?, ?, ?, ?)",
+                [(order_id, product_id, name, price, quantity) for product_id, quantity, name, price, _, _ in lines]
+            )
+            await conn.run("DELETE FROM cart WHERE user_id = ?", user_id)
+            await conn.run('''
+            INSERT INTO customers (user_id, first_seen, order_count, lifetime_spend) VALUES (?, ?, 1, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET order_count = order_count + 1, lifetime_spend = lifetime_spend + excluded.lifetime_spend
+            ''', user_id, created_at, total)
+        cart_cache.bump(user_id)
+    except OutOfStock:
+        raise
+    except Exception as e:
+        logging.error(f"Error placing order: {e}")
+        raise e
+
+    order = {
+        'id': order_id,
+        'total': _money(total),
+        'created_at': _timestamp(created_at)
+    }
+    order['items'] = [
+        {
+            'order_id': order_id, 'total': order['total'], 'created_at': order['created_at'],
+            'product_id': product_id, 'name': name, 'price': _money(price), 'quantity': quantity
+        }
+        for product_id, quantity, name, price, _, _ in lines
+    ]
+    return order
+
+async def get_orders_page(
+    user_id: int, after_id: int = 0, before_id: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """Get one page of the user's order history, see database.postgres.get_orders_page"""
+    async with reading("get_orders_page") as conn:
+        try:
+            if before_id is not None:
+                rows = await conn.run('''
+                SELECT id, total, created_at FROM orders
+                WHERE user_id = ?1
+                  AND (created_at, id) > (SELECT created_at, id FROM orders WHERE id = ?2 AND user_id = ?1)
+                ORDER BY created_at, id
+                LIMIT ?3
+                ''', user_id, before_id, ORDERS_PAGE_SIZE + 1)
+                if rows:
+                    orders = [_order_row(row) for row in rows[:ORDERS_PAGE_SIZE][::-1]]
+                    return orders, len(rows) > ORDERS_PAGE_SIZE, True
+            elif after_id:
+                rows = await conn.run('''
+                SELECT id, total, created_at FROM orders
+                WHERE user_id = ?1
+                  AND (created_at, id) < (SELECT created_at, id FROM orders WHERE id = ?2 AND user_id = ?1)
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?3
+                ''', user_id, after_id, ORDERS_PAGE_SIZE + 1)
+                if rows:
+                    orders = [_order_row(row) for row in rows[:ORDERS_PAGE_SIZE]]
+                    return orders, True, len(rows) > ORDERS_PAGE_SIZE
+
+            rows = await conn.run(
+                "SELECT id, total, created_at FROM orders WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                user_id, ORDERS_PAGE_SIZE + 1
+            )
+            orders = [_order_row(row) for row in rows[:ORDERS_PAGE_SIZE]]
+            return orders, False, len(rows) > ORDERS_PAGE_SIZE
+        except Exception as e:
+            logging.error(f"Error getting orders page: {e}")
+            raise e
+
+async def get_order_summary(user_id: int) -> Tuple[int, Decimal]:
+    """The user's order count and lifetime spend, kept up to date by place_order"""
+    async with reading("get_order_summary") as conn:
+        try:
+            row = await conn.run_row(
+                "SELECT order_count, lifetime_spend FROM customers WHERE user_id = ?", user_id
+            )
+            return (row[0], _money(row[1])) if row else (0, _money(0))
+        except Exception as e:
+            logging.error(f"Error getting order summary: {e}")
+            raise e
+
+async def get_order(user_id: int, order_id: int) -> Optional[Dict[str, Any]]:
+    """One of the user's orders like place_order returns it, None if it is not theirs"""
+    async with reading("get_order") as conn:
+        try:
+            rows = await conn.run('''
+            SELECT o.id, o.total, o.created_at, i.product_id, i.name, i.price, i.quantity
+            FROM orders o JOIN order_items i ON i.order_id = o.id
+            WHERE o.id = ? AND o.user_id = ?
+            ORDER BY i.id
+            ''', order_id, user_id)
+        except Exception as e:
+            logging.error(f"Error getting order: {e}")
+            raise e
+
+    if not rows:
+        return None
+
+    order = _order_row(rows[0])
+    order['items'] = [
+        {
+            'order_id': order['id'], 'total': order['total'], 'created_at': order['created_at'],
+            'product_id': product_id, 'name': name, 'price': _money(price), 'quantity': quantity
+        }
+        for _, _, _, product_id, name, price, quantity in rows
+    ]
+    return order
+
+# Outbox operations
+async def enqueue_broadcast(text: str, admin_id: int) -> Tuple[int, int]:
+    """Queue a message to every customer, returning (broadcast id, recipients)"""
+    try:
+        async with writing("enqueue_broadcast") as conn:
+            now = time.time()
+            row = await conn.run_row('''
+            INSERT INTO broadcasts (text, admin_id, total, created_at)
+            SELECT ?, ?, COUNT(*), ? FROM customers
+            RETURNING id, total
+            ''', text, admin_id, now)
+            await conn.run('''
+            INSERT INTO outbox (chat_id, broadcast_id, not_before)
+            SELECT user_id, ?, ? FROM customers
+            ''', row[0], now)
+        return row[0], row[1]
+    except Exception as e:
+        logging.error(f"Error enqueueing broadcast: {e}")
+        raise e
+
+async def set_broadcast_message(broadcast_id: int, message_id: int) -> None:
+    """Remember the admin's message that shows the broadcast's progress"""
+    try:
+        async with writing("set_broadcast_message") as conn:
+            await conn.run(
+                "UPDATE broadcasts SET progress_message_id = ? WHERE id = ?",
+                message_id, broadcast_id
+            )
+    except Exception as e:
+        logging.error(f"Error saving broadcast message: {e}")
+        raise e
+
+async def notify_price_change(product_id: int, text: str) -> int:
+    """Queue a message to everyone with the product in their cart, returning how many"""
+    try:
+        async with writing("notify_price_change") as conn:
+            return await conn.run_count('''
+            INSERT INTO outbox (chat_id, text, not_before)
+            SELECT DISTINCT user_id, ?, ? FROM cart WHERE product_id = ?
+            ''', text, time.time(), product_id)
+    except Exception as e:
+        logging.error(f"Error queueing price notifications: {e}")
+        raise e
+
+async def claim_outbox(limit: int, lease: float) -> List[Dict[str, Any]]:
+    """Take up to limit due messages for delivery, hiding them for lease seconds"""
+    try:
+        async with writing("claim_outbox") as conn:
+            now = time.time()
+            rows = await conn.run('''
+            UPDATE outbox SET not_before = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND not_before <= ?
+                ORDER BY not_before, id
+                LIMIT ?
+            )
+            RETURNING id, chat_id, broadcast_id, attempts,
+                      COALESCE(text, (SELECT b.text FROM broadcasts b WHERE b.id = outbox.broadcast_id))
+            ''', now + lease, now, limit)
+        keys = ('id', 'chat_id', 'broadcast_id', 'attempts', 'text')
+        return sorted((dict(zip(keys, row)) for row in rows), key=lambda row: row['id'])
+    except Exception as e:
+        logging.error(f"Error claiming outbox messages: {e}")
+        raise e
+
+async def finish_outbox(
+    sent: List[Dict[str, Any]],
+    failed: List[Tuple[Dict[str, Any], str]],
+    retry: List[Tuple[Dict[str, Any], float, str]]
+) -> List[Dict[str, Any]]:
+    """Record delivery results of claimed messages, see database.postgres.finish_outbox"""
+    counts: Dict[int, List[int]] = {}
+    for message in sent:
+        if message['broadcast_id'] is not None:
+            counts.setdefault(message['broadcast_id'], [0, 0])[0] += 1
+    for message, _ in failed:
+        if message['broadcast_id'] is not None:
+            counts.setdefault(message['broadcast_id'], [0, 0])[1] += 1
+
+    try:
+        async with writing("finish_outbox") as conn:
+            now = time.time()
+            if sent:
+                await conn.run_many(
+                    "UPDATE outbox SET status = 'sent', sent_at = ? WHERE id = ?",
+                    [(now, message['id']) for message in sent]
+                )
+            if failed:
+                await conn.run_many(
+                    "UPDATE outbox SET status = 'failed', error = ? WHERE id = ?",
+                    [(error, message['id']) for message, error in failed]
+                )
+            if retry:
+                # A message put back without being sent (no error) keeps its attempt
+                await conn.run_many('''
+                UPDATE outbox
+                SET not_before = ?1, error = ?2,
+                    attempts = attempts - (CASE WHEN ?2 IS NULL THEN 1 ELSE 0 END)
+                WHERE id = ?3
+                ''', [(now + delay, error, message['id']) for message, delay, error in retry])
+            progress = []
+            for broadcast_id, (sent_count, failed_count) in counts.items():
+                row = await conn.run_row('''
+                UPDATE broadcasts SET sent = sent + ?, failed = failed + ?
+                WHERE id = ?
+                RETURNING id, admin_id, progress_message_id, total, sent, failed
+                ''', sent_count, failed_count, broadcast_id)
+                if row:
+                    keys = ('id', 'admin_id', 'progress_message_id', 'total', 'sent', 'failed')
+                    progress.append(dict(zip(keys, row)))
+        return progress
+    except Exception as e:
+        logging.error(f"Error recording outbox results: {e}")
+        raise e
+
+# FSM state operations, used by database.fsm_storage
+async def fsm_get_state(key: str, ttl: int) -> Tuple[Optional[str], float]:
+    """State of a storage key and the seconds until it expires, see database.postgres.fsm_get_state"""
+    now = time.time()
+    async with reading("fsm_get_state") as conn:
+        try:
+            row = await conn.run_row(
+                "SELECT state, updated_at + ?2 - ?3 FROM fsm_state WHERE key = ?1 AND updated_at > ?3 - ?2",
+                key, ttl, now
+            )
+            return (row[0], row[1]) if row else (None, 0.0)
+        except Exception as e:
+            logging.error(f"Error getting FSM state: {e}")
+            raise e
+
+async def fsm_get_data(key: str, ttl: int) -> Optional[str]:
+    """Data of a storage key as JSON text, None if unset or expired"""
+    async with reading("fsm_get_data") as conn:
+        try:
+            return await conn.run_value(
+                "SELECT data FROM fsm_state WHERE key = ? AND updated_at > ?", key, time.time() - ttl
+            )
+        except Exception as e:
+            logging.error(f"Error getting FSM data: {e}")
+            raise e
+
+async def fsm_set_many(rows: List[Tuple[str, Optional[str], Optional[str], bool, bool]]) -> None:
+    """Upsert (key, state, data JSON, state written, data written) rows in one batch"""
+    now = time.time()
+    try:
+        async with writing("fsm_flush") as conn:
+            await conn.run_many('''
+            INSERT INTO fsm_state (key, state, data, updated_at)
+            VALUES (?1, ?2, COALESCE(?3, '{}'), ?6)
+            ON CONFLICT (key) DO UPDATE SET
+                state = CASE WHEN ?4 THEN excluded.state ELSE state END,
+                data = CASE WHEN ?5 THEN excluded.data ELSE data END,
+                updated_at = excluded.updated_at
+            ''', [row + (now,) for row in rows])
+    except Exception as e:
+        logging.error(f"Error saving FSM states: {e}")
+        raise e
+
+async def fsm_cleanup(ttl: int) -> int:
+    """Delete expired and cleared states, returning the number removed"""
+    try:
+        async with writing("fsm_cleanup") as conn:
+            return await conn.run_count('''
+            DELETE FROM fsm_state
+            WHERE updated_at < ? OR (state IS NULL AND data = '{}')
+            ''', time.time() - ttl)
+    except Exception as e:
+        logging.error(f"Error cleaning up FSM states: {e}")
+        raise e
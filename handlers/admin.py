@@ -1,18 +1,39 @@
+import html
+import os
+import tempfile
+import time
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command, Text
+from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 
 from config import ADMIN_IDS
 from states import AdminStates
 from keyboards import admin_kb, user_kb
+from keyboards.catalog import catalog_page_keyboard
+from utils.misc import format_price, parse_page_callback
+from utils.catalog_csv import CatalogRows
+from utils.render import render_categories, answer_chunks
 from database.db import (
     add_product,
-    get_all_products,
     get_product_by_id,
     update_product,
-    delete_product
+    delete_product,
+    get_category_tree,
+    add_category,
+    rename_category,
+    delete_category,
+    set_product_category,
+    get_stock,
+    set_stock,
+    import_products,
+    export_products,
+    enqueue_broadcast,
+    set_broadcast_message,
+    notify_price_change
 )
+from outbox import outbox_sender
 
 # Initialize router
 admin_router = Router()
@@ -30,24 +51,24 @@ async def cmd_admin(message: Message):
     
     await message.answer(
         "Admin panelga xush kelibsiz!",
-        reply_markup=admin_kb.admin_menu()
+        reply_markup=admin_kb.ADMIN_MENU
     )
 
-@admin_router.message(Text(text="➕ Mahsulot qo'shish"))
-async def add_product_start(message: Message):
+@admin_router.message(F.text == "➕ Mahsulot qo'shish")
+async def add_product_start(message: Message, state: FSMContext):
     """Start adding a new product"""
     if not is_admin(message):
         return
     
     await message.answer("Yangi mahsulot nomini kiriting:")
-    await AdminStates.add_product_name.set()
+    await state.set_state(AdminStates.add_product_name)
 
-@admin_router.message(Text(text="🔙 Asosiy menyu"))
+@admin_router.message(F.text == "🔙 Asosiy menyu")
 async def back_to_main_menu(message: Message):
     """Return to main menu"""
     await message.answer(
         "Asosiy menyuga qaytdingiz.",
-        reply_markup=user_kb.main_menu()
+        reply_markup=user_kb.MAIN_MENU
     )
 
 @admin_router.message(AdminStates.add_product_name)
@@ -77,26 +98,31 @@ async def add_product_price(message: Message, state: FSMContext):
     
     await message.answer(
         f"Mahsulot qo'shildi:\nNomi: {name}\nNarxi: {price} so'm",
-        reply_markup=admin_kb.admin_menu()
+        reply_markup=admin_kb.ADMIN_MENU
     )
     
     await state.clear()
 
-@admin_router.message(Text(text="✏️ Mahsulotni o'zgartirish"))
+@admin_router.message(F.text == "✏️ Mahsulotni o'zgartirish")
 async def edit_product_start(message: Message):
     """Start editing a product"""
     if not is_admin(message):
         return
     
-    products = await get_all_products()
-    if not products:
+    keyboard = await catalog_page_keyboard(admin_kb.product_list_for_edit)
+    if keyboard is None:
         await message.answer("Hozircha mahsulotlar mavjud emas.")
         return
     
-    await message.answer(
-        "O'zgartirish uchun mahsulotni tanlang:",
-        reply_markup=admin_kb.product_list_for_edit(products)
-    )
+    await message.answer("O'zgartirish uchun mahsulotni tanlang:", reply_markup=keyboard)
+
+@admin_router.callback_query(F.data.startswith("edit_page:"))
+async def edit_product_page(callback: CallbackQuery):
+    """Switch the editing list message to another page"""
+    after_id, before_id = parse_page_callback(callback.data)
+    keyboard = await catalog_page_keyboard(admin_kb.product_list_for_edit, after_id, before_id)
+    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer()
 
 @admin_router.callback_query(F.data.startswith("edit:"))
 async def edit_product_selected(callback: CallbackQuery, state: FSMContext):
@@ -113,7 +139,7 @@ async def edit_product_selected(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer(
         f"Mahsulot: {product['name']}, Narxi: {product['price']} so'm\n\n"
         f"Nimani o'zgartirmoqchisiz?",
-        reply_markup=admin_kb.edit_options()
+        reply_markup=admin_kb.EDIT_OPTIONS
     )
     
     await callback.answer()
@@ -129,6 +155,20 @@ async def edit_option_selected(callback: CallbackQuery, state: FSMContext):
     elif option == 'price':
         await callback.message.answer("Yangi narxni kiriting (faqat raqam):")
         await state.set_state(AdminStates.edit_product_price)
+    elif option == 'stock':
+        user_data = await state.get_data()
+        stock = await get_stock(user_data.get('product_id'))
+        await callback.message.answer(
+            f"Hozirgi qoldiq: {'hisoblanmaydi' if stock is None else stock}\n"
+            "Savatlarda band qilinmagan yangi qoldiqni kiriting "
+            "(hisobni to'xtatish uchun \"-\"):"
+        )
+        await state.set_state(AdminStates.edit_product_stock)
+    elif option == 'category':
+        tree = await get_category_tree()
+        await answer_chunks(callback.message, render_categories(tree.outline()))
+        await callback.message.answer("Kategoriya id sini kiriting (yuqori darajaga chiqarish uchun 0):")
+        await state.set_state(AdminStates.edit_product_category)
     
     await callback.answer()
 
@@ -144,7 +184,7 @@ async def edit_product_name(message: Message, state: FSMContext):
     
     await message.answer(
         f"Mahsulot nomi o'zgartirildi:\nYangi nomi: {new_name}",
-        reply_markup=admin_kb.admin_menu()
+        reply_markup=admin_kb.ADMIN_MENU
     )
     
     await state.clear()
@@ -167,28 +207,99 @@ async def edit_product_price(message: Message, state: FSMContext):
     product = await get_product_by_id(product_id)
     await update_product(product_id, name=product['name'], price=new_price)
     
+    # Tell everyone who has the product in their cart
+    notified = 0
+    if new_price != product['price']:
+        notified = await notify_price_change(product_id, (
+            f"🔔 Savatingizdagi mahsulot narxi o'zgardi:\n"
+            f"{html.escape(product['name'])}: {format_price(product['price'])} → {format_price(new_price)} so'm"
+        ))
+        if notified:
+            outbox_sender.wake()
+    
+    await message.answer(
+        f"Mahsulot narxi o'zgartirildi:\nMahsulot: {product['name']}\nYangi narxi: {new_price} so'm\n"
+        f"Xabardor qilinadigan xaridorlar: {notified}",
+        reply_markup=admin_kb.ADMIN_MENU
+    )
+    
+    await state.clear()
+
+@admin_router.message(AdminStates.edit_product_stock)
+async def edit_product_stock(message: Message, state: FSMContext):
+    """Process new stock input, "-" stops tracking the product's stock"""
+    text = message.text.strip()
+    if text == "-":
+        stock = None
+    else:
+        try:
+            stock = int(text)
+            if stock < 0:
+                await message.answer("Qoldiq manfiy bo'lishi mumkin emas. Qaytadan kiriting:")
+                return
+        except ValueError:
+            await message.answer("Iltimos, butun son yoki \"-\" kiriting. Qaytadan urinib ko'ring:")
+            return
+    
+    user_data = await state.get_data()
+    product_id = user_data.get('product_id')
+    
+    await set_stock(product_id, stock)
+    
+    await message.answer(
+        f"Mahsulot qoldig'i o'zgartirildi: {'hisoblanmaydi' if stock is None else stock}",
+        reply_markup=admin_kb.ADMIN_MENU
+    )
+    
+    await state.clear()
+
+@admin_router.message(AdminStates.edit_product_category)
+async def edit_product_category(message: Message, state: FSMContext):
+    """Process new category id input, 0 lists the product at the top level"""
+    try:
+        category_id = int(message.text) or None
+    except ValueError:
+        await message.answer("Iltimos, kategoriya id sini kiriting. Qaytadan urinib ko'ring:")
+        return
+    
+    tree = await get_category_tree()
+    if category_id not in tree:
+        await message.answer("Bunday kategoriya yo'q. Qaytadan kiriting:")
+        return
+    
+    user_data = await state.get_data()
+    product_id = user_data.get('product_id')
+    
+    await set_product_category(product_id, category_id)
+    
+    category = tree.get(category_id) if category_id else None
     await message.answer(
-        f"Mahsulot narxi o'zgartirildi:\nMahsulot: {product['name']}\nYangi narxi: {new_price} so'm",
-        reply_markup=admin_kb.admin_menu()
+        f"Mahsulot kategoriyasi o'zgartirildi: {html.escape(category['name']) if category else 'yuqori daraja'}",
+        reply_markup=admin_kb.ADMIN_MENU
     )
     
     await state.clear()
 
-@admin_router.message(Text(text="❌ Mahsulotni o'chirish"))
+@admin_router.message(F.text == "❌ Mahsulotni o'chirish")
 async def delete_product_start(message: Message):
     """Start deleting a product"""
     if not is_admin(message):
         return
     
-    products = await get_all_products()
-    if not products:
+    keyboard = await catalog_page_keyboard(admin_kb.product_list_for_delete)
+    if keyboard is None:
         await message.answer("Hozircha mahsulotlar mavjud emas.")
         return
     
-    await message.answer(
-        "O'chirish uchun mahsulotni tanlang:",
-        reply_markup=admin_kb.product_list_for_delete(products)
-    )
+    await message.answer("O'chirish uchun mahsulotni tanlang:", reply_markup=keyboard)
+
+@admin_router.callback_query(F.data.startswith("delete_page:"))
+async def delete_product_page(callback: CallbackQuery):
+    """Switch the deleting list message to another page"""
+    after_id, before_id = parse_page_callback(callback.data)
+    keyboard = await catalog_page_keyboard(admin_kb.product_list_for_delete, after_id, before_id)
+    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer()
 
 @admin_router.callback_query(F.data.startswith("delete:"))
 async def delete_product_selected(callback: CallbackQuery):
@@ -204,7 +315,174 @@ async def delete_product_selected(callback: CallbackQuery):
     
     await callback.message.answer(
         f"Mahsulot o'chirildi: {product['name']}",
-        reply_markup=admin_kb.admin_menu()
+        reply_markup=admin_kb.ADMIN_MENU
     )
     
     await callback.answer()
+
+@admin_router.message(F.text == "🗂 Kategoriyalar")
+async def show_categories(message: Message):
+    """Show the category tree with ids and the commands that change it"""
+    if not is_admin(message):
+        return
+    
+    tree = await get_category_tree()
+    await answer_chunks(message, render_categories(tree.outline()), reply_markup=admin_kb.ADMIN_MENU)
+
+def parse_category_args(args):
+    """Split "<id> <name>" command arguments into (id, name), None if malformed"""
+    parts = (args or "").split(maxsplit=1)
+    if len(parts) != 2 or not parts[0].isdigit():
+        return None
+    return int(parts[0]), parts[1].strip()
+
+@admin_router.message(Command("addcategory"))
+async def add_category_command(message: Message, command: CommandObject):
+    """Add a category: /addcategory <parent id or 0> <name>"""
+    if not is_admin(message):
+        return
+    
+    parsed = parse_category_args(command.args)
+    if parsed is None:
+        await message.answer("Foydalanish: /addcategory &lt;ota id yoki 0&gt; &lt;nomi&gt;")
+        return
+    
+    parent_id, name = parsed
+    tree = await get_category_tree()
+    if parent_id and parent_id not in tree:
+        await message.answer("Bunday ota kategoriya yo'q.")
+        return
+    
+    category_id = await add_category(name, parent_id or None)
+    await message.answer(f"Kategoriya qo'shildi: #{category_id} {html.escape(name)}")
+
+@admin_router.message(Command("renamecategory"))
+async def rename_category_command(message: Message, command: CommandObject):
+    """Rename a category: /renamecategory <id> <name>"""
+    if not is_admin(message):
+        return
+    
+    parsed = parse_category_args(command.args)
+    if parsed is None:
+        await message.answer("Foydalanish: /renamecategory &lt;id&gt; &lt;nomi&gt;")
+        return
+    
+    category_id, name = parsed
+    tree = await get_category_tree()
+    if tree.get(category_id) is None:
+        await message.answer("Bunday kategoriya yo'q.")
+        return
+    
+    await rename_category(category_id, name)
+    await message.answer(f"Kategoriya nomi o'zgartirildi: #{category_id} {html.escape(name)}")
+
+@admin_router.message(Command("delcategory"))
+async def delete_category_command(message: Message, command: CommandObject):
+    """Delete a category: /delcategory <id>; its contents move to the parent"""
+    if not is_admin(message):
+        return
+    
+    args = (command.args or "").strip()
+    tree = await get_category_tree()
+    category = tree.get(int(args)) if args.isdigit() else None
+    if category is None:
+        await message.answer("Foydalanish: /delcategory &lt;id&gt; (mavjud kategoriya)")
+        return
+    
+    await delete_category(category['id'])
+    await message.answer(f"Kategoriya o'chirildi: {html.escape(category['name'])}")
+
+@admin_router.message(Command("export"))
+async def export_catalog(message: Message):
+    """Send the whole catalog as a CSV file"""
+    if not is_admin(message):
+        return
+    
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "products.csv")
+        count = await export_products(path)
+        elapsed = time.perf_counter() - started
+        await message.answer_document(
+            FSInputFile(path),
+            caption=f"{count} ta mahsulot eksport qilindi ({elapsed:.2f} s)"
+        )
+
+@admin_router.message(Command("import"))
+async def import_catalog_start(message: Message, state: FSMContext):
+    """Start a bulk catalog import"""
+    if not is_admin(message):
+        return
+    
+    await message.answer(
+        "Mahsulotlar CSV faylini yuboring.\n"
+        "Ustunlar: id, name, price. id bo'lsa mahsulot yangilanadi, "
+        "bo'sh bo'lsa yangi mahsulot qo'shiladi."
+    )
+    await state.set_state(AdminStates.import_catalog)
+
+@admin_router.message(AdminStates.import_catalog, F.document)
+async def import_catalog_file(message: Message, state: FSMContext):
+    """Load an uploaded catalog CSV with COPY"""
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "import.csv")
+        await message.bot.download(message.document, destination=path)
+        
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            try:
+                rows = CatalogRows(file)
+                updated, inserted = await import_products(rows)
+            except (ValueError, UnicodeDecodeError) as e:
+                await message.answer(f"Faylni o'qib bo'lmadi: {e}")
+                return
+            except Exception:
+                # Logged by the database layer; the import is one transaction,
+                # so nothing was changed
+                await state.clear()
+                await message.answer(
+                    "Import amalga oshmadi, katalog o'zgarmadi. Keyinroq qayta urinib ko'ring.",
+                    reply_markup=admin_kb.ADMIN_MENU
+                )
+                return
+    
+    elapsed = time.perf_counter() - started
+    report = (
+        f"Import tugadi ({elapsed:.2f} s)\n"
+        f"Yangilandi: {updated}\n"
+        f"Qo'shildi: {inserted}\n"
+        f"Rad etildi: {rows.rejected}"
+    )
+    for line, reason in rows.errors:
+        report += f"\n  {line}-qator: {reason}"
+    
+    await message.answer(report, reply_markup=admin_kb.ADMIN_MENU)
+    await state.clear()
+
+@admin_router.message(AdminStates.import_catalog)
+async def import_catalog_not_file(message: Message):
+    """Remind that a document is expected"""
+    await message.answer("Iltimos, CSV faylni hujjat sifatida yuboring.")
+
+@admin_router.message(Command("broadcast"))
+async def broadcast_start(message: Message, state: FSMContext):
+    """Start a broadcast to every customer"""
+    if not is_admin(message):
+        return
+    
+    await message.answer("Barcha xaridorlarga yuboriladigan xabarni kiriting:")
+    await state.set_state(AdminStates.broadcast_text)
+
+@admin_router.message(AdminStates.broadcast_text, F.text)
+async def broadcast_text(message: Message, state: FSMContext):
+    """Queue the broadcast and show its progress"""
+    await state.clear()
+    broadcast_id, total = await enqueue_broadcast(message.html_text, message.from_user.id)
+    if not total:
+        await message.answer("Hozircha xaridorlar yo'q.", reply_markup=admin_kb.ADMIN_MENU)
+        return
+    
+    # The outbox sender edits this message as delivery goes on
+    progress = await message.answer(f"📣 Xabar {total} ta xaridorga navbatga qo'yildi.")
+    await set_broadcast_message(broadcast_id, progress.message_id)
+    outbox_sender.wake()
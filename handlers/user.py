@@ -1,17 +1,39 @@
+import html
+from contextlib import suppress
+from typing import Optional
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command, Text
-from aiogram.fsm.context import FSMContext
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    BufferedInputFile
+)
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.filters import Command
 
-from states import UserStates
 from keyboards import user_kb
+from keyboards.catalog import catalog_page_keyboard, category_keyboard
+from config import INLINE_RESULTS_LIMIT
+from utils.misc import format_price, parse_page_callback, parse_quantity_callback
+from utils.render import render_cart, render_receipt, render_order, answer_chunks
+from receipts import receipt_renderer
+from utils.concurrency import answered, gather_bounded
+from database.cache import cart_cache
+from database.errors import OutOfStock
 from database.db import (
-    get_all_products,
+    get_products_page,
     get_product_by_id,
+    search_products,
     add_to_cart,
     get_cart_items,
     remove_from_cart,
-    clear_cart
+    place_order,
+    get_orders_page,
+    get_order_summary,
+    get_order
 )
 
 # Initialize router
@@ -23,26 +45,48 @@ async def cmd_start(message: Message):
     await message.answer(
         f"Assalomu alaykum, {message.from_user.first_name}!\n"
         f"Korzinka botiga xush kelibsiz. Mahsulotlarni ko'rish uchun quyidagi tugmani bosing:",
-        reply_markup=user_kb.main_menu()
+        reply_markup=user_kb.MAIN_MENU
     )
 
 
-@user_router.message(Text(text="🛍 Mahsulotlar"))
+@user_router.message(F.text == "🛍 Mahsulotlar")
 async def show_products(message: Message):
-    """Show all available products"""
-    products = await get_all_products()
-    if not products:
+    """Show the top level of the category tree"""
+    view = await category_keyboard(user_kb.category_level)
+    if view is None:
         await message.answer("Hozircha mahsulotlar mavjud emas.")
         return
     
-    await message.answer(
-        "Mahsulotlar ro'yxati:",
-        reply_markup=user_kb.product_list(products)
-    )
+    level, keyboard = view
+    await message.answer(category_title(level), reply_markup=keyboard)
+
+@user_router.callback_query(F.data.startswith("category:"))
+async def category_selected(callback: CallbackQuery):
+    """Drill into a category (0 is the top level) in place"""
+    category_id = int(callback.data.split(':')[1]) or None
+    async with answered(callback):
+        await show_category(callback, category_id)
+
+@user_router.callback_query(F.data.startswith("category_page:"))
+async def category_page(callback: CallbackQuery):
+    """Switch a category's product list to another page"""
+    # category_page:<category id>:<direction>:<anchor>
+    prefix, category_id, page = callback.data.split(':', 2)
+    after_id, before_id = parse_page_callback(f"{prefix}:{page}")
+    async with answered(callback):
+        await show_category(callback, int(category_id) or None, after_id, before_id)
+
+@user_router.callback_query(F.data.startswith("products_page:"))
+async def products_page(callback: CallbackQuery):
+    """Switch a flat product list message (sent before categories) to another page"""
+    after_id, before_id = parse_page_callback(callback.data)
+    async with answered(callback):
+        keyboard = await catalog_page_keyboard(user_kb.product_list, after_id, before_id)
+        await callback.message.edit_reply_markup(reply_markup=keyboard)
 
 @user_router.callback_query(F.data.startswith("product:"))
-async def product_selected(callback: CallbackQuery, state: FSMContext):
-    """Handle product selection"""
+async def product_selected(callback: CallbackQuery):
+    """Show a product card with the quantity stepper"""
     product_id = int(callback.data.split(':')[1])
     product = await get_product_by_id(product_id)
     
@@ -50,76 +94,105 @@ async def product_selected(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Mahsulot topilmadi")
         return
     
-    # Save product_id to state
-    await state.update_data(selected_product_id=product_id)
-    
-    # Show product details with quantity selection
-    await callback.message.answer(
-        f"📦 {product['name']}\n"
-        f"💰 Narxi: {product['price']} so'm\n\n"
-        f"Miqdorni tanlang yoki kiriting:",
-        reply_markup=user_kb.quantity_keyboard()
+    # Sent to the user directly since inline-mode messages have no
+    # callback.message; the stepper then edits this card in place
+    send = callback.bot.send_message(
+        callback.from_user.id,
+        product_card(product),
+        reply_markup=user_kb.quantity_stepper(product_id, 1)
     )
+    if callback.message is not None:
+        async with answered(callback):
+            await send
+        return
     
-    await state.set_state(UserStates.selecting_quantity)
-    await callback.answer()
-
-@user_router.message(UserStates.selecting_quantity)
-async def quantity_selected(message: Message, state: FSMContext):
-    """Handle quantity selection"""
+    # Anyone can tap an inline-mode card, including users who never started
+    # the bot, so the answer waits for the send to know what to say
     try:
-        quantity = int(message.text)
-        if quantity <= 0:
-            await message.answer("Iltimos, musbat son kiriting.")
-            return
-    except ValueError:
-        await message.answer("Iltimos, raqam kiriting.")
+        await send
+    except TelegramForbiddenError:
+        await callback.answer(
+            "Mahsulotni ko'rish uchun avval botni oching va /start bosing, keyin qayta tanlang.",
+            show_alert=True
+        )
         return
+    await callback.answer()
+
+@user_router.callback_query(F.data.startswith("qty:"))
+async def quantity_stepped(callback: CallbackQuery):
+    """Redraw the stepper with another quantity; nothing is stored anywhere"""
+    product_id, quantity = parse_quantity_callback(callback.data, user_kb.MAX_QUANTITY)
+    async with answered(callback):
+        # A tap on a stale stepper may ask for the quantity already shown
+        with suppress(TelegramBadRequest):
+            await callback.message.edit_reply_markup(reply_markup=user_kb.quantity_stepper(product_id, quantity))
+
+@user_router.callback_query(F.data.startswith("add:"))
+async def quantity_added(callback: CallbackQuery):
+    """Add the stepper's quantity to the cart and turn the card into a confirmation"""
+    product_id, quantity = parse_quantity_callback(callback.data, user_kb.MAX_QUANTITY)
+    # The name comes from the catalog cache, the add is the only query
+    product, added = await gather_bounded(
+        get_product_by_id(product_id),
+        add_to_cart(callback.from_user.id, product_id, quantity)
+    )
     
-    # Get product_id from state
-    user_data = await state.get_data()
-    product_id = user_data.get('selected_product_id')
-    
-    if not product_id:
-        await message.answer("Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
-        await state.clear()
+    if product is None:
+        await callback.answer("Mahsulot topilmadi")
         return
     
-    # Add to cart
-    product = await get_product_by_id(product_id)
-    await add_to_cart(message.from_user.id, product_id, quantity)
+    if not added:
+        await callback.answer(f"Kechirasiz, omborda {product['name']} yetarli emas.", show_alert=True)
+        return
     
-    await message.answer(
-        f"{product['name']} savatga qo'shildi. Miqdori: {quantity}",
-        reply_markup=user_kb.after_adding_to_cart()
-    )
+    async with answered(callback, "Savatga qo'shildi"):
+        await callback.message.edit_text(
+            f"{product_card(product)}\n\n✅ Savatga qo'shildi. Miqdori: {quantity}",
+            reply_markup=None
+        )
+
+@user_router.callback_query(F.data == "noop")
+async def noop(callback: CallbackQuery):
+    """Buttons that only display something"""
+    await callback.answer()
+
+@user_router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """Search products from any chat with @bot <query>"""
+    query = inline_query.query.strip()
+    if query:
+        products = await search_products(query, INLINE_RESULTS_LIMIT)
+    else:
+        products, _, _ = await get_products_page()
     
-    await state.clear()
+    results = [
+        InlineQueryResultArticle(
+            id=str(product['id']),
+            title=product['name'],
+            description=f"{format_price(product['price'])} so'm",
+            input_message_content=InputTextMessageContent(
+                message_text=(
+                    f"📦 {html.escape(product['name'])}\n"
+                    f"💰 Narxi: {format_price(product['price'])} so'm"
+                )
+            ),
+            reply_markup=user_kb.add_product_button(product['id'])
+        )
+        for product in products
+    ]
+    # Results are the same for everyone, let Telegram cache them briefly
+    await inline_query.answer(results, cache_time=30, is_personal=False)
 
-@user_router.message(Text(text="🧺 Savatni ko'rish"))
+@user_router.message(F.text == "🧺 Savatni ko'rish")
 async def show_cart(message: Message):
     """Show user's cart"""
-    cart_items = await get_cart_items(message.from_user.id)
+    cart_pages, cart_keyboard = await get_cart_view(message.from_user.id)
     
-    if not cart_items:
-        await message.answer("Savatingiz bo'sh.", reply_markup=user_kb.main_menu())
+    if cart_keyboard is None:
+        await message.answer("Savatingiz bo'sh.", reply_markup=user_kb.MAIN_MENU)
         return
     
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
-    
-    cart_text = "🧺 Savatingizdagi mahsulotlar:\n\n"
-    for i, item in enumerate(cart_items, 1):
-        cart_text += (
-            f"{i}. {item['name']} - {item['quantity']} dona\n"
-            f"   {item['price']} x {item['quantity']} = {item['price'] * item['quantity']} so'm\n\n"
-        )
-    
-    cart_text += f"\n💰 Jami: {total} so'm"
-    
-    await message.answer(
-        cart_text,
-        reply_markup=user_kb.cart_keyboard(cart_items)
-    )
+    await answer_chunks(message, cart_pages, reply_markup=cart_keyboard)
 
 @user_router.callback_query(F.data.startswith("remove:"))
 async def remove_cart_item(callback: CallbackQuery):
@@ -127,70 +200,140 @@ async def remove_cart_item(callback: CallbackQuery):
     item_id = int(callback.data.split(':')[1])
     user_id = callback.from_user.id
     
-    await remove_from_cart(user_id, item_id)
-    
-    await callback.answer("Mahsulot savatdan olib tashlandi")
-    
-    # Show updated cart
-    cart_items = await get_cart_items(user_id)
-    
-    if not cart_items:
-        await callback.message.edit_text(
-            "Savatingiz bo'sh.",
-            reply_markup=None
-        )
-        await callback.message.answer("Savatingiz bo'sh.", reply_markup=user_kb.main_menu())
-        return
-    
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
-    
-    cart_text = "🧺 Savatingizdagi mahsulotlar:\n\n"
-    for i, item in enumerate(cart_items, 1):
-        cart_text += (
-            f"{i}. {item['name']} - {item['quantity']} dona\n"
-            f"   {item['price']} x {item['quantity']} = {item['price'] * item['quantity']} so'm\n\n"
+    async with answered(callback, "Mahsulot savatdan olib tashlandi"):
+        await remove_from_cart(user_id, item_id)
+        
+        # Show updated cart
+        cart_pages, cart_keyboard = await get_cart_view(user_id)
+        
+        if cart_keyboard is None:
+            await gather_bounded(
+                callback.message.edit_text("Savatingiz bo'sh.", reply_markup=None),
+                callback.message.answer("Savatingiz bo'sh.", reply_markup=user_kb.MAIN_MENU)
+            )
+            return
+        
+        if len(cart_pages) == 1:
+            await callback.message.edit_text(
+                cart_pages[0],
+                reply_markup=cart_keyboard
+            )
+            return
+        
+        # Too long for one message: first page in place, the rest below it
+        await gather_bounded(
+            callback.message.edit_text(cart_pages[0]),
+            answer_chunks(callback.message, cart_pages[1:], reply_markup=cart_keyboard)
         )
-    
-    cart_text += f"\n💰 Jami: {total} so'm"
-    
-    await callback.message.edit_text(
-        cart_text,
-        reply_markup=user_kb.cart_keyboard(cart_items)
-    )
 
 @user_router.callback_query(F.data == "checkout")
 async def checkout(callback: CallbackQuery):
     """Process checkout"""
     user_id = callback.from_user.id
-    cart_items = await get_cart_items(user_id)
+    # Moves the cart into an order atomically and returns what was bought
+    try:
+        order = await place_order(user_id)
+    except OutOfStock as e:
+        await callback.answer(
+            "Omborda yetarli emas: " + ", ".join(e.names) + ". Savatni o'zgartiring.",
+            show_alert=True
+        )
+        return
     
-    if not cart_items:
+    if not order:
         await callback.answer("Savatingiz bo'sh.")
         return
     
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
-    
-    receipt = "🧾 CHEK 🧾\n\n"
-    receipt += f"Mijoz: {callback.from_user.full_name}\n"
-    receipt += f"Sana: {callback.message.date.strftime('%Y-%m-%d %H:%M')}\n\n"
-    receipt += "Mahsulotlar:\n"
-    
-    for i, item in enumerate(cart_items, 1):
-        receipt += (
-            f"{i}. {item['name']} - {item['quantity']} dona\n"
-            f"   {item['price']} x {item['quantity']} = {item['price'] * item['quantity']} so'm\n\n"
+    # The receipt ends with the follow-up question and carries the main menu;
+    # a PDF when a receipt worker is free, the text receipt otherwise
+    async with answered(callback, "Xaridingiz uchun rahmat!"):
+        pdf = await receipt_renderer.render(order, callback.from_user.full_name)
+        if pdf is None:
+            await answer_chunks(
+                callback.message,
+                render_receipt(order, callback.from_user.full_name),
+                reply_markup=user_kb.MAIN_MENU
+            )
+            return
+        
+        await callback.message.answer_document(
+            BufferedInputFile(pdf, filename=f"chek-{order['id']}.pdf"),
+            caption=(
+                f"🧾 Buyurtma #{order['id']}\n"
+                f"💰 Jami: {format_price(order['total'])} so'm\n\n"
+                "Xaridingiz uchun rahmat!\n"
+                "Boshqa mahsulotlar xarid qilishni xohlaysizmi?"
+            ),
+            reply_markup=user_kb.MAIN_MENU
         )
+
+@user_router.message(F.text == "📜 Buyurtmalarim")
+async def show_orders(message: Message):
+    """Show the user's order count, lifetime spend and newest orders"""
+    user_id = message.from_user.id
+    # The totals are kept on the customer row, neither query aggregates orders
+    (count, spend), (orders, has_prev, has_next) = await gather_bounded(
+        get_order_summary(user_id),
+        get_orders_page(user_id)
+    )
     
-    receipt += f"\n💰 Jami: {total} so'm\n"
-    receipt += "\nXaridingiz uchun rahmat!"
+    if not orders:
+        await message.answer("Sizda hali buyurtmalar yo'q.", reply_markup=user_kb.MAIN_MENU)
+        return
     
-    await callback.message.answer(receipt)
+    await message.answer(
+        f"📜 Buyurtmalaringiz: {count} ta\n"
+        f"💰 Jami xaridlar: {format_price(spend)} so'm",
+        reply_markup=user_kb.order_list(orders, has_prev, has_next)
+    )
+
+@user_router.callback_query(F.data.startswith("orders_page:"))
+async def orders_page(callback: CallbackQuery):
+    """Switch the order history to older or newer orders"""
+    after_id, before_id = parse_page_callback(callback.data)
+    async with answered(callback):
+        orders, has_prev, has_next = await get_orders_page(callback.from_user.id, after_id, before_id)
+        await callback.message.edit_reply_markup(reply_markup=user_kb.order_list(orders, has_prev, has_next))
+
+@user_router.callback_query(F.data.startswith("order:"))
+async def order_selected(callback: CallbackQuery):
+    """Show the items of one past order"""
+    order_id = int(callback.data.split(':')[1])
+    order = await get_order(callback.from_user.id, order_id)
     
-    # Clear the cart
-    await clear_cart(user_id)
+    if not order:
+        await callback.answer("Buyurtma topilmadi")
+        return
     
-    await callback.answer("Xaridingiz uchun rahmat!")
-    await callback.message.answer(
-        "Boshqa mahsulotlar xarid qilishni xohlaysizmi?",
-        reply_markup=user_kb.main_menu()
-    )
+    async with answered(callback):
+        await answer_chunks(callback.message, render_order(order))
+
+async def show_category(
+    callback: CallbackQuery, category_id: Optional[int], after_id: int = 0, before_id: Optional[int] = None
+):
+    """Edit the catalog message to show one category level"""
+    view = await category_keyboard(user_kb.category_level, category_id, after_id, before_id)
+    if view is None:
+        await callback.message.edit_text("Hozircha mahsulotlar mavjud emas.", reply_markup=None)
+        return
+    
+    level, keyboard = view
+    await callback.message.edit_text(category_title(level), reply_markup=keyboard)
+
+def product_card(product) -> str:
+    """Text of a product card above the quantity stepper"""
+    return f"📦 {html.escape(product['name'])}\n💰 Narxi: {format_price(product['price'])} so'm"
+
+def category_title(level) -> str:
+    """Breadcrumb of a category level, e.g. 🛍 Mahsulotlar › Sut mahsulotlari"""
+    return " › ".join(["🛍 Mahsulotlar"] + [html.escape(category['name']) for category in level.path])
+
+async def get_cart_view(user_id: int):
+    """Rendered cart pages and keyboard (None if empty), reused while the cart is unchanged"""
+    view = cart_cache.get(user_id)
+    if view is None:
+        key = cart_cache.key(user_id)
+        cart_items = await get_cart_items(user_id)
+        view = (render_cart(cart_items), user_kb.cart_keyboard(cart_items) if cart_items else None)
+        cart_cache.put(user_id, key, view)
+    return view
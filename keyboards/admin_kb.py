@@ -1,44 +1,44 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import KeyboardButton, InlineKeyboardButton
 from typing import List, Dict, Any
+from keyboards.prepared import PreparedInlineKeyboard, PreparedReplyKeyboard
+from keyboards.user_kb import pagination_row
 
-def admin_menu() -> ReplyKeyboardMarkup:
-    """Admin menu keyboard"""
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(KeyboardButton(text="➕ Mahsulot qo'shish"))
-    keyboard.add(KeyboardButton(text="✏️ Mahsulotni o'zgartirish"))
-    keyboard.add(KeyboardButton(text="❌ Mahsulotni o'chirish"))
-    keyboard.add(KeyboardButton(text="🔙 Asosiy menyu"))
-    return keyboard
+ADMIN_MENU = PreparedReplyKeyboard(resize_keyboard=True, keyboard=[
+    [KeyboardButton(text="➕ Mahsulot qo'shish")],
+    [KeyboardButton(text="✏️ Mahsulotni o'zgartirish")],
+    [KeyboardButton(text="❌ Mahsulotni o'chirish")],
+    [KeyboardButton(text="🗂 Kategoriyalar")],
+    [KeyboardButton(text="🔙 Asosiy menyu")]
+])
 
-def product_list_for_edit(products: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
-    """Product list for editing"""
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for product in products:
-        keyboard.add(
-            InlineKeyboardButton(
-                text=f"{product['name']} - {product['price']} so'm",
-                callback_data=f"edit:{product['id']}"
-            )
-        )
-    return keyboard
+EDIT_OPTIONS = PreparedInlineKeyboard(inline_keyboard=[[
+    InlineKeyboardButton(text="Nomini o'zgartirish", callback_data="option:name"),
+    InlineKeyboardButton(text="Narxini o'zgartirish", callback_data="option:price")
+], [
+    InlineKeyboardButton(text="Qoldiqni o'zgartirish", callback_data="option:stock"),
+    InlineKeyboardButton(text="Kategoriyasini o'zgartirish", callback_data="option:category")
+]])
 
-def product_list_for_delete(products: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
-    """Product list for deletion"""
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for product in products:
-        keyboard.add(
-            InlineKeyboardButton(
-                text=f"{product['name']} - {product['price']} so'm",
-                callback_data=f"delete:{product['id']}"
-            )
-        )
-    return keyboard
+def product_list_for_edit(products: List[Dict[str, Any]], has_prev: bool = False, has_next: bool = False) -> PreparedInlineKeyboard:
+    """One page of the product list for editing"""
+    rows = [
+        [InlineKeyboardButton(
+            text=f"{product['name']} - {product['price']} so'm",
+            callback_data=f"edit:{product['id']}"
+        )]
+        for product in products
+    ]
+    rows.extend(pagination_row("edit_page", products, has_prev, has_next))
+    return PreparedInlineKeyboard(inline_keyboard=rows)
 
-def edit_options() -> InlineKeyboardMarkup:
-    """Edit options keyboard"""
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    keyboard.add(
-        InlineKeyboardButton(text="Nomini o'zgartirish", callback_data="option:name"),
-        InlineKeyboardButton(text="Narxini o'zgartirish", callback_data="option:price")
-    )
-    return keyboard
+def product_list_for_delete(products: List[Dict[str, Any]], has_prev: bool = False, has_next: bool = False) -> PreparedInlineKeyboard:
+    """One page of the product list for deletion"""
+    rows = [
+        [InlineKeyboardButton(
+            text=f"{product['name']} - {product['price']} so'm",
+            callback_data=f"delete:{product['id']}"
+        )]
+        for product in products
+    ]
+    rows.extend(pagination_row("delete_page", products, has_prev, has_next))
+    return PreparedInlineKeyboard(inline_keyboard=rows)
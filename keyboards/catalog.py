@@ -0,0 +1,84 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import CATALOG_PAGE_SIZE
+from database.cache import catalog_cache
+from database.db import get_products_page, get_category_tree
+from keyboards.prepared import PreparedInlineKeyboard
+from utils.categories import CategoryLevel
+
+Builder = Callable[..., PreparedInlineKeyboard]
+
+# Page and category keyboards kept per catalog version; page anchors come
+# from callback data, so the number of entries is capped
+MAX_PAGE_KEYBOARDS = 1024
+
+_version: Optional[int] = None
+_pages: Dict[Tuple[Any, ...], Any] = {}
+
+
+async def catalog_page_keyboard(
+    build: Builder, after_id: int = 0, before_id: Optional[int] = None
+) -> Optional[PreparedInlineKeyboard]:
+    """Keyboard ``build`` makes for one catalog page, built once per catalog version.
+
+    A page emptied by deletions falls back to the first one. Returns None
+    when the catalog is empty.
+    """
+    global _version, _pages
+    # Read before the page: a page loaded across an invalidation is filed
+    # under the old version and never served again
+    version = catalog_cache.version
+    if version != _version:
+        _version, _pages = version, {}
+
+    key = (build, after_id, before_id)
+    if key in _pages:
+        return _pages[key]
+
+    products, has_prev, has_next = await get_products_page(after_id, before_id)
+    if not products and (after_id or before_id is not None):
+        products, has_prev, has_next = await get_products_page()
+    keyboard = build(products, has_prev, has_next) if products else None
+
+    if version == _version:
+        if len(_pages) >= MAX_PAGE_KEYBOARDS:
+            _pages = {}
+        _pages[key] = keyboard
+    return keyboard
+
+
+async def category_keyboard(
+    build: Callable[[CategoryLevel], PreparedInlineKeyboard],
+    category_id: Optional[int] = None,
+    after_id: int = 0,
+    before_id: Optional[int] = None
+) -> Optional[Tuple[CategoryLevel, PreparedInlineKeyboard]]:
+    """One level of the category tree and the keyboard ``build`` makes for it.
+
+    Levels come from the in-memory category tree, so only a catalog change
+    costs a query. A deleted category falls back to the top level and a page
+    emptied by deletions to the category's first one. Returns None when
+    there is nothing to show.
+    """
+    global _version, _pages
+    version = catalog_cache.version
+    if version != _version:
+        _version, _pages = version, {}
+
+    key = (build, 'category', category_id, after_id, before_id)
+    if key in _pages:
+        return _pages[key]
+
+    tree = await get_category_tree()
+    level = tree.level(category_id, after_id, before_id, CATALOG_PAGE_SIZE)
+    if level is None:
+        level = tree.level(None, 0, None, CATALOG_PAGE_SIZE)
+    elif not level.products and (after_id or before_id is not None):
+        level = tree.level(category_id, 0, None, CATALOG_PAGE_SIZE)
+    view = (level, build(level)) if level.children or level.products else None
+
+    if version == _version:
+        if len(_pages) >= MAX_PAGE_KEYBOARDS:
+            _pages = {}
+        _pages[key] = view
+    return view
@@ -0,0 +1,40 @@
+import json
+from functools import cached_property
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+from aiohttp import FormData
+
+
+class _Prepared:
+    """Markup that serializes itself once; shared instances must not be changed"""
+
+    @cached_property
+    def prepared_json(self) -> str:
+        return json.dumps(self.model_dump(exclude_none=True), ensure_ascii=False)
+
+
+class PreparedInlineKeyboard(_Prepared, InlineKeyboardMarkup):
+    pass
+
+
+class PreparedReplyKeyboard(_Prepared, ReplyKeyboardMarkup):
+    pass
+
+
+class PreparedMarkupSession(AiohttpSession):
+    """Session that sends a prepared keyboard's cached JSON as reply_markup.
+
+    Other fields are serialized as usual; the markup, usually the largest
+    part of a request, is left out of the per-request model dump.
+    """
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        markup = getattr(method, 'reply_markup', None)
+        if not isinstance(markup, _Prepared):
+            return super().build_form_data(bot, method)
+        form = super().build_form_data(bot, method.model_copy(update={'reply_markup': None}))
+        form.add_field('reply_markup', markup.prepared_json)
+        return form
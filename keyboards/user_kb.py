@@ -1,50 +1,106 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from functools import lru_cache
 from typing import List, Dict, Any
+from keyboards.prepared import PreparedInlineKeyboard, PreparedReplyKeyboard
+from utils.categories import CategoryLevel
+from utils.misc import format_price
 
-def main_menu() -> ReplyKeyboardMarkup:
-    """Main menu keyboard"""
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(KeyboardButton(text="🛍 Mahsulotlar"))
-    keyboard.add(KeyboardButton(text="🧺 Savatni ko'rish"))
-    return keyboard
-
-def product_list(products: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
-    """Product list as inline keyboard"""
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for product in products:
-        keyboard.add(
-            InlineKeyboardButton(
-                text=f"{product['name']} - {product['price']} so'm",
-                callback_data=f"product:{product['id']}"
-            )
+# Static keyboards are built and serialized once and shared by every message
+MAIN_MENU = PreparedReplyKeyboard(resize_keyboard=True, keyboard=[
+    [KeyboardButton(text="🛍 Mahsulotlar")],
+    [KeyboardButton(text="🧺 Savatni ko'rish")],
+    [KeyboardButton(text="📜 Buyurtmalarim")]
+])
+
+# Largest quantity the stepper offers for one add
+MAX_QUANTITY = 99
+
+@lru_cache(maxsize=1024)
+def quantity_stepper(product_id: int, quantity: int) -> PreparedInlineKeyboard:
+    """Inline -/+ stepper for a product card; the quantity travels in the callback data.
+
+    "qty:<id>:<n>" redraws the card with n selected, "add:<id>:<n>" adds n
+    to the cart. Buttons that would not change anything are no-ops. Built
+    once per (product, quantity) and shared like the static keyboards.
+    """
+    return PreparedInlineKeyboard(inline_keyboard=[[
+        InlineKeyboardButton(
+            text="➖",
+            callback_data=f"qty:{product_id}:{quantity - 1}" if quantity > 1 else "noop"
+        ),
+        InlineKeyboardButton(text=f"{quantity} dona", callback_data="noop"),
+        InlineKeyboardButton(
+            text="➕",
+            callback_data=f"qty:{product_id}:{quantity + 1}" if quantity < MAX_QUANTITY else "noop"
         )
-    return keyboard
-
-def quantity_keyboard() -> ReplyKeyboardMarkup:
-    """Quantity selection keyboard"""
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=3)
-    buttons = [KeyboardButton(text=str(i)) for i in range(1, 10)]
-    keyboard.add(*buttons)
-    return keyboard
-
-def after_adding_to_cart() -> ReplyKeyboardMarkup:
-    """Keyboard after adding product to cart"""
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(KeyboardButton(text="🛍 Mahsulotlar"))
-    keyboard.add(KeyboardButton(text="🧺 Savatni ko'rish"))
-    return keyboard
-
-def cart_keyboard(cart_items: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
+    ], [
+        InlineKeyboardButton(text=f"🛒 Savatga qo'shish ({quantity})", callback_data=f"add:{product_id}:{quantity}")
+    ]])
+
+def product_list(products: List[Dict[str, Any]], has_prev: bool = False, has_next: bool = False) -> PreparedInlineKeyboard:
+    """One page of the product list as inline keyboard"""
+    rows = [
+        [InlineKeyboardButton(
+            text=f"{product['name']} - {product['price']} so'm",
+            callback_data=f"product:{product['id']}"
+        )]
+        for product in products
+    ]
+    rows.extend(pagination_row("products_page", products, has_prev, has_next))
+    return PreparedInlineKeyboard(inline_keyboard=rows)
+
+def category_level(level: CategoryLevel) -> PreparedInlineKeyboard:
+    """Subcategories with their product counts, then a page of the category's own products"""
+    category_id = level.category['id'] if level.category else 0
+    rows = [
+        [InlineKeyboardButton(text=f"📁 {category['name']} ({count})", callback_data=f"category:{category['id']}")]
+        for category, count in level.children
+    ]
+    rows.extend(
+        [InlineKeyboardButton(
+            text=f"{product['name']} - {product['price']} so'm",
+            callback_data=f"product:{product['id']}"
+        )]
+        for product in level.products
+    )
+    rows.extend(pagination_row(f"category_page:{category_id}", level.products, level.has_prev, level.has_next))
+    if level.category:
+        parent_id = level.path[-2]['id'] if len(level.path) > 1 else 0
+        rows.append([InlineKeyboardButton(text="⬆️ Orqaga", callback_data=f"category:{parent_id}")])
+    return PreparedInlineKeyboard(inline_keyboard=rows)
+
+def order_list(orders: List[Dict[str, Any]], has_prev: bool = False, has_next: bool = False) -> PreparedInlineKeyboard:
+    """One page of the user's order history, newest first; "Keyingi" goes to older orders"""
+    rows = [
+        [InlineKeyboardButton(
+            text=f"#{order['id']} · {order['created_at'].strftime('%Y-%m-%d')} · {format_price(order['total'])} so'm",
+            callback_data=f"order:{order['id']}"
+        )]
+        for order in orders
+    ]
+    rows.extend(pagination_row("orders_page", orders, has_prev, has_next))
+    return PreparedInlineKeyboard(inline_keyboard=rows)
+
+def pagination_row(prefix: str, products: List[Dict[str, Any]], has_prev: bool, has_next: bool) -> List[List[InlineKeyboardButton]]:
+    """Prev/next buttons for a keyset page, keyed by the first and last row id"""
+    row = []
+    if has_prev and products:
+        row.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"{prefix}:prev:{products[0]['id']}"))
+    if has_next and products:
+        row.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"{prefix}:next:{products[-1]['id']}"))
+    return [row] if row else []
+
+def add_product_button(product_id: int) -> InlineKeyboardMarkup:
+    """Single button that opens the product for adding to cart"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🛒 Savatga qo'shish", callback_data=f"product:{product_id}")
+    ]])
+
+def cart_keyboard(cart_items: List[Dict[str, Any]]) -> PreparedInlineKeyboard:
     """Cart management keyboard"""
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    
-    for item in cart_items:
-        keyboard.add(
-            InlineKeyboardButton(
-                text=f"❌ {item['name']}",
-                callback_data=f"remove:{item['id']}"
-            )
-        )
-    
-    keyboard.add(InlineKeyboardButton(text="💰 Hisob-kitob", callback_data="checkout"))
-    return keyboard
+    rows = [
+        [InlineKeyboardButton(text=f"❌ {item['name']}", callback_data=f"remove:{item['id']}")]
+        for item in cart_items
+    ]
+    rows.append([InlineKeyboardButton(text="💰 Hisob-kitob", callback_data="checkout")])
+    return PreparedInlineKeyboard(inline_keyboard=rows)
@@ -1,14 +1,26 @@
+import argparse
 import asyncio
 import logging
+import signal
 import sys
 from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, TELEGRAM_API_URL, WORKERS, METRICS_ENABLED, METRICS_PORT, WEBHOOK_HOST, DB_BACKEND
 from handlers.user import user_router
 from handlers.admin import admin_router
-from database.db import init_db, create_tables
+from database.db import init_db, migrate_schema, close_db
+from database.fsm_storage import DatabaseStorage
+from keyboards.prepared import PreparedMarkupSession
+from middlewares import ThrottlingMiddleware, HandlerMetricsMiddleware, RequestMetricsMiddleware
+from webhook import UpdateFeeder, run_webhook
+from outbox import outbox_sender
+from receipts import receipt_renderer
+from database.maintenance import cart_expiry
+from supervisor import consume_queue, run_supervisor
+from utils.metrics import start_metrics_server
 
 # Configure logging
 logging.basicConfig(
@@ -18,33 +30,114 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(storage=MemoryStorage())
+# The session sends prepared keyboards' cached JSON instead of re-serializing them
+session = PreparedMarkupSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else PreparedMarkupSession()
+bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML), session=session)
+dp = Dispatcher(storage=DatabaseStorage())
 
 # Register routers
 dp.include_router(user_router)
 dp.include_router(admin_router)
 
-async def on_startup():
+# Drop floods and double taps before they reach filters, handlers and the database
+throttling = ThrottlingMiddleware()
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+
+# Handler timings and Bot API call counts for /metrics; nothing is wrapped when disabled
+if METRICS_ENABLED:
+    handler_metrics = HandlerMetricsMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(handler_metrics)
+    bot.session.middleware(RequestMetricsMiddleware())
+
+async def on_startup(create_schema: bool = True, run_jobs: bool = True):
     """Actions to perform on bot startup"""
     try:
         # Initialize database connection pool
         await init_db()
-        # Create database tables on startup
-        await create_tables()
+        # Apply pending schema migrations (done once by the supervisor);
+        # replicas starting together take turns on an advisory lock
+        if create_schema:
+            await migrate_schema()
+        # Start expiring old FSM states
+        await dp.storage.start()
+        # Start the processes that render PDF receipts off the event loop
+        await receipt_renderer.start()
+        # Deliver queued broadcasts and notifications and expire abandoned
+        # carts (once per deployment)
+        if run_jobs:
+            await outbox_sender.start(bot)
+            await cart_expiry.start()
         logger.info("Bot started and database initialized")
     except Exception as e:
         logger.error(f"Error during startup: {e}")
         sys.exit(1)
 
-async def main():
+async def on_shutdown():
+    """Actions to perform on bot shutdown"""
+    await outbox_sender.close()
+    await cart_expiry.close()
+    await receipt_renderer.close()
+    # Write out FSM changes still waiting in the write-back buffer
+    await dp.storage.close()
+    await close_db()
+
+def run_worker(index: int, queue):
+    """Entry point of a supervisor worker process"""
+    # Ctrl+C reaches the whole process group, workers stop on the supervisor's sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, queue))
+
+async def _worker(index: int, queue):
+    await on_startup(create_schema=False, run_jobs=index == 0)
+    logger.info(f"Worker {index} ready")
+    feeder = UpdateFeeder(dp, bot)
+    metrics_runner = None
+    if METRICS_ENABLED:
+        metrics_runner = await start_metrics_server(WEBHOOK_HOST, METRICS_PORT + 1 + index)
+    try:
+        await consume_queue(queue, feeder)
+        await feeder.drain()
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await on_shutdown()
+        await bot.session.close()
+
+async def main(mode: str = "polling", workers: int = WORKERS):
     """Main function to start the bot"""
+    if mode == "supervisor":
+        # Worker processes keep their catalog caches coherent through
+        # Postgres notifications, SQLite has no way to tell them
+        if DB_BACKEND == "sqlite":
+            sys.exit("Supervisor mode needs DB_BACKEND=postgres")
+        # Migrate the schema once, then shard updates over worker processes
+        await init_db()
+        await migrate_schema()
+        await close_db()
+        await run_supervisor(dp, bot, workers, run_worker)
+        return
+    
     # Startup actions
     await on_startup()
     
-    # Start polling
-    await dp.start_polling(bot)
+    # Polling for development, webhook for production
+    try:
+        if mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            if METRICS_ENABLED:
+                await start_metrics_server(WEBHOOK_HOST, METRICS_PORT)
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Korzinka bot")
+    parser.add_argument("--mode", choices=["polling", "webhook", "supervisor"], default="polling")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes in supervisor mode")
+    args = parser.parse_args()
+    
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    asyncio.run(main(args.mode, args.workers))
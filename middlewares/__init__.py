@@ -0,0 +1,2 @@
+from .throttling import ThrottlingMiddleware
+from .metrics import HandlerMetricsMiddleware, RequestMetricsMiddleware
@@ -0,0 +1,44 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+from utils import metrics
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Time every handler call, labelled with the handler's function name.
+
+    Register it as an inner middleware so ``data["handler"]`` is the handler
+    that matched; updates no handler wants are not measured.
+    """
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(handler=name)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, handler=name)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Count and time Bot API requests per method (bot.session middleware)"""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            metrics.api_errors.inc(method=name)
+            raise
+        finally:
+            metrics.api_seconds.observe(time.perf_counter() - started, method=name)
@@ -0,0 +1,87 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from config import THROTTLE_RATE, THROTTLE_BURST, ADMIN_IDS
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+# Prune idle buckets once per this many events
+PRUNE_EVERY = 1000
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Per-user token bucket plus coalescing of repeated callbacks.
+
+    Each user gets ``burst`` tokens refilled at ``rate`` per second, one per
+    update. Updates over the limit are dropped before any filter or handler
+    runs. A callback whose data is already being handled for the same user
+    (a double-tapped button) is dropped as well. Dropped callbacks are
+    answered so the client stops its spinner, dropped messages are ignored.
+
+    Users in ``exempt`` (the admins by default) have no bucket: their FSM
+    dialogues take typed input, which would otherwise be dropped silently.
+    """
+
+    def __init__(
+        self,
+        rate: float = THROTTLE_RATE,
+        burst: int = THROTTLE_BURST,
+        exempt: Iterable[int] = ADMIN_IDS
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.exempt = frozenset(exempt)
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+        self._in_flight: Set[Tuple[int, str]] = set()
+        self._events = 0
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        if user.id not in self.exempt and not self._take_token(user.id):
+            if isinstance(event, CallbackQuery):
+                await event.answer("Iltimos, biroz kuting.")
+            return None
+
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        key = (user.id, event.data or "")
+        if key in self._in_flight:
+            await event.answer()
+            return None
+
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
+
+    def _take_token(self, user_id: int) -> bool:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        self._events += 1
+        if self._events % PRUNE_EVERY == 0:
+            self._prune(now)
+
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        return True
+
+    def _prune(self, now: float) -> None:
+        """Forget users whose bucket has refilled completely"""
+        refill_time = self.burst / self.rate
+        self._buckets = {
+            user_id: bucket
+            for user_id, bucket in self._buckets.items()
+            if now - bucket[1] < refill_time
+        }
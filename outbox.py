@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter
+)
+
+from config import (
+    OUTBOX_RATE,
+    OUTBOX_CHAT_INTERVAL,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_LEASE,
+    OUTBOX_PROGRESS_INTERVAL
+)
+from database.db import claim_outbox, finish_outbox
+
+logger = logging.getLogger(__name__)
+
+# Longest wait between two attempts of a message that failed for a transient reason
+MAX_BACKOFF = 300
+
+# Prune per-chat send times once there are this many
+MAX_TRACKED_CHATS = 10000
+
+
+class OutboxSender:
+    """Deliver the outbox table within Telegram's flood limits.
+
+    Sends start at most ``rate`` per second overall and ``chat_interval``
+    seconds apart for the same chat; a message that would break the
+    per-chat limit goes back to the queue with a delay. ``RetryAfter``
+    pauses all sending for the time Telegram asks: the message and the
+    rest of its batch that has not been sent yet go back to the queue.
+    Other errors are retried with exponential backoff, up to
+    ``max_attempts``; a blocked bot or a missing chat is given up at once.
+
+    The queue lives in Postgres, so messages survive restarts and several
+    senders never claim the same message at once. A sender stopped in the
+    middle of a batch may deliver some of it twice once the lease runs out.
+    Run one sender per deployment: the rate limit is per sender.
+    """
+
+    def __init__(
+        self,
+        rate: float = OUTBOX_RATE,
+        chat_interval: float = OUTBOX_CHAT_INTERVAL,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS
+    ):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # Monotonic time of the next free global send slot
+        self._next_slot = 0.0
+        # Monotonic time Telegram's flood control on the bot ends
+        self._paused_until = 0.0
+        self._chat_next: Dict[int, float] = {}
+        self._progress_shown: Dict[int, float] = {}
+
+    async def start(self, bot: Bot) -> None:
+        if self._task is None:
+            self.bot = bot
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self) -> None:
+        """Check the queue now instead of at the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                batch = await claim_outbox(self.batch_size, OUTBOX_LEASE)
+            except Exception:
+                batch = []
+            if not batch:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._deliver(batch)
+
+    async def _deliver(self, batch: List[Dict[str, Any]]) -> None:
+        sent: List[Dict[str, Any]] = []
+        failed: List[Tuple[Dict[str, Any], str]] = []
+        retry: List[Tuple[Dict[str, Any], float, Optional[str]]] = []
+
+        sends = []
+        for message in batch:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                retry.append((message, pause, None))
+                continue
+            delay = await self._wait_for_slot(message['chat_id'])
+            if delay:
+                retry.append((message, delay, None))
+                continue
+            sends.append(asyncio.create_task(self._send(message, sent, failed, retry)))
+        if sends:
+            await asyncio.gather(*sends)
+
+        try:
+            progress = await finish_outbox(sent, failed, retry)
+        except Exception:
+            # The lease runs out and the batch is delivered again
+            return
+        await self._report(progress)
+
+    async def _wait_for_slot(self, chat_id: int) -> float:
+        """Wait for a global send slot; returns a delay instead if the chat is too busy"""
+        now = time.monotonic()
+        chat_next = self._chat_next.get(chat_id, 0.0)
+        slot = max(now, self._next_slot)
+        if chat_next > slot:
+            return chat_next - now
+
+        self._next_slot = slot + 1 / self.rate
+        self._chat_next[chat_id] = slot + self.chat_interval
+        if len(self._chat_next) > MAX_TRACKED_CHATS:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        return 0.0
+
+    async def _send(self, message: Dict[str, Any], sent: List, failed: List, retry: List) -> None:
+        # Its slot may have come up while another send of the batch got a RetryAfter
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            retry.append((message, pause, None))
+            return
+        try:
+            await self.bot.send_message(message['chat_id'], message['text'])
+            sent.append(message)
+        except TelegramRetryAfter as e:
+            # Flood control applies to the whole bot: stop every send for a while
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            self._next_slot = max(self._next_slot, self._paused_until)
+            retry.append((message, e.retry_after, str(e)))
+        except (TelegramForbiddenError, TelegramNotFound, TelegramBadRequest) as e:
+            failed.append((message, str(e)))
+        except Exception as e:
+            if message['attempts'] >= self.max_attempts:
+                failed.append((message, str(e)))
+            else:
+                retry.append((message, min(2 ** message['attempts'], MAX_BACKOFF), str(e)))
+
+    async def _report(self, progress: List[Dict[str, Any]]) -> None:
+        """Edit the admins' progress messages, at most every few seconds each"""
+        now = time.monotonic()
+        for broadcast in progress:
+            if broadcast['progress_message_id'] is None:
+                continue
+            done = broadcast['sent'] + broadcast['failed'] >= broadcast['total']
+            if not done and now - self._progress_shown.get(broadcast['id'], 0.0) < OUTBOX_PROGRESS_INTERVAL:
+                continue
+            if done:
+                self._progress_shown.pop(broadcast['id'], None)
+            else:
+                self._progress_shown[broadcast['id']] = now
+            try:
+                await self.bot.edit_message_text(
+                    broadcast_progress_text(broadcast, done),
+                    chat_id=broadcast['admin_id'],
+                    message_id=broadcast['progress_message_id']
+                )
+            except Exception as e:
+                logger.warning(f"Error showing progress of broadcast {broadcast['id']}: {e}")
+
+
+def broadcast_progress_text(broadcast: Dict[str, Any], done: bool = False) -> str:
+    title = "📣 Xabar yuborildi" if done else "📣 Xabar yuborilmoqda"
+    return (
+        f"{title}: {broadcast['sent'] + broadcast['failed']}/{broadcast['total']}\n"
+        f"✅ Yetkazildi: {broadcast['sent']}\n"
+        f"⚠️ Yetkazilmadi: {broadcast['failed']}"
+    )
+
+
+# Sender of this process, started by main.on_startup where it should run
+outbox_sender = OutboxSender()
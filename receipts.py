@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+from config import RECEIPT_WORKERS, RECEIPT_QUEUE_LIMIT, METRICS_ENABLED
+from utils.receipt_pdf import render_receipt_pdf
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptRenderer:
+    """Render PDF receipts in a bounded pool of worker processes.
+
+    Rendering is CPU work that would stall every other update if it ran on
+    the event loop. At most ``queue_limit`` receipts render or wait for a
+    worker at once; past that ``render`` returns None right away and the
+    caller sends the text receipt. ``workers=0`` disables PDF receipts.
+
+    Workers are forked from a forkserver rather than from the bot process,
+    which has threads (aiosqlite, executors) that a fork would copy mid-use.
+    """
+
+    def __init__(self, workers: int = RECEIPT_WORKERS, queue_limit: int = RECEIPT_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self.fallbacks = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def start(self) -> None:
+        if self._pool is not None or self.workers <= 0:
+            return
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        # Start the processes now rather than on the first checkouts
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, os.getpid) for _ in range(self.workers)))
+        logger.info(f"Started {self.workers} receipt workers")
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+    async def render(self, order: Dict[str, Any], customer: str) -> Optional[bytes]:
+        """PDF receipt of a placed order, None when disabled, saturated or failed"""
+        if self._pool is None:
+            self._fallback("disabled")
+            return None
+        if self.pending >= self.queue_limit:
+            self._fallback("saturated")
+            return None
+
+        # Database rows don't pickle, the workers get plain tuples
+        items = [(item['name'], item['price'], item['quantity']) for item in order['items']]
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool, render_receipt_pdf, order['id'], order['created_at'], order['total'], items, customer
+            )
+        except Exception as e:
+            logger.error(f"Error rendering receipt: {e}")
+            self._fallback("failed")
+            return None
+        finally:
+            self.pending -= 1
+
+    def _fallback(self, reason: str) -> None:
+        self.fallbacks += 1
+        metrics.receipt_fallbacks.inc(reason=reason)
+
+
+# Shared renderer for this process
+receipt_renderer = ReceiptRenderer()
+
+if METRICS_ENABLED:
+    metrics.register_gauge("receipts_pending", "Receipts rendering or waiting for a worker", lambda: receipt_renderer.pending)
@@ -1,9 +1,5 @@
 from aiogram.fsm.state import State, StatesGroup
 
-class UserStates(StatesGroup):
-    """User states for FSM"""
-    selecting_quantity = State()
-
 class AdminStates(StatesGroup):
     """Admin states for FSM"""
     # Add product states
@@ -13,3 +9,11 @@ class AdminStates(StatesGroup):
     # Edit product states
     edit_product_name = State()
     edit_product_price = State()
+    edit_product_stock = State()
+    edit_product_category = State()
+    
+    # Bulk import state
+    import_catalog = State()
+    
+    # Broadcast state
+    broadcast_text = State()
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+from typing import Any, Callable, Dict, List
+
+from aiogram import Bot, Dispatcher
+
+from webhook import run_webhook, update_user_id
+
+logger = logging.getLogger(__name__)
+
+# Updates a worker may have waiting before the supervisor blocks on it
+WORKER_QUEUE_SIZE = 10000
+
+# Child processes are started fresh instead of forking a running event loop
+_mp = multiprocessing.get_context("spawn")
+
+
+class ShardRouter:
+    """Route raw updates to worker queues by Telegram user id.
+
+    Every update of a user lands on the same worker, which keeps the
+    per-user ordering the FSM flows rely on while the work spreads over
+    all workers. Updates without a user go to the first worker.
+    """
+
+    def __init__(self, queues: List[Any]):
+        self.queues = queues
+
+    async def submit(self, update: Dict[str, Any]) -> None:
+        user_id = update_user_id(update) or 0
+        worker_queue = self.queues[user_id % len(self.queues)]
+        try:
+            worker_queue.put_nowait(update)
+        except queue.Full:
+            # Worker is behind, wait in a thread so the event loop stays free
+            await asyncio.get_running_loop().run_in_executor(None, worker_queue.put, update)
+
+    async def drain(self) -> None:
+        """Updates are owned by the workers once queued"""
+
+
+async def consume_queue(worker_queue, feeder) -> None:
+    """Worker side: feed queued updates until the stop sentinel (None) arrives"""
+    loop = asyncio.get_running_loop()
+    while True:
+        update = await loop.run_in_executor(None, worker_queue.get)
+        if update is None:
+            break
+        await feeder.submit(update)
+
+
+def _start_worker(index: int, worker_queue, target: Callable) -> multiprocessing.Process:
+    # Not daemonic: workers start receipt worker processes of their own, and
+    # run_supervisor stops them explicitly on the way out
+    process = _mp.Process(target=target, args=(index, worker_queue), name=f"worker-{index}")
+    process.start()
+    logger.info(f"Started worker {index} (pid {process.pid})")
+    return process
+
+
+async def _watch_workers(processes: List[multiprocessing.Process], queues: List[Any], target: Callable) -> None:
+    """Restart workers that died, keeping their queue and shard"""
+    while True:
+        await asyncio.sleep(1)
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                processes[index] = _start_worker(index, queues[index], target)
+
+
+async def run_supervisor(dp: Dispatcher, bot: Bot, workers: int, target: Callable) -> None:
+    """Serve the webhook and shard updates over ``workers`` processes.
+
+    ``target(index, queue)`` is the worker entry point. It must be a module
+    level function so it can be started in a spawned process.
+    """
+    queues = [_mp.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+    processes = [_start_worker(index, queues[index], target) for index in range(workers)]
+    watcher = asyncio.create_task(_watch_workers(processes, queues, target))
+
+    try:
+        await run_webhook(dp, bot, feeder=ShardRouter(queues))
+    finally:
+        watcher.cancel()
+        for worker_queue in queues:
+            worker_queue.put(None)
+        for process in processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.join, 30)
+            if process.is_alive():
+                process.terminate()
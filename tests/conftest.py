@@ -0,0 +1,51 @@
+import asyncio
+import importlib
+import itertools
+import os
+
+import pytest
+
+from database.cache import catalog_cache
+
+# Users the backend tests act as; far above real Telegram ids so a run on a
+# scratch Postgres database does not touch anyone's cart
+_user_ids = itertools.count(3_000_000_000 + os.getpid() * 1000)
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path, monkeypatch):
+    """A storage backend module: SQLite on a fresh file, or the Postgres at DB_*.
+
+    Postgres runs only with TEST_POSTGRES=1; point DB_* at a scratch
+    database, the tests create products and orders in it.
+    """
+    if request.param == "postgres" and not os.getenv("TEST_POSTGRES"):
+        pytest.skip("set TEST_POSTGRES=1 and DB_* to a scratch database")
+    module = importlib.import_module(f"database.{request.param}")
+    if request.param == "sqlite":
+        monkeypatch.setattr(module, "SQLITE_PATH", str(tmp_path / "test.db"))
+    return module
+
+
+@pytest.fixture
+def user_id():
+    """A new user id for every call"""
+    return lambda: next(_user_ids)
+
+
+@pytest.fixture
+def run(backend):
+    """Run ``scenario()`` against the migrated backend in a fresh event loop"""
+    def run_scenario(scenario):
+        async def main():
+            await backend.init_db()
+            try:
+                await backend.migrate_schema()
+                catalog_cache.invalidate()
+                await scenario()
+            finally:
+                await backend.close_db()
+
+        asyncio.run(main())
+
+    return run_scenario
@@ -0,0 +1,267 @@
+"""Carts, orders, stock, order history and FSM rows, the same tests for both storage backends"""
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from database.errors import OutOfStock
+
+
+def test_add_to_cart_merges_lines(backend, run, user_id):
+    buyer = user_id()
+
+    async def scenario():
+        first = await backend.add_product("Sinov mahsuloti", Decimal("1000"))
+        second = await backend.add_product("Non", Decimal("3500"))
+        await backend.add_to_cart(buyer, first, 2)
+        await backend.add_to_cart(buyer, second, 1)
+        await backend.add_to_cart(buyer, first, 3)
+
+        items = await backend.get_cart_items(buyer)
+        assert [(item['product_id'], item['quantity']) for item in items] == [(first, 5), (second, 1)]
+        assert items[1]['price'] == Decimal("3500")
+
+        await backend.remove_from_cart(buyer, items[0]['id'])
+        assert [item['product_id'] for item in await backend.get_cart_items(buyer)] == [second]
+        await backend.clear_cart(buyer)
+        assert await backend.get_cart_items(buyer) == []
+        await backend.delete_product(first)
+        await backend.delete_product(second)
+
+    run(scenario)
+
+
+def test_place_order_moves_the_cart(backend, run, user_id):
+    buyer = user_id()
+
+    async def scenario():
+        product_id = await backend.add_product("Sinov mahsuloti", Decimal("2500.50"))
+        await backend.add_to_cart(buyer, product_id, 3)
+        order = await backend.place_order(buyer)
+
+        assert order['total'] == Decimal("7501.50")
+        assert [(item['product_id'], item['quantity']) for item in order['items']] == [(product_id, 3)]
+        assert order['items'][0]['name'] == "Sinov mahsuloti"
+        assert await backend.get_cart_items(buyer) == []
+        assert await backend.place_order(buyer) is None
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_expire_carts_keeps_recent_carts(backend, run, user_id):
+    buyer = user_id()
+
+    async def scenario():
+        product_id = await backend.add_product("Sinov mahsuloti", Decimal("1000"))
+        await backend.add_to_cart(buyer, product_id, 1)
+        await backend.expire_carts(3600, 100)
+        assert len(await backend.get_cart_items(buyer)) == 1
+
+        while await backend.expire_carts(0, 100):
+            pass
+        assert await backend.get_cart_items(buyer) == []
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_expire_carts_skips_locked_lines(backend, run, user_id):
+    if backend.__name__ != "database.postgres":
+        pytest.skip("SQLite runs one write transaction at a time")
+    buyer = user_id()
+
+    async def scenario():
+        product_id = await backend.add_product("Sinov mahsuloti", Decimal("1000"))
+        await backend.add_to_cart(buyer, product_id, 1)
+        async with backend.acquire("test") as conn, conn.transaction():
+            await conn.execute("SELECT 1 FROM cart WHERE user_id = $1 FOR UPDATE", buyer)
+            while await backend.expire_carts(0, 100):
+                pass
+        assert len(await backend.get_cart_items(buyer)) == 1
+
+        while await backend.expire_carts(0, 100):
+            pass
+        assert await backend.get_cart_items(buyer) == []
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_fsm_rows_keep_unwritten_fields(backend, run, user_id):
+    key = f"test:{user_id()}"
+
+    async def scenario():
+        await backend.fsm_set_many([(key, "Form:name", '{"a": 1}', True, True)])
+        state, expires_in = await backend.fsm_get_state(key, 60)
+        assert state == "Form:name"
+        assert 0 < expires_in <= 60
+        assert await backend.fsm_get_data(key, 60) == '{"a": 1}'
+
+        # Only the state was written, the data stays
+        await backend.fsm_set_many([(key, None, None, True, False)])
+        assert (await backend.fsm_get_state(key, 60))[0] is None
+        assert await backend.fsm_get_data(key, 60) == '{"a": 1}'
+
+        await backend.fsm_set_many([(key, None, '{}', False, True)])
+        assert await backend.fsm_cleanup(60) >= 1
+        assert await backend.fsm_get_data(key, 60) is None
+
+    run(scenario)
+
+
+async def tracked_product(backend, stock, price="1000"):
+    product_id = await backend.add_product("Sinov mahsuloti", Decimal(price))
+    await backend.set_stock(product_id, stock)
+    return product_id
+
+
+def test_add_to_cart_reserves_stock(backend, run, user_id):
+    buyer, other = user_id(), user_id()
+
+    async def scenario():
+        product_id = await tracked_product(backend, 5)
+        assert await backend.add_to_cart(buyer, product_id, 3)
+        assert await backend.get_stock(product_id) == 2
+
+        # Not enough left: nothing is reserved and nothing is added
+        assert not await backend.add_to_cart(other, product_id, 3)
+        assert await backend.get_stock(product_id) == 2
+        assert await backend.get_cart_items(other) == []
+
+        assert await backend.add_to_cart(other, product_id, 2)
+        assert await backend.get_stock(product_id) == 0
+        await backend.clear_cart(other)
+        assert await backend.get_stock(product_id) == 2
+
+        items = await backend.get_cart_items(buyer)
+        await backend.remove_from_cart(buyer, items[0]['id'])
+        assert await backend.get_stock(product_id) == 5
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_place_order_keeps_reserved_stock(backend, run, user_id):
+    buyer = user_id()
+
+    async def scenario():
+        product_id = await tracked_product(backend, 4, price="2500.50")
+        await backend.add_to_cart(buyer, product_id, 3)
+        order = await backend.place_order(buyer)
+
+        assert order['total'] == Decimal("7501.50")
+        assert [(item['product_id'], item['quantity']) for item in order['items']] == [(product_id, 3)]
+        assert await backend.get_stock(product_id) == 1
+        assert await backend.get_cart_items(buyer) == []
+        assert await backend.place_order(buyer) is None
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_checkout_reserves_released_lines_again(backend, run, user_id):
+    buyer, other = user_id(), user_id()
+
+    async def scenario():
+        product_id = await tracked_product(backend, 3)
+        await backend.add_to_cart(buyer, product_id, 2)
+        assert await backend.release_reservations(0, 1000) >= 1
+        assert await backend.get_stock(product_id) == 3
+
+        # Someone else takes the released stock, the idle cart comes up short
+        assert await backend.add_to_cart(other, product_id, 2)
+        with pytest.raises(OutOfStock) as error:
+            await backend.place_order(buyer)
+        assert error.value.names == ["Sinov mahsuloti"]
+        assert len(await backend.get_cart_items(buyer)) == 1
+        assert await backend.get_stock(product_id) == 1
+
+        await backend.set_stock(product_id, 5)
+        order = await backend.place_order(buyer)
+        assert order['items'][0]['quantity'] == 2
+        assert await backend.get_stock(product_id) == 3
+
+        await backend.clear_cart(other)
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_concurrent_buyers_never_oversell(backend, run, user_id):
+    buyers = [user_id() for _ in range(30)]
+
+    async def scenario():
+        product_id = await tracked_product(backend, 10)
+        added = await asyncio.gather(*(backend.add_to_cart(buyer, product_id, 1) for buyer in buyers))
+        assert sum(added) == 10
+        assert await backend.get_stock(product_id) == 0
+
+        orders = await asyncio.gather(*(backend.place_order(buyer) for buyer in buyers))
+        sold = sum(item['quantity'] for order in orders if order for item in order['items'])
+        assert sold == 10
+        assert await backend.get_stock(product_id) == 0
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_untracked_products_are_not_limited(backend, run, user_id):
+    buyer = user_id()
+
+    async def scenario():
+        product_id = await backend.add_product("Cheksiz", Decimal("10"))
+        assert await backend.add_to_cart(buyer, product_id, 1000)
+        assert await backend.get_stock(product_id) is None
+        assert (await backend.place_order(buyer))['items'][0]['quantity'] == 1000
+        await backend.delete_product(product_id)
+
+    run(scenario)
+
+
+def test_orders_page_by_keyset(backend, run, user_id):
+    buyer, stranger = user_id(), user_id()
+    size = backend.ORDERS_PAGE_SIZE
+    count = size * 2 + 3
+
+    async def scenario():
+        product_id = await backend.add_product("Non", Decimal("3500"))
+        placed = []
+        for quantity in range(1, count + 1):
+            await backend.add_to_cart(buyer, product_id, quantity)
+            placed.append((await backend.place_order(buyer))['id'])
+        newest_first = placed[::-1]
+
+        first, has_prev, has_next = await backend.get_orders_page(buyer)
+        assert [order['id'] for order in first] == newest_first[:size]
+        assert (has_prev, has_next) == (False, True)
+
+        second, has_prev, has_next = await backend.get_orders_page(buyer, after_id=first[-1]['id'])
+        assert [order['id'] for order in second] == newest_first[size:2 * size]
+        assert (has_prev, has_next) == (True, True)
+
+        last, has_prev, has_next = await backend.get_orders_page(buyer, after_id=second[-1]['id'])
+        assert [order['id'] for order in last] == newest_first[2 * size:]
+        assert (has_prev, has_next) == (True, False)
+
+        back, has_prev, has_next = await backend.get_orders_page(buyer, before_id=last[0]['id'])
+        assert [order['id'] for order in back] == [order['id'] for order in second]
+        assert (has_prev, has_next) == (True, True)
+
+        back, has_prev, has_next = await backend.get_orders_page(buyer, before_id=back[0]['id'])
+        assert [order['id'] for order in back] == [order['id'] for order in first]
+        assert (has_prev, has_next) == (False, True)
+
+        # Another user's order as the anchor gives that user's first page
+        assert (await backend.get_orders_page(stranger, after_id=placed[0]))[0] == []
+        assert await backend.get_order(stranger, placed[0]) is None
+
+        order = await backend.get_order(buyer, placed[2])
+        assert order['total'] == Decimal(3500 * 3)
+        assert [item['quantity'] for item in order['items']] == [3]
+
+        assert await backend.get_order_summary(buyer) == (count, Decimal(3500 * count * (count + 1) // 2))
+        assert await backend.get_order_summary(stranger) == (0, Decimal(0))
+        await backend.delete_product(product_id)
+
+    run(scenario)
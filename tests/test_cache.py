@@ -0,0 +1,72 @@
+"""Catalog cache loading and keyset pages"""
+import asyncio
+
+from database.cache import CatalogCache
+
+PRODUCTS = [{'id': product_id, 'name': f"Mahsulot {product_id}"} for product_id in (1, 2, 3, 5, 8)]
+
+
+def ids(products):
+    return [product['id'] for product in products]
+
+
+def loaded_cache():
+    cache = CatalogCache()
+
+    async def loader():
+        return PRODUCTS
+
+    asyncio.run(cache.get_all(loader))
+    return cache
+
+
+def test_concurrent_misses_load_once():
+    cache = CatalogCache()
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0)
+        return PRODUCTS
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.get_all(loader) for _ in range(5)))
+        assert all(result is PRODUCTS for result in results)
+
+    asyncio.run(scenario())
+    assert loads == [1]
+    assert cache.loaded
+
+
+def test_load_started_before_invalidate_is_not_installed():
+    cache = CatalogCache()
+
+    async def loader():
+        cache.invalidate()
+        return PRODUCTS
+
+    assert asyncio.run(cache.get_all(loader)) is PRODUCTS
+    assert not cache.loaded
+
+
+def test_page_forward():
+    cache = loaded_cache()
+    assert [(ids(page), has_prev, has_next) for page, has_prev, has_next in (
+        cache.page(0, None, 2),
+        cache.page(2, None, 2),
+        cache.page(5, None, 2),
+    )] == [([1, 2], False, True), ([3, 5], True, True), ([8], True, False)]
+
+
+def test_page_backward():
+    cache = loaded_cache()
+    page, has_prev, has_next = cache.page(0, 5, 2)
+    assert (ids(page), has_prev, has_next) == ([2, 3], True, True)
+    page, has_prev, has_next = cache.page(0, 2, 2)
+    assert (ids(page), has_prev, has_next) == ([1], False, True)
+
+
+def test_page_after_deleted_id():
+    # The id the keyboard points at may be gone by the time it is tapped
+    page, has_prev, has_next = loaded_cache().page(4, None, 2)
+    assert (ids(page), has_prev, has_next) == ([5, 8], True, False)
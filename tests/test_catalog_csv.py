@@ -0,0 +1,57 @@
+"""Catalog CSV validation"""
+import io
+from decimal import Decimal
+
+import pytest
+
+from utils.catalog_csv import MAX_REPORTED_ERRORS, CatalogRows
+
+
+def rows(text):
+    return CatalogRows(io.StringIO(text))
+
+
+def test_header_needs_name_and_price():
+    with pytest.raises(ValueError):
+        rows("id,name\n1,Non\n")
+    with pytest.raises(ValueError):
+        rows("")
+
+
+def test_valid_rows():
+    catalog = rows(" ID , Name ,PRICE\n7,Non,\"4 500,5\"\n,Sut,12000\n")
+    assert list(catalog) == [(7, "Non", Decimal("4500.50")), (None, "Sut", Decimal("12000.00"))]
+    assert (catalog.valid, catalog.rejected, catalog.errors) == (2, 0, [])
+
+
+def test_invalid_rows_are_skipped_and_reported():
+    catalog = rows(
+        "id,name,price\n"
+        "1,,100\n"
+        "2,Non,abc\n"
+        "3,Non,0\n"
+        "4,Non,100000000\n"
+        "5,Non,100\n"
+        "5,Sut,100\n"
+        "2147483648,Tuz,100\n"
+        "-1,Tuz,100\n"
+    )
+    assert list(catalog) == [(5, "Non", Decimal("100.00"))]
+    assert catalog.valid == 1
+    assert catalog.rejected == 7
+    assert catalog.errors == [
+        (2, "nomi bo'sh"),
+        (3, "narx raqam emas"),
+        (4, "narx noto'g'ri"),
+        (5, "narx noto'g'ri"),
+        (7, "id takrorlangan"),
+        (8, "id noto'g'ri"),
+        (9, "id noto'g'ri"),
+    ]
+
+
+def test_only_the_first_errors_are_kept():
+    catalog = rows("name,price\n" + ",1\n" * (MAX_REPORTED_ERRORS + 5))
+    assert list(catalog) == []
+    assert catalog.rejected == MAX_REPORTED_ERRORS + 5
+    assert len(catalog.errors) == MAX_REPORTED_ERRORS
@@ -0,0 +1,107 @@
+"""Category tree levels, counts and incremental updates"""
+from utils.categories import ROOT, CategoryTree
+
+CATEGORIES = [
+    {'id': 1, 'name': "Ichimliklar", 'parent_id': None},
+    {'id': 2, 'name': "Suv", 'parent_id': 1},
+    {'id': 3, 'name': "Choy", 'parent_id': 1},
+    {'id': 4, 'name': "Mevalar", 'parent_id': None},
+]
+
+PRODUCTS = [
+    {'id': 10, 'name': "Nestle", 'category_id': 2},
+    {'id': 11, 'name': "Hydrolife", 'category_id': 2},
+    {'id': 12, 'name': "Ahmad", 'category_id': 3},
+    {'id': 13, 'name': "Non", 'category_id': None},
+    # Unknown categories are listed at the root
+    {'id': 14, 'name': "Tuz", 'category_id': 99},
+]
+
+
+def tree():
+    result = CategoryTree()
+    result.rebuild(CATEGORIES, PRODUCTS, version=1)
+    return result
+
+
+def ids(items):
+    return [item['id'] for item in items]
+
+
+def test_counts_include_subcategories():
+    categories = tree()
+    assert categories.count(ROOT) == 5
+    assert categories.count(1) == 3
+    assert categories.count(2) == 2
+    assert categories.count(4) == 0
+    assert ids(categories.path(2)) == [1, 2]
+
+
+def test_level_lists_children_by_name_and_hides_empty_ones():
+    categories = tree()
+    root = categories.level(ROOT, 0, None, 10)
+    assert [(category['id'], count) for category, count in root.children] == [(1, 3)]
+    assert ids(root.products) == [13, 14]
+    assert root.category is None
+
+    with_empty = categories.level(ROOT, 0, None, 10, include_empty=True)
+    assert [category['id'] for category, _ in with_empty.children] == [1, 4]
+
+    drinks = categories.level(1, 0, None, 10)
+    assert [category['name'] for category, _ in drinks.children] == ["Choy", "Suv"]
+    assert drinks.products == []
+    assert categories.level(99, 0, None, 10) is None
+
+
+def test_level_pages_products_by_keyset():
+    categories = tree()
+    first = categories.level(2, 0, None, 1)
+    assert (ids(first.products), first.has_prev, first.has_next) == ([10], False, True)
+    second = categories.level(2, 10, None, 1)
+    assert (ids(second.products), second.has_prev, second.has_next) == ([11], True, False)
+    back = categories.level(2, 0, 11, 1)
+    assert (ids(back.products), back.has_prev, back.has_next) == ([10], False, True)
+
+
+def test_apply_matches_rebuild():
+    categories = tree()
+    categories.apply(2, product={'id': 15, 'name': "Lipton", 'category_id': 3})
+    categories.apply(3, category={'id': 5, 'name': "Gazli", 'parent_id': 1})
+    categories.apply(4, product={'id': 10, 'name': "Nestle", 'category_id': 5})
+    categories.apply(5, category={'id': 4, 'name': "Sabzavotlar", 'parent_id': None})
+    # Like the database: subcategories and products move up to the parent
+    categories.apply(6, removed_category_id=1)
+    categories.apply(7, removed_id=11)
+    assert categories.version == 7
+
+    expected = CategoryTree()
+    expected.rebuild(
+        [
+            {'id': 2, 'name': "Suv", 'parent_id': None},
+            {'id': 3, 'name': "Choy", 'parent_id': None},
+            {'id': 4, 'name': "Sabzavotlar", 'parent_id': None},
+            {'id': 5, 'name': "Gazli", 'parent_id': None},
+        ],
+        [
+            {'id': 10, 'name': "Nestle", 'category_id': 5},
+            {'id': 12, 'name': "Ahmad", 'category_id': 3},
+            {'id': 13, 'name': "Non", 'category_id': None},
+            {'id': 14, 'name': "Tuz", 'category_id': 99},
+            {'id': 15, 'name': "Lipton", 'category_id': 3},
+        ],
+        version=7,
+    )
+    assert list(categories.outline()) == list(expected.outline())
+    for category_id in (ROOT, 2, 3, 4, 5):
+        level = categories.level(category_id, 0, None, 10, include_empty=True)
+        other = expected.level(category_id, 0, None, 10, include_empty=True)
+        assert ids(level.products) == ids(other.products)
+        assert level.children == other.children
+    assert categories.count(ROOT) == expected.count(ROOT) == 5
+
+
+def test_apply_skips_writes_it_missed():
+    categories = tree()
+    categories.apply(3, product={'id': 15, 'name': "Lipton", 'category_id': 3})
+    assert categories.version == 1
+    assert categories.count(3) == 1
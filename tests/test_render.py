@@ -0,0 +1,31 @@
+"""Message splitting, measured in UTF-16 code units like Telegram does"""
+from utils.render import split_blocks
+
+# One code point, two UTF-16 code units
+EMOJI = "🧺"
+
+
+def utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def test_blocks_are_packed_by_utf16_length():
+    # Three blocks are 9 code points but 18 code units: only two fit in 12
+    chunks = split_blocks([EMOJI * 3] * 3, limit=12)
+    assert chunks == [EMOJI * 6, EMOJI * 3]
+
+
+def test_block_exactly_at_the_limit_stays_whole():
+    chunks = split_blocks(["a", EMOJI * 5, "b"], limit=10)
+    assert chunks == ["a", EMOJI * 5, "b"]
+
+
+def test_oversized_block_is_cut_under_the_limit():
+    block = EMOJI * 12 + "x"
+    chunks = split_blocks(["Savat:\n", block], limit=10)
+    assert ''.join(chunks) == "Savat:\n" + block
+    assert all(utf16_length(chunk) <= 10 for chunk in chunks)
+
+
+def test_no_blocks():
+    assert split_blocks([]) == []
@@ -0,0 +1,28 @@
+"""Search normalisation and the product index"""
+from utils.search import ProductIndex, normalize, to_latin
+
+
+def test_to_latin_keeps_case_and_punctuation():
+    assert to_latin("Ғишт, Ўрик!") == "Gʻisht, Oʻrik!"
+    assert to_latin("Шоколад 100 г") == "Shokolad 100 g"
+
+
+def test_normalize_spellings_meet():
+    assert normalize("Ўзбек гўшти") == "ozbek goshti"
+    assert normalize("O‘zbek go'shti") == "ozbek goshti"
+    assert normalize("  OZBEK   GOʻSHTI!! ") == "ozbek goshti"
+    assert normalize("...") == ""
+
+
+def test_search_finds_latin_names_by_cyrillic_prefix_and_typo():
+    index = ProductIndex()
+    index.rebuild([
+        {'id': 1, 'name': "Qo'y go'shti"},
+        {'id': 2, 'name': "Mol go'shti"},
+        {'id': 3, 'name': "Shokolad"},
+    ], version=1)
+    assert [p['id'] for p in index.search("гўшт", 10)] == [2, 1]
+    # Prefix matches rank first, fuzzy matches fill the rest
+    assert [p['id'] for p in index.search("қўй гўшт", 10)] == [1, 2]
+    assert [p['id'] for p in index.search("shokalad", 10)] == [3]
+    assert index.search("   ", 10) == []
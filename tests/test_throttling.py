@@ -0,0 +1,122 @@
+"""Per-user token bucket and callback coalescing"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import CallbackQuery, Message, User
+
+from middlewares import throttling
+from middlewares.throttling import ThrottlingMiddleware
+
+USER = User(id=1, is_bot=False, first_name="Ali")
+OTHER = User(id=2, is_bot=False, first_name="Vali")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Time seen by the middleware, moved by hand"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(throttling, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Texts of callback answers, None for an empty answer"""
+    sent = []
+
+    async def answer(self, text=None, **kwargs):
+        sent.append(text)
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    return sent
+
+
+def callback(user, data):
+    return CallbackQuery(id="1", from_user=user, chat_instance="chat", data=data)
+
+
+async def handled(event, data):
+    return "handled"
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    middleware = ThrottlingMiddleware(rate=2, burst=3)
+    message = Message.model_construct(text="salom")
+
+    async def send(user):
+        return await middleware(handled, message, {"event_from_user": user})
+
+    async def scenario():
+        assert [await send(USER) for _ in range(4)] == ["handled"] * 3 + [None]
+        # Buckets are per user
+        assert await send(OTHER) == "handled"
+        clock.value += 0.5
+        assert await send(USER) == "handled"
+        assert await send(USER) is None
+
+    asyncio.run(scenario())
+
+
+def test_exempt_users_are_not_limited(clock):
+    middleware = ThrottlingMiddleware(rate=1, burst=1, exempt=[USER.id])
+
+    async def send(user):
+        return await middleware(handled, Message.model_construct(text="Non"), {"event_from_user": user})
+
+    async def scenario():
+        assert [await send(USER) for _ in range(5)] == ["handled"] * 5
+        assert [await send(OTHER) for _ in range(2)] == ["handled", None]
+
+    asyncio.run(scenario())
+
+
+def test_updates_without_user_are_not_limited(clock):
+    middleware = ThrottlingMiddleware(rate=1, burst=1)
+
+    async def scenario():
+        for _ in range(3):
+            assert await middleware(handled, Message.model_construct(text="x"), {}) == "handled"
+
+    asyncio.run(scenario())
+
+
+def test_throttled_callback_is_answered(clock, answers):
+    middleware = ThrottlingMiddleware(rate=1, burst=1)
+
+    async def scenario():
+        data = {"event_from_user": USER}
+        assert await middleware(handled, callback(USER, "buy:1"), data) == "handled"
+        assert await middleware(handled, callback(USER, "buy:2"), data) is None
+
+    asyncio.run(scenario())
+    assert answers == ["Iltimos, biroz kuting."]
+
+
+def test_repeated_callback_is_dropped_while_the_first_runs(clock, answers):
+    middleware = ThrottlingMiddleware(rate=100, burst=100)
+    calls = []
+
+    async def scenario():
+        done = asyncio.Event()
+
+        async def slow(event, data):
+            calls.append(event.data)
+            await done.wait()
+            return "handled"
+
+        data = {"event_from_user": USER}
+        first = asyncio.create_task(middleware(slow, callback(USER, "buy:1"), data))
+        await asyncio.sleep(0)
+        assert await middleware(slow, callback(USER, "buy:1"), data) is None
+        other = asyncio.create_task(middleware(slow, callback(USER, "buy:2"), data))
+        await asyncio.sleep(0)
+        done.set()
+        assert await first == "handled"
+        assert await other == "handled"
+        # Once the first one is finished the same button works again
+        assert await middleware(slow, callback(USER, "buy:1"), data) == "handled"
+
+    asyncio.run(scenario())
+    assert calls == ["buy:1", "buy:2", "buy:1"]
+    assert answers == [None]
@@ -0,0 +1,68 @@
+import csv
+from decimal import Decimal, InvalidOperation
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+# Largest value that fits products.price NUMERIC(10, 2)
+MAX_PRICE = Decimal("99999999.99")
+
+# Largest value of products.id (SERIAL)
+MAX_ID = 2 ** 31 - 1
+
+# Rejected rows kept for the report, the rest are only counted
+MAX_REPORTED_ERRORS = 10
+
+
+class CatalogRows:
+    """Validated (id, name, price) records read lazily from a catalog CSV.
+
+    The file needs a header with ``name`` and ``price`` columns and may have
+    an ``id`` column (as written by the export). Invalid rows are skipped and
+    counted; the first few are kept with their line number and reason.
+    """
+
+    def __init__(self, file: TextIO):
+        self.reader = csv.DictReader(file)
+        columns = {(name or '').strip().lower() for name in self.reader.fieldnames or []}
+        if not {'name', 'price'} <= columns:
+            raise ValueError("CSV sarlavhasida name va price ustunlari bo'lishi kerak")
+        self.reader.fieldnames = [(name or '').strip().lower() for name in self.reader.fieldnames]
+        self.valid = 0
+        self.rejected = 0
+        self.errors: List[Tuple[int, str]] = []
+        self._ids = set()
+
+    def __iter__(self) -> Iterator[Tuple[Optional[int], str, Decimal]]:
+        for row in self.reader:
+            try:
+                record = self._parse(row)
+            except ValueError as e:
+                self.rejected += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append((self.reader.line_num, str(e)))
+                continue
+            self.valid += 1
+            yield record
+
+    def _parse(self, row) -> Tuple[Optional[int], str, Decimal]:
+        name = (row.get('name') or '').strip()
+        if not name:
+            raise ValueError("nomi bo'sh")
+
+        try:
+            price = Decimal((row.get('price') or '').strip().replace(' ', '').replace(',', '.'))
+        except InvalidOperation:
+            raise ValueError("narx raqam emas")
+        if not price.is_finite() or price <= 0 or price > MAX_PRICE:
+            raise ValueError("narx noto'g'ri")
+
+        raw_id = (row.get('id') or '').strip()
+        product_id = None
+        if raw_id:
+            if not raw_id.isdigit() or int(raw_id) > MAX_ID:
+                raise ValueError("id noto'g'ri")
+            product_id = int(raw_id)
+            if product_id in self._ids:
+                raise ValueError("id takrorlangan")
+            self._ids.add(product_id)
+
+        return product_id, name, price.quantize(Decimal("0.01"))
@@ -0,0 +1,221 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Products without a category (or in one that no longer exists) are listed
+# at the root, next to the top-level categories
+ROOT = None
+
+
+class CategoryLevel:
+    """What one tap on a category shows: its subcategories and a page of its own products"""
+    __slots__ = ('category', 'path', 'children', 'products', 'has_prev', 'has_next')
+
+    def __init__(self, category, path, children, products, has_prev, has_next):
+        self.category: Optional[Dict[str, Any]] = category
+        self.path: List[Dict[str, Any]] = path
+        self.children: List[Tuple[Dict[str, Any], int]] = children
+        self.products: List[Dict[str, Any]] = products
+        self.has_prev: bool = has_prev
+        self.has_next: bool = has_next
+
+
+class CategoryTree:
+    """In-memory category hierarchy with the products assigned to it.
+
+    Keeps each category's children sorted by name, the ids of its own
+    products and the number of products in its whole subtree, so any level
+    is served without a query. ``version`` is the catalog version the tree
+    reflects: category writes bump the catalog version too. ``apply`` keeps
+    the tree in step with single writes, anything else needs ``rebuild``.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self._categories: Dict[int, Dict[str, Any]] = {}
+        self._children: Dict[Optional[int], List[int]] = {ROOT: []}
+        self._counts: Dict[Optional[int], int] = {ROOT: 0}
+        self._products: Dict[int, Dict[str, Any]] = {}
+        self._placed: Dict[int, Optional[int]] = {}
+        self._product_ids: Dict[Optional[int], List[int]] = {ROOT: []}
+
+    def rebuild(self, categories: List[Dict[str, Any]], products: List[Dict[str, Any]], version: int) -> None:
+        self._categories = {category['id']: dict(category) for category in categories}
+        self._children = {ROOT: []}
+        self._counts = {ROOT: 0}
+        self._product_ids = {ROOT: []}
+        for category_id in self._categories:
+            self._children[category_id] = []
+            self._counts[category_id] = 0
+            self._product_ids[category_id] = []
+        for category_id, category in self._categories.items():
+            self._children[self._parent(category)].append(category_id)
+        for children in self._children.values():
+            children.sort(key=self._sort_key)
+
+        self._products = {}
+        self._placed = {}
+        for product in products:
+            self._add_product(product)
+        self.version = version
+
+    def apply(
+        self,
+        version: int,
+        category: Optional[Dict[str, Any]] = None,
+        removed_category_id: Optional[int] = None,
+        product: Optional[Dict[str, Any]] = None,
+        removed_id: Optional[int] = None
+    ) -> None:
+        """Apply one catalog write that produced ``version``.
+
+        A removed category hands its subcategories and products over to its
+        parent, like the database does. Only done when the tree is exactly
+        one version behind; otherwise it stays stale and the next read
+        rebuilds it.
+        """
+        if self.version != version - 1:
+            return
+        if removed_category_id is not None:
+            self._remove_category(removed_category_id)
+        if category is not None:
+            self._put_category(category)
+        if removed_id is not None:
+            self._remove_product(removed_id)
+        if product is not None:
+            self._remove_product(product['id'])
+            self._add_product(product)
+        self.version = version
+
+    def _sort_key(self, category_id: int) -> Tuple[str, int]:
+        return self._categories[category_id]['name'].casefold(), category_id
+
+    def _parent(self, category: Dict[str, Any]) -> Optional[int]:
+        parent_id = category['parent_id']
+        return parent_id if parent_id in self._categories else ROOT
+
+    def _ancestors(self, category_id: Optional[int]) -> Iterator[Optional[int]]:
+        """The category itself, its parents up to the top level, then ROOT"""
+        while category_id is not ROOT:
+            yield category_id
+            category_id = self._parent(self._categories[category_id])
+        yield ROOT
+
+    def _put_category(self, category: Dict[str, Any]) -> None:
+        category_id = category['id']
+        old = self._categories.get(category_id)
+        if old is None:
+            self._children[category_id] = []
+            self._counts[category_id] = 0
+            self._product_ids[category_id] = []
+        else:
+            self._children[self._parent(old)].remove(category_id)
+            for ancestor in self._ancestors(self._parent(old)):
+                self._counts[ancestor] -= self._counts[category_id]
+        self._categories[category_id] = dict(category)
+        self._insert_child(self._parent(category), category_id)
+        for ancestor in self._ancestors(self._parent(category)):
+            self._counts[ancestor] += self._counts[category_id]
+
+    def _insert_child(self, parent_id: Optional[int], category_id: int) -> None:
+        # Sibling lists are short, re-sorting beats keeping a parallel key list
+        children = self._children[parent_id]
+        children.append(category_id)
+        children.sort(key=self._sort_key)
+
+    def _remove_category(self, category_id: int) -> None:
+        category = self._categories.get(category_id)
+        if category is None:
+            return
+        parent_id = self._parent(category)
+        self._children[parent_id].remove(category_id)
+
+        # Counts above are unchanged: everything stays in the parent's subtree
+        for child_id in self._children.pop(category_id):
+            self._categories[child_id]['parent_id'] = parent_id
+            self._insert_child(parent_id, child_id)
+        for product_id in self._product_ids.pop(category_id):
+            self._placed[product_id] = parent_id
+            insort(self._product_ids[parent_id], product_id)
+        del self._counts[category_id]
+        del self._categories[category_id]
+
+    def _add_product(self, product: Dict[str, Any]) -> None:
+        product_id = product['id']
+        category_id = product['category_id']
+        if category_id not in self._categories:
+            category_id = ROOT
+        self._products[product_id] = product
+        self._placed[product_id] = category_id
+        insort(self._product_ids[category_id], product_id)
+        for ancestor in self._ancestors(category_id):
+            self._counts[ancestor] += 1
+
+    def _remove_product(self, product_id: int) -> None:
+        if product_id not in self._placed:
+            return
+        category_id = self._placed.pop(product_id)
+        del self._products[product_id]
+        ids = self._product_ids[category_id]
+        del ids[bisect_left(ids, product_id)]
+        for ancestor in self._ancestors(category_id):
+            self._counts[ancestor] -= 1
+
+    def __contains__(self, category_id: Optional[int]) -> bool:
+        return category_id is ROOT or category_id in self._categories
+
+    def get(self, category_id: int) -> Optional[Dict[str, Any]]:
+        return self._categories.get(category_id)
+
+    def count(self, category_id: Optional[int] = ROOT) -> int:
+        """Products in the category and all its subcategories"""
+        return self._counts.get(category_id, 0)
+
+    def path(self, category_id: Optional[int]) -> List[Dict[str, Any]]:
+        """Categories from the top level down to ``category_id``"""
+        if category_id not in self:
+            return []
+        return [self._categories[ancestor] for ancestor in self._ancestors(category_id) if ancestor is not ROOT][::-1]
+
+    def level(
+        self,
+        category_id: Optional[int],
+        after_id: int,
+        before_id: Optional[int],
+        size: int,
+        include_empty: bool = False
+    ) -> Optional[CategoryLevel]:
+        """Subcategories and a keyset page of the category's own products.
+
+        Empty subcategories are left out unless ``include_empty``. Returns
+        None for an unknown category.
+        """
+        if category_id not in self:
+            return None
+        children = [
+            (self._categories[child_id], self._counts[child_id])
+            for child_id in self._children[category_id]
+            if include_empty or self._counts[child_id]
+        ]
+
+        ids = self._product_ids[category_id]
+        if before_id is not None:
+            end = bisect_left(ids, before_id)
+            start = max(end - size, 0)
+        else:
+            start = bisect_right(ids, after_id)
+            end = start + size
+        products = [self._products[product_id] for product_id in ids[start:end]]
+        category = None if category_id is ROOT else self._categories[category_id]
+        return CategoryLevel(category, self.path(category_id), children, products, start > 0, end < len(ids))
+
+    def outline(self) -> Iterator[Tuple[int, Dict[str, Any], int]]:
+        """Every category depth first as (depth, category, product count)"""
+        stack = [(0, child_id) for child_id in reversed(self._children[ROOT])]
+        while stack:
+            depth, category_id = stack.pop()
+            yield depth, self._categories[category_id], self._counts[category_id]
+            stack.extend((depth + 1, child_id) for child_id in reversed(self._children[category_id]))
+
+
+# Shared category tree for this process
+category_tree = CategoryTree()
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, List, Optional
+
+from aiogram.types import CallbackQuery
+
+# Calls a single handler runs at the same time by default
+DEFAULT_LIMIT = 4
+
+
+async def gather_bounded(*aws: Awaitable[Any], limit: int = DEFAULT_LIMIT) -> List[Any]:
+    """Run independent awaitables concurrently, at most ``limit`` at a time.
+
+    Results come back in argument order. If one fails the others are
+    cancelled and the error is raised, like a task group.
+    """
+    slots = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with slots:
+            return await aw
+
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+@asynccontextmanager
+async def answered(callback: CallbackQuery, text: Optional[str] = None, show_alert: bool = False):
+    """Answer a callback query right away and keep working meanwhile.
+
+    The client's spinner stops after one round trip instead of after the
+    whole handler. The answer is awaited on exit so the handler still ends
+    after it; failing to answer (e.g. a query that is too old) is logged,
+    not raised.
+    """
+    task = asyncio.ensure_future(callback.answer(text, show_alert=show_alert))
+    try:
+        yield
+    finally:
+        try:
+            await task
+        except Exception as e:
+            logging.warning(f"Error answering callback query: {e}")
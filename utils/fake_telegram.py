@@ -0,0 +1,180 @@
+"""Local stand-in for the Telegram side of the bot, for offline runs.
+
+Run the fake Bot API and point the bot at it with TELEGRAM_API_URL::
+
+    python -m utils.fake_telegram api --port 8081
+    TELEGRAM_API_URL=http://localhost:8081 python main.py --mode webhook
+
+then post synthetic updates to the webhook::
+
+    python -m utils.fake_telegram send --url http://localhost:8080/webhook --users 50 --text "🛍 Mahsulotlar"
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import ClientSession, web
+
+# Methods whose result is the sent or edited message
+MESSAGE_METHODS = {
+    'sendmessage',
+    'senddocument',
+    'sendphoto',
+    'editmessagetext',
+    'editmessagereplymarkup'
+}
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Korzinka', 'username': 'korzinka_bot'}
+
+
+class FakeTelegramAPI:
+    """Answers Bot API calls with minimal valid results and counts them"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        self.calls[method] += 1
+        fields = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': self.result(method, fields)})
+
+    def result(self, method: str, fields) -> Any:
+        if method == 'getme':
+            return BOT_USER
+        if method in MESSAGE_METHODS:
+            chat_id = int(fields.get('chat_id') or 0)
+            message = {
+                'message_id': int(fields.get('message_id') or next(self._message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER
+            }
+            if fields.get('text'):
+                message['text'] = fields['text']
+            return message
+        return True
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+
+
+def message_update(user_id: int, text: str) -> Dict[str, Any]:
+    """Update with a private text message from user_id"""
+    return {
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_update_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': _user(user_id),
+            'text': text
+        }
+    }
+
+
+def callback_update(user_id: int, data: str, message_id: Optional[int] = None) -> Dict[str, Any]:
+    """Update with an inline button press by user_id"""
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id or next(_update_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '...'
+            }
+        }
+    }
+
+
+async def send_updates(url: str, updates, secret: str = '', concurrency: int = 20) -> Counter:
+    """POST updates to a webhook and count the response statuses"""
+    statuses = Counter()
+    slots = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with ClientSession() as session:
+        async def post(update):
+            async with slots:
+                async with session.post(url, json=update, headers=headers) as response:
+                    statuses[response.status] += 1
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return statuses
+
+
+async def _serve_api(port: int, latency: float) -> None:
+    api = FakeTelegramAPI(latency)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', port).start()
+    print(f"Fake Bot API on http://localhost:{port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(dict(api.calls))
+    finally:
+        await runner.cleanup()
+
+
+async def _send(args) -> None:
+    updates = []
+    for user_id in range(1, args.users + 1):
+        if args.callback:
+            updates.append(callback_update(user_id, args.callback))
+        else:
+            updates.append(message_update(user_id, args.text))
+
+    started = time.perf_counter()
+    statuses = await send_updates(args.url, updates, args.secret, args.concurrency)
+    elapsed = time.perf_counter() - started
+    print(f"Sent {len(updates)} updates in {elapsed:.2f}s: {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    api = commands.add_parser('api', help="run the fake Bot API server")
+    api.add_argument('--port', type=int, default=8081)
+    api.add_argument('--latency', type=float, default=0.0, help="seconds to wait before each answer")
+
+    send = commands.add_parser('send', help="post synthetic updates to a webhook")
+    send.add_argument('--url', default='http://localhost:8080/webhook')
+    send.add_argument('--secret', default='')
+    send.add_argument('--users', type=int, default=10)
+    send.add_argument('--text', default="🛍 Mahsulotlar")
+    send.add_argument('--callback', help="send this callback data instead of a text message")
+    send.add_argument('--concurrency', type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == 'api':
+        asyncio.run(_serve_api(args.port, args.latency))
+    else:
+        asyncio.run(_send(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+from aiohttp import web
+
+# Latency buckets in seconds, from a cache hit to a stuck query
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels.items())
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Per label set: observations per bucket, the last one is +Inf
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name: str, description: str, read: Callable[[], float]):
+        self.name = name
+        self.description = description
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+handler_seconds = Histogram("bot_handler_seconds", "Time spent in update handlers")
+handler_errors = Counter("bot_handler_errors_total", "Handlers that raised")
+pool_wait_seconds = Histogram("db_pool_wait_seconds", "Time waiting for a pool connection")
+query_seconds = Histogram("db_query_seconds", "Time a pool connection was held")
+query_errors = Counter("db_query_errors_total", "Database calls that raised")
+api_seconds = Histogram("telegram_api_seconds", "Bot API request latency")
+api_errors = Counter("telegram_api_errors_total", "Bot API requests that failed")
+receipt_fallbacks = Counter("receipt_fallbacks_total", "Checkouts that got a text receipt instead of a PDF")
+
+_metrics = [
+    handler_seconds, handler_errors,
+    pool_wait_seconds, query_seconds, query_errors,
+    api_seconds, api_errors,
+    receipt_fallbacks
+]
+
+
+def register_gauge(name: str, description: str, read: Callable[[], float]) -> None:
+    _metrics.append(Gauge(name, description, read))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TimedAcquire:
+    """``pool.acquire()`` that records wait and hold time under a query name"""
+    __slots__ = ('_acquire', '_query', '_started', '_acquired')
+
+    def __init__(self, pool, query: str):
+        self._acquire = pool.acquire()
+        self._query = query
+
+    async def __aenter__(self):
+        self._started = time.perf_counter()
+        conn = await self._acquire.__aenter__()
+        self._acquired = time.perf_counter()
+        pool_wait_seconds.observe(self._acquired - self._started, query=self._query)
+        return conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        query_seconds.observe(time.perf_counter() - self._acquired, query=self._query)
+        if exc_type is not None:
+            query_errors.inc(query=self._query)
+        return await self._acquire.__aexit__(exc_type, exc, tb)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve /metrics on its own port (polling mode and supervisor workers)"""
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
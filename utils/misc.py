@@ -1,3 +1,15 @@
 def format_price(price):
     """Format price with thousand separators"""
     return f"{price:,.0f}".replace(",", " ")
+
+def parse_page_callback(data):
+    """Parse "<prefix>:next:<id>" / "<prefix>:prev:<id>" into (after_id, before_id)"""
+    _, direction, anchor = data.split(':')
+    if direction == 'prev':
+        return 0, int(anchor)
+    return int(anchor), None
+
+def parse_quantity_callback(data, max_quantity):
+    """Parse "<prefix>:<product id>:<quantity>" into (product_id, quantity), quantity clamped to 1..max_quantity"""
+    _, product_id, quantity = data.split(':')
+    return int(product_id), min(max(int(quantity), 1), max_quantity)
@@ -0,0 +1,116 @@
+"""Printable PDF receipts without third-party libraries.
+
+Receipts are laid out as monospaced text on pages the width of an 80 mm
+till roll and written with the standard Courier font, which every PDF
+viewer has, so nothing is embedded. Standard fonts only cover Latin
+letters: Cyrillic names are transliterated to the Uzbek Latin alphabet.
+
+Runs in receipt worker processes (see receipts.py): arguments and result are
+plain picklable values and nothing here touches the bot or the database.
+"""
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Sequence, Tuple
+
+from utils.misc import format_price
+from utils.search import to_latin
+
+# 80 mm roll, in points
+PAGE_WIDTH = 226.77
+MARGIN = 12
+FONT_SIZE = 8.5
+LEADING = 11
+# Courier glyphs are 0.6 em wide
+LINE_CHARS = int((PAGE_WIDTH - 2 * MARGIN) / (FONT_SIZE * 0.6))
+# Lines per page, keeps pages within the PDF size limit for long orders
+PAGE_LINES = 200
+
+# Uzbek apostrophes have no glyph in the standard fonts
+_APOSTROPHES = str.maketrans({'ʻ': "'", 'ʼ': "'", '‘': "'", '’': "'", '`': "'"})
+
+Item = Tuple[str, Decimal, int]
+
+
+def receipt_lines(order_id: int, created_at: datetime, total: Decimal, items: Sequence[Item], customer: str) -> List[str]:
+    """The receipt as lines of at most LINE_CHARS characters, in Latin script"""
+    rule = '-' * LINE_CHARS
+    lines = [
+        "KORZINKA".center(LINE_CHARS),
+        "SAVDO CHEKI".center(LINE_CHARS),
+        rule,
+        f"Buyurtma: #{order_id}",
+        f"Sana: {created_at.strftime('%Y-%m-%d %H:%M')}",
+        *_wrap(f"Mijoz: {to_latin(customer)}"),
+        rule
+    ]
+    for i, (name, price, quantity) in enumerate(items, 1):
+        lines.extend(_wrap(f"{i}. {to_latin(name)}"))
+        lines.append(_columns(f"   {quantity} x {format_price(price)}", format_price(price * quantity)))
+    lines.extend([
+        rule,
+        _columns("JAMI:", f"{format_price(total)} so'm"),
+        rule,
+        "Xaridingiz uchun rahmat!".center(LINE_CHARS)
+    ])
+    return lines
+
+
+def render_receipt_pdf(order_id: int, created_at: datetime, total: Decimal, items: Sequence[Item], customer: str) -> bytes:
+    """Receipt of a placed order as a PDF document"""
+    lines = [_pdf_string(line) for line in receipt_lines(order_id, created_at, total, items, customer)]
+    pages = [lines[start:start + PAGE_LINES] for start in range(0, len(lines), PAGE_LINES)]
+
+    # 1 catalog, 2 page tree, 3 font, then a page and its content per page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(len(pages)))
+        + b"] /Count %d >>" % len(pages),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"
+    ]
+    for i, page in enumerate(pages):
+        height = 2 * MARGIN + len(page) * LEADING
+        content = zlib.compress(
+            b"BT /F1 %.1f Tf %d TL %d %.2f Td\n" % (FONT_SIZE, LEADING, MARGIN, height - MARGIN - FONT_SIZE)
+            + b"".join(b"(" + line + b") Tj T*\n" for line in page)
+            + b"ET"
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %d] " % (PAGE_WIDTH, height)
+            + b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objects.append(
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream"
+        )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _wrap(text: str) -> List[str]:
+    """Cut a line into LINE_CHARS pieces, continuation lines indented"""
+    lines = [text[:LINE_CHARS]]
+    rest = text[LINE_CHARS:].lstrip()
+    while rest:
+        lines.append("   " + rest[:LINE_CHARS - 3])
+        rest = rest[LINE_CHARS - 3:].lstrip()
+    return lines
+
+
+def _columns(left: str, right: str) -> str:
+    """Left text and a right-aligned amount on one line"""
+    return left[:LINE_CHARS - len(right) - 1].ljust(LINE_CHARS - len(right)) + right
+
+
+def _pdf_string(text: str) -> bytes:
+    """Text as the inside of a PDF literal string in WinAnsiEncoding"""
+    data = text.translate(_APOSTROPHES).encode('cp1252', errors='replace')
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
@@ -0,0 +1,123 @@
+import html
+from typing import Any, Dict, List, Optional
+
+from aiogram.types import Message
+
+from utils.misc import format_price
+
+# Telegram's limit for one text message, in UTF-16 code units
+MAX_MESSAGE_LENGTH = 4096
+
+
+def _length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def split_blocks(blocks: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Pack text blocks into as few messages as fit under the limit.
+
+    A block is never split unless it alone exceeds the limit.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for block in _fit_blocks(blocks, limit):
+        length = _length(block)
+        if size + length > limit and current:
+            chunks.append(''.join(current))
+            current, size = [], 0
+        current.append(block)
+        size += length
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def _fit_blocks(blocks: List[str], limit: int):
+    """Cut blocks longer than the limit into pieces"""
+    # Half the limit in code points never exceeds the limit in UTF-16 units
+    step = limit // 2
+    for block in blocks:
+        if _length(block) <= limit:
+            yield block
+        else:
+            for start in range(0, len(block), step):
+                yield block[start:start + step]
+
+
+def _item_blocks(items: List[Dict[str, Any]]):
+    """One block per item and the total, computed in the same pass"""
+    blocks = []
+    total = 0
+    for i, item in enumerate(items, 1):
+        price = item['price']
+        quantity = item['quantity']
+        subtotal = price * quantity
+        total += subtotal
+        blocks.append(
+            f"{i}. {html.escape(item['name'])} - {quantity} dona\n"
+            f"   {format_price(price)} x {quantity} = {format_price(subtotal)} so'm\n\n"
+        )
+    return blocks, total
+
+
+def render_cart(items: List[Dict[str, Any]]) -> List[str]:
+    """Cart contents as one or more message texts"""
+    blocks, total = _item_blocks(items)
+    blocks.insert(0, "🧺 Savatingizdagi mahsulotlar:\n\n")
+    blocks.append(f"\n💰 Jami: {format_price(total)} so'm")
+    return split_blocks(blocks)
+
+
+def render_receipt(order: Dict[str, Any], customer: str) -> List[str]:
+    """Receipt of a placed order as one or more message texts"""
+    blocks, _ = _item_blocks(order['items'])
+    blocks.insert(0, (
+        "🧾 CHEK 🧾\n\n"
+        f"Buyurtma: #{order['id']}\n"
+        f"Mijoz: {html.escape(customer)}\n"
+        f"Sana: {order['created_at'].strftime('%Y-%m-%d %H:%M')}\n\n"
+        "Mahsulotlar:\n"
+    ))
+    blocks.append(
+        f"\n💰 Jami: {format_price(order['total'])} so'm\n"
+        "\nXaridingiz uchun rahmat!\n"
+        "Boshqa mahsulotlar xarid qilishni xohlaysizmi?"
+    )
+    return split_blocks(blocks)
+
+
+def render_order(order: Dict[str, Any]) -> List[str]:
+    """A past order from the history as one or more message texts"""
+    blocks, _ = _item_blocks(order['items'])
+    blocks.insert(0, (
+        f"🧾 Buyurtma #{order['id']}\n"
+        f"Sana: {order['created_at'].strftime('%Y-%m-%d %H:%M')}\n\n"
+        "Mahsulotlar:\n"
+    ))
+    blocks.append(f"\n💰 Jami: {format_price(order['total'])} so'm")
+    return split_blocks(blocks)
+
+
+def render_categories(outline) -> List[str]:
+    """Category tree for admins, one indented line per category with its id and product count"""
+    blocks = ["🗂 Kategoriyalar (id, mahsulotlar soni):\n\n"]
+    blocks.extend(
+        f"{'    ' * depth}#{category['id']} {html.escape(category['name'])} ({count})\n"
+        for depth, category, count in outline
+    )
+    if len(blocks) == 1:
+        blocks.append("Hozircha kategoriyalar yo'q.\n")
+    blocks.append(
+        "\n/addcategory &lt;ota id yoki 0&gt; &lt;nomi&gt; - qo'shish\n"
+        "/renamecategory &lt;id&gt; &lt;nomi&gt; - nomini o'zgartirish\n"
+        "/delcategory &lt;id&gt; - o'chirish (ichidagilar ota kategoriyaga o'tadi)"
+    )
+    return split_blocks(blocks)
+
+
+async def answer_chunks(message: Message, chunks: List[str], reply_markup: Optional[Any] = None) -> None:
+    """Send chunks as consecutive messages, the keyboard goes on the last one"""
+    for chunk in chunks[:-1]:
+        await message.answer(chunk)
+    await message.answer(chunks[-1], reply_markup=reply_markup)
@@ -0,0 +1,169 @@
+import re
+from typing import Any, Dict, List, Optional, Set
+
+# Uzbek Cyrillic to the official Latin alphabet (lowercase, case is restored by to_latin)
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ғ': 'gʻ', 'д': 'd', 'е': 'e',
+    'ё': 'yo', 'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'қ': 'q',
+    'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's',
+    'т': 't', 'у': 'u', 'ў': 'oʻ', 'ф': 'f', 'х': 'x', 'ҳ': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': 'ʼ', 'ь': '', 'ы': 'i', 'э': 'e',
+    'ю': 'yu', 'я': 'ya'
+}
+
+# Apostrophe look-alikes used in oʻ, gʻ and the tutuq belgisi
+APOSTROPHES = "'`ʻʼ‘’"
+
+# Word prefixes longer than this are checked against the word itself
+MAX_PREFIX = 8
+
+# Share of query trigrams a fuzzy match must contain
+MIN_TRIGRAM_SCORE = 0.3
+
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def to_latin(text: str) -> str:
+    """Transliterate Uzbek Cyrillic to Latin, keeping case and punctuation"""
+    result = []
+    for char in text:
+        latin = CYRILLIC_TO_LATIN.get(char.lower())
+        if latin is None:
+            result.append(char)
+        elif char.isupper():
+            result.append(latin.capitalize())
+        else:
+            result.append(latin)
+    return ''.join(result)
+
+
+def normalize(text: str) -> str:
+    """Search form of a text: lowercase Latin words without apostrophes.
+
+    "Ўзбек гўшти", "O‘zbek go'shti" and "ozbek goshti" all become
+    "ozbek goshti".
+    """
+    text = to_latin(text.lower())
+    for apostrophe in APOSTROPHES:
+        text = text.replace(apostrophe, '')
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def _trigrams(word: str) -> Set[str]:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductIndex:
+    """In-memory prefix and trigram index over product names.
+
+    Queries whose words are all word prefixes of a name rank first, then
+    names sharing enough trigrams with the query (typos, missing letters).
+    ``version`` is the catalog version the index reflects. ``apply`` keeps
+    it in step with single product writes, anything else needs ``rebuild``.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self._products: Dict[int, Dict[str, Any]] = {}
+        self._words: Dict[int, List[str]] = {}
+        self._prefixes: Dict[str, Set[int]] = {}
+        self._trigrams: Dict[str, Set[int]] = {}
+
+    def rebuild(self, products: List[Dict[str, Any]], version: int) -> None:
+        self._products = {}
+        self._words = {}
+        self._prefixes = {}
+        self._trigrams = {}
+        for product in products:
+            self._add(product)
+        self.version = version
+
+    def apply(self, version: int, product: Optional[Dict[str, Any]] = None, removed_id: Optional[int] = None) -> None:
+        """Apply one catalog write that produced ``version``.
+
+        Only done when the index is exactly one version behind; otherwise it
+        stays stale and the next search rebuilds it.
+        """
+        if self.version != version - 1:
+            return
+        if removed_id is not None:
+            self._remove(removed_id)
+        if product is not None:
+            self._remove(product['id'])
+            self._add(product)
+        self.version = version
+
+    def _add(self, product: Dict[str, Any]) -> None:
+        product_id = product['id']
+        words = normalize(product['name']).split()
+        self._products[product_id] = product
+        self._words[product_id] = words
+        for word in words:
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                self._prefixes.setdefault(word[:length], set()).add(product_id)
+            for trigram in _trigrams(word):
+                self._trigrams.setdefault(trigram, set()).add(product_id)
+
+    def _remove(self, product_id: int) -> None:
+        words = self._words.pop(product_id, None)
+        if words is None:
+            return
+        del self._products[product_id]
+        for word in words:
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                self._discard(self._prefixes, word[:length], product_id)
+            for trigram in _trigrams(word):
+                self._discard(self._trigrams, trigram, product_id)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[int]], key: str, product_id: int) -> None:
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del index[key]
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """Best matching products for a query, at most ``limit``"""
+        tokens = normalize(query).split()
+        if not tokens:
+            return []
+
+        matches = self._prefix_matches(tokens)
+        ranked = sorted(matches, key=lambda pid: (len(self._products[pid]['name']), pid))
+
+        if len(ranked) < limit:
+            ranked.extend(self._fuzzy_matches(tokens, exclude=matches))
+
+        return [self._products[pid] for pid in ranked[:limit]]
+
+    def _prefix_matches(self, tokens: List[str]) -> Set[int]:
+        result = None
+        for token in tokens:
+            ids = self._prefixes.get(token[:MAX_PREFIX], set())
+            if len(token) > MAX_PREFIX:
+                ids = {pid for pid in ids if any(w.startswith(token) for w in self._words[pid])}
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return set(result)
+
+    def _fuzzy_matches(self, tokens: List[str], exclude: Set[int]) -> List[int]:
+        query_trigrams = set()
+        for token in tokens:
+            query_trigrams |= _trigrams(token)
+
+        hits: Dict[int, int] = {}
+        for trigram in query_trigrams:
+            for pid in self._trigrams.get(trigram, ()):
+                hits[pid] = hits.get(pid, 0) + 1
+
+        threshold = MIN_TRIGRAM_SCORE * len(query_trigrams)
+        scored = [(count, pid) for pid, count in hits.items() if count >= threshold and pid not in exclude]
+        scored.sort(key=lambda item: (-item[0], len(self._products[item[1]]['name']), item[1]))
+        return [pid for _, pid in scored]
+
+
+# Shared product index for this process
+product_index = ProductIndex()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_MAX_CONCURRENCY,
+    METRICS_ENABLED
+)
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Header Telegram uses to send the secret token given to setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Telegram user id behind a raw update, without parsing it into models"""
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from'].get('id')
+    return None
+
+
+class UpdateFeeder:
+    """Feed raw updates to the dispatcher in background tasks.
+
+    At most ``max_concurrency`` updates are processed at once. When all slots
+    are busy ``submit`` waits for one, which delays the HTTP answer and lets
+    Telegram throttle delivery instead of us queueing without bound.
+    Updates of the same user are processed one after another, in the order
+    they were submitted, so FSM flows never see their steps reordered.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        # Last submitted task per user, the next update of that user waits for it
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    async def submit(self, update: Dict[str, Any]) -> None:
+        await self._slots.acquire()
+        user_id = update_user_id(update)
+        previous = self._tails.get(user_id) if user_id is not None else None
+        task = asyncio.create_task(self._process(update, previous))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if user_id is not None:
+            self._tails[user_id] = task
+            task.add_done_callback(lambda done: self._forget(user_id, done))
+
+    def _forget(self, user_id: int, task: asyncio.Task) -> None:
+        if self._tails.get(user_id) is task:
+            del self._tails[user_id]
+
+    async def _process(self, update: Dict[str, Any], previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Error processing update {update.get('update_id')}: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self) -> None:
+        """Wait for updates that are still being processed"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_app(feeder: UpdateFeeder) -> web.Application:
+    """aiohttp application that accepts updates on WEBHOOK_PATH (and serves /metrics)"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        await feeder.submit(await request.json())
+        # Answer right away, the update is handled in the background
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    if METRICS_ENABLED:
+        app.router.add_get('/metrics', metrics.handle_metrics)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, feeder=None) -> None:
+    """Register the webhook with Telegram and serve updates until cancelled.
+
+    Updates go to ``feeder.submit``, by default an ``UpdateFeeder`` running
+    them on this process' dispatcher.
+    """
+    if feeder is None:
+        feeder = UpdateFeeder(dp, bot)
+    runner = web.AppRunner(create_app(feeder))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await feeder.drain()
+        await bot.session.close()